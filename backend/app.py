@@ -1,28 +1,205 @@
-from flask import Flask, jsonify, request
+import contextlib
+import threading
+import time
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
-import pandas as pd
-from langchain_agentic import check
-from research_agent import suggest_alternatives
+import http_client
+import metrics
+import prescreen
+import singleflight
+import langchain_agentic
+import research_agent
+from langchain_agentic import check, check_many, label_cache, stream_check
+from research_agent import stream_alternatives, suggest_alternatives
+from streaming import sse
+from patients import SEARCH_FIELDS, PatientStore
+from jobs import JobQueue, QueueFull, job_key
+from prefetch import LabelPrefetcher
+from tokens import count_tokens
+
+# Upper bound on drugs screened by one /api/compatibility/batch request
+MAX_BATCH_DRUGS = int(os.environ.get('COMPAT_BATCH_MAX_DRUGS', 25))
+
+def as_list(qval):
+    """
+    Convert a comma-separated query string (or a JSON list) to a clean list.
+    Handles empty/missing values gracefully.
+    """
+    if not qval:
+        return []
+    if isinstance(qval, list):
+        return [str(part).strip() for part in qval if str(part).strip()]
+    # Split on commas, strip whitespace, drop empties
+    return [part.strip() for part in qval.split(',') if part.strip()]
+
+def _event_stream(events, error_message):
+    """Serve (event, data) pairs as text/event-stream; failures become an 'error' event."""
+    # Set by the ASGI entry point when the client disconnects
+    disconnected = request.environ.get('asgi.scope', {}).get('disconnected')
+
+    def generate():
+        try:
+            for event, data in events:
+                if disconnected is not None and disconnected.is_set():
+                    return
+                yield sse(event, data)
+        except Exception as e:
+            yield sse('error', {'error': error_message, 'details': str(e)})
+        yield sse('done', {})
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def label_index_stats():
+    """Offline label index counters, or None when no index has been built."""
+    index = langchain_agentic.label_index.get()
+    return index.stats() if index is not None else None
+
+def warm_up(stores=True):
+    """
+    Do the slow first-use work ahead of traffic: import LangChain, build both
+    chains and their OpenAI clients, open the article store and label index
+    (with stores=False, only import their modules) and load the tokenizer.
+    """
+    langchain_agentic.warmup(stores)
+    research_agent.warmup(stores)
+    count_tokens('warm-up')
 
 def create_app():
     app = Flask(__name__)
     
     # Enable CORS for all routes
-    CORS(app)
+    CORS(app, expose_headers=['X-Result-Cache', 'Server-Timing', 'X-Label-Prefetch'])
     
     # Basic configuration
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
-    #load in mastercsv
+    #load in mastercsv (indexed by Patient_ID, reloaded when the file changes).
+    # Loaded here, whatever WARMUP says, so under gunicorn --preload the
+    # workers fork with it built instead of each parsing the CSV on first use
     user_path_info = os.path.join(os.path.dirname(__file__), 'patientData.csv')
-    try:
-        user_info_df = pd.read_csv(user_path_info)
-        print(f"The user data loading worked {user_path_info}")
-    except FileNotFoundError:
-        print(f"We have an issue, the user data CSV was not found at {user_path_info}. Our user endpoint fails.")
-        user_info_df = pd.DataFrame()
+    patient_store = PatientStore(user_path_info)
+    patient_store.snapshot()
+    app.extensions['patient_store'] = patient_store
+
+    # Research jobs (POST /api/research/jobs): a bounded pool per worker,
+    # records shared through SQLite so any worker can answer the poll.
+    # Set RESEARCH_JOB_PATH to an empty string to keep them in memory.
+    research_jobs = JobQueue(
+        'research',
+        workers=int(os.environ.get('RESEARCH_JOB_WORKERS', 4)),
+        max_pending=int(os.environ.get('RESEARCH_JOB_MAX_PENDING', 64)),
+        ttl=float(os.environ.get('RESEARCH_JOB_TTL', 600)),
+        heartbeat=float(os.environ.get('RESEARCH_JOB_HEARTBEAT', 5)),
+        stale_after=float(os.environ.get('RESEARCH_JOB_STALE_AFTER', 30)),
+        path=os.environ.get(
+            'RESEARCH_JOB_PATH',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'jobs.sqlite3'),
+        ),
+    )
+    app.extensions['research_jobs'] = research_jobs
+    # Wraps the LLM work of each job; the ASGI entry point swaps in its shared limiter
+    app.extensions['llm_slot'] = contextlib.nullcontext
+
+    # Label prefetch on /api/user: with ?prefetch=1, or on every lookup when
+    # LABEL_PREFETCH=true, the patient's medications (and common companions)
+    # are fetched into the label cache in the background.
+    prefetch_default = os.environ.get('LABEL_PREFETCH', 'False').lower() == 'true'
+    label_prefetcher = LabelPrefetcher(
+        langchain_agentic.fetch_warn_prec,
+        langchain_agentic.label_cached,
+        workers=int(os.environ.get('LABEL_PREFETCH_WORKERS', 2)),
+        rate=float(os.environ.get('LABEL_PREFETCH_RATE', 2)),
+        max_pending=int(os.environ.get('LABEL_PREFETCH_MAX_PENDING', 64)),
+        co_prescribed=int(os.environ.get('LABEL_PREFETCH_COMPANIONS', 2)),
+    )
+    app.extensions['label_prefetcher'] = label_prefetcher
+
+    # Warm-up: "background" (default) runs it in a thread so /health answers
+    # at once; "eager" finishes it before create_app returns (use with
+    # gunicorn --preload so forked workers start warm); "off" leaves it to
+    # the first requests. /ready reports when the chains are built. Eager
+    # warm-up builds only in-memory objects: a database handle opened in the
+    # gunicorn master would be inherited by every worker, so each worker
+    # opens its own on first use.
+    # The background thread starts with the first request in each process,
+    # never in create_app: under --preload a thread running at fork time could
+    # leave a Lazy lock held forever in the worker.
+    warmup_mode = os.environ.get('WARMUP', 'background').lower()
+    warmup_state = {'status': 'pending', 'seconds': None, 'error': None}
+    warmup_started = {'pid': None}
+    warmup_lock = threading.Lock()
+
+    def run_warm_up(stores=True):
+        start = time.perf_counter()
+        warmup_state['status'] = 'running'
+        try:
+            warm_up(stores)
+            warmup_state['status'] = 'done'
+        except Exception as e:
+            print(f"Warm-up failed, components will load on first use: {e}")
+            warmup_state.update(status='failed', error=str(e))
+        warmup_state['seconds'] = round(time.perf_counter() - start, 3)
+
+    def start_warm_up():
+        """Start the background warm-up once in this process."""
+        if warmup_mode != 'background' or warmup_started['pid'] == os.getpid():
+            return
+        with warmup_lock:
+            if warmup_started['pid'] == os.getpid():
+                return
+            warmup_started['pid'] = os.getpid()
+        threading.Thread(target=run_warm_up, name='warm-up', daemon=True).start()
+
+    app.extensions['start_warm_up'] = start_warm_up
+    if warmup_mode == 'eager':
+        run_warm_up(stores=False)
+
+    # Per-request timing: histograms always, Server-Timing header on request
+    # (X-Debug-Timing: 1 or ?timing=1, or always with TIMING_HEADER=true)
+    timing_header_default = os.environ.get('TIMING_HEADER', 'False').lower() == 'true'
+
+    metrics.register_stats('label_cache', 'cache', lambda: {label_cache.name: label_cache.stats()})
+    metrics.register_stats('llm_cache', 'chain', lambda: {
+        'compatibility': langchain_agentic.result_cache.stats(),
+        'research': research_agent.result_cache.stats()
+    })
+    metrics.register_stats('http_client', 'upstream', http_client.stats)
+    metrics.register_stats('prescreen', 'check', lambda: {'compatibility': prescreen.stats()})
+    metrics.register_stats('singleflight', 'group', singleflight.stats)
+    metrics.register_stats('prefetch', 'kind', lambda: {'label': label_prefetcher.stats()})
+    metrics.register_stats('jobs', 'queue', lambda: {'research': research_jobs.stats()})
+    metrics.register_stats('label_index', 'index', lambda: {'openfda': label_index_stats() or {}})
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        metrics.begin_request()
+        start_warm_up()
+
+    @app.after_request
+    def record_timing(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        if not response.is_streamed and response.content_length is not None:
+            metrics.response_bytes.observe(response.content_length, endpoint=endpoint)
+        if timing_header_default or request.headers.get('X-Debug-Timing') == '1' or request.args.get('timing') == '1':
+            timings = metrics.breakdown() + [('total', elapsed)]
+            response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+        return response
+
+    # Prometheus scrape endpoint
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
     # Health check endpoint
     @app.route('/health', methods=['GET'])
@@ -31,6 +208,23 @@ def create_app():
             'status': 'healthy',
             'message': 'Flask backend is running!'
         }), 200
+
+    # Readiness probe: 503 until both LLM chains are built
+    @app.route('/ready', methods=['GET'])
+    def readiness_check():
+        components = {
+            'compatibility_chain': langchain_agentic.chains.ready,
+            'research_chain': research_agent.chains.ready
+        }
+        ready = all(components.values())
+        body = jsonify({
+            'status': 'ready' if ready else 'warming',
+            'components': components,
+            'warmup': {'mode': warmup_mode, **warmup_state}
+        })
+        if ready:
+            return body, 200
+        return body, 503, {'Retry-After': '1'}
     
     # Basic API routes
     @app.route('/api', methods=['GET'])
@@ -40,11 +234,34 @@ def create_app():
             'version': '1.0.0',
             'endpoints': [
                 '/health - Health check',
+                '/ready - Readiness check (LLM chains warm)',
                 '/api - API information',
-                '/api/data - Sample data endpoint'
+                '/api/data - Sample data endpoint',
+                '/api/stats - Cache statistics',
+                '/api/patients/search - Patients by allergy, condition and medication',
+                '/api/research/jobs - Queue a research request (POST), poll /api/research/jobs/<id>',
+                '/metrics - Prometheus metrics'
             ]
         }), 200
     
+    # Cache statistics
+    @app.route('/api/stats', methods=['GET'])
+    def stats():
+        return jsonify({
+            'ok': True,
+            'label_cache': label_cache.stats(),
+            'label_index': label_index_stats(),
+            'upstreams': http_client.stats(),
+            'prescreen': prescreen.stats(),
+            'coalescing': singleflight.stats(),
+            'prefetch': label_prefetcher.stats(),
+            'jobs': {'research': research_jobs.stats()},
+            'llm_cache': {
+                'compatibility': langchain_agentic.result_cache.stats(),
+                'research': research_agent.result_cache.stats()
+            }
+        }), 200
+
     # Sample data endpoint
     @app.route('/api/data', methods=['GET'])
     def get_data():
@@ -75,44 +292,81 @@ def create_app():
         return jsonify(response_data), 201
     @app.route('/api/compatibility', methods=['GET']) 
     def compatibility_check():
-        def _as_list(qval):
-            """
-            Convert a comma-separated query string to a clean list.
-            Handles empty/missing values gracefully.
-            """
-            if not qval:
-                return []
-            # Split on commas, strip whitespace, drop empties
-            return [part.strip() for part in qval.split(',') if part.strip()]
+        drug = request.args.get('drug', '').strip()
+        if not drug:
+            return jsonify({'error': "Missing required query parameter 'drug'"}), 400
+
+        allergies = as_list(request.args.get('allergies', ''))
+        conditions = as_list(request.args.get('conditions', ''))
+        ongoing_meds = as_list(request.args.get('ongoingMeds', ''))
+
+        return _compatibility_response(drug, allergies, conditions, ongoing_meds)
+
+    @app.route('/api/compatibility/stream', methods=['GET'])
+    def compatibility_stream():
+        """
+        Server-Sent Events version of /api/compatibility (same query params).
+        Events: stage, verdict, reason, evidence, result, error, done.
+        """
+        drug = request.args.get('drug', '').strip()
+        if not drug:
+            return jsonify({'error': "Missing required query parameter 'drug'"}), 400
+
+        events = stream_check(
+            drug=drug,
+            allergies=as_list(request.args.get('allergies', '')),
+            conditions=as_list(request.args.get('conditions', '')),
+            ongoingMeds=as_list(request.args.get('ongoingMeds', ''))
+        )
+        return _event_stream(events, 'Failed to compute compatibility')
 
+    @app.route('/api/patients/<int:patient_id>/compatibility', methods=['GET'])
+    def patient_compatibility_check(patient_id):
+        """
+        Compatibility check against a patient resolved server-side.
+        Example: /api/patients/2/compatibility?drug=aspirin
+        """
         drug = request.args.get('drug', '').strip()
         if not drug:
             return jsonify({'error': "Missing required query parameter 'drug'"}), 400
 
-        allergies = _as_list(request.args.get('allergies', ''))
-        conditions = _as_list(request.args.get('conditions', ''))
-        ongoing_meds = _as_list(request.args.get('ongoingMeds', ''))
+        profile = patient_store.profile(patient_id)
+        if profile is None:
+            return jsonify({'ok': False, 'error': f'User with id "{patient_id}" not found'}), 404
+
+        return _compatibility_response(
+            drug,
+            profile.allergies,
+            profile.conditions,
+            profile.ongoing_meds,
+            patient_id=patient_id
+        )
 
+    def _compatibility_response(drug, allergies, conditions, ongoing_meds, **extra_input):
         try:
             # Call your LangChain pipeline (returns a Pydantic model)
+            meta = {}
             result = check(
                 drug=drug,
                 allergies=allergies,
                 conditions=conditions,
-                ongoingMeds=ongoing_meds
+                ongoingMeds=ongoing_meds,
+                meta=meta
             )
             # Pydantic -> dict for JSON response
             payload = result.model_dump()
             return jsonify({
                 'ok': True,
                 'input': {
+                    **extra_input,
                     'drug': drug,
                     'allergies': allergies,
                     'conditions': conditions,
                     'ongoingMeds': ongoing_meds
                 },
-                'result': payload
-            }), 200
+                'result': payload,
+                'meta': meta
+            }), 200, {'X-Result-Cache': 'HIT' if meta.get('cached') else 'MISS'}
 
         except Exception as e:
             # Log the exception server-side if you like
@@ -122,6 +376,65 @@ def create_app():
                 'error': 'Failed to compute compatibility',
                 'details': str(e)
             }), 500    
+
+    @app.route('/api/compatibility/batch', methods=['POST'])
+    def compatibility_batch():
+        """
+        Screen several candidate drugs against one patient.
+        Body: {"drugs": [...], "allergies": [...], "conditions": [...], "ongoingMeds": [...]}
+        Each drug gets its own ok/result or ok/error entry.
+        """
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        drugs = as_list(data.get('drugs'))
+        if not drugs:
+            return jsonify({'error': "Missing required field 'drugs'"}), 400
+        if len(drugs) > MAX_BATCH_DRUGS:
+            return jsonify({'error': f"At most {MAX_BATCH_DRUGS} drugs per batch"}), 400
+
+        allergies = as_list(data.get('allergies'))
+        conditions = as_list(data.get('conditions'))
+        ongoing_meds = as_list(data.get('ongoingMeds'))
+
+        try:
+            outcomes = check_many(
+                drugs,
+                allergies=allergies,
+                conditions=conditions,
+                ongoingMeds=ongoing_meds
+            )
+        except Exception as e:
+            return jsonify({
+                'ok': False,
+                'error': 'Failed to compute compatibility',
+                'details': str(e)
+            }), 500
+
+        results = []
+        for drug, (outcome, meta) in zip(drugs, outcomes):
+            if isinstance(outcome, Exception):
+                results.append({
+                    'drug': drug,
+                    'ok': False,
+                    'error': 'Failed to compute compatibility',
+                    'details': str(outcome)
+                })
+            else:
+                results.append({'drug': drug, 'ok': True, 'result': outcome.model_dump(), 'meta': meta})
+
+        return jsonify({
+            'ok': True,
+            'input': {
+                'drugs': drugs,
+                'allergies': allergies,
+                'conditions': conditions,
+                'ongoingMeds': ongoing_meds
+            },
+            'results': results,
+            'failed': sum(1 for r in results if not r['ok'])
+        }), 200
     # Error handlers
 
     @app.route('/api/research', methods=['GET']) 
@@ -133,10 +446,12 @@ def create_app():
         search_hint = request.args.get('search_hint', '').strip()
         try:
             # Call your LangChain pipeline (returns a Pydantic model)
+            meta = {}
             result = suggest_alternatives(
                 issue=issue,
                 current_option=current_option,
                 search_hint=search_hint,
+                meta=meta
             )
             # Pydantic -> dict for JSON response
             payload = result.model_dump()
@@ -147,8 +462,9 @@ def create_app():
                     'current_option': current_option,
                     'search_hint': search_hint,
                 },
-                'result': payload
-            }), 200
+                'result': payload,
+                'meta': meta
+            }), 200, {'X-Result-Cache': 'HIT' if meta.get('cached') else 'MISS'}
         except Exception as e:
             # Log the exception server-side if you like
             # import traceback; traceback.print_exc()
@@ -159,6 +475,71 @@ def create_app():
             }), 500    
     # Error handlers
 
+    @app.route('/api/research/stream', methods=['GET'])
+    def research_stream():
+        """
+        Server-Sent Events version of /api/research (same query params).
+        Events: stage, alternative, result, error, done.
+        """
+        current_option = request.args.get('current_option', '').strip()
+        if not current_option:
+            return jsonify({'error': "Missing required query parameter 'current_option'"}), 400
+
+        events = stream_alternatives(
+            issue=request.args.get('issue', '').strip(),
+            current_option=current_option,
+            search_hint=request.args.get('search_hint', '').strip(),
+        )
+        return _event_stream(events, 'Failed to parse through pubmed accurately')
+
+    @app.route('/api/research/jobs', methods=['POST'])
+    def research_job_submit():
+        """
+        Queue a research request and return at once with a job id; poll
+        GET /api/research/jobs/<id> for the result. Takes the /api/research
+        params as a JSON body (or query string). An identical request that
+        is still queued or running is joined instead of started again.
+        """
+        data = request.get_json(silent=True) or request.args
+        current_option = str(data.get('current_option') or '').strip()
+        if not current_option:
+            return jsonify({'error': "Missing required field 'current_option'"}), 400
+        inputs = {
+            'issue': str(data.get('issue') or '').strip(),
+            'current_option': current_option,
+            'search_hint': str(data.get('search_hint') or '').strip(),
+        }
+
+        def run(meta):
+            with app.extensions['llm_slot']():
+                return suggest_alternatives(meta=meta, **inputs).model_dump()
+
+        try:
+            job, attached = research_jobs.submit(job_key('research', inputs), inputs, run)
+        except QueueFull as e:
+            return jsonify({'ok': False, 'error': 'Research queue is full, retry shortly', 'details': str(e)}), 503, {
+                'Retry-After': '5'
+            }
+        location = f"/api/research/jobs/{job['id']}"
+        return jsonify({'ok': True, 'job': job, 'attached': attached, 'poll': location}), 202, {'Location': location}
+
+    @app.route('/api/research/jobs/<job_id>', methods=['GET'])
+    def research_job_status(job_id):
+        """Job record: status queued/running/done/failed, plus result and meta once finished."""
+        job = research_jobs.get(job_id)
+        if job is None:
+            return jsonify({'ok': False, 'error': f'Job "{job_id}" not found or expired'}), 404
+        if job['status'] == 'failed':
+            return jsonify({
+                'ok': False,
+                'error': 'Failed to parse through pubmed accurately',
+                'details': job.get('error'),
+                'job': job
+            }), 200
+        if job['status'] != 'done':
+            return jsonify({'ok': True, 'job': job}), 200, {'Retry-After': '1'}
+        return jsonify({'ok': True, 'job': job}), 200
+
     #user api
     @app.route('/api/user', methods=['GET']) 
     def user_grab():  
@@ -166,23 +547,71 @@ def create_app():
         Obtains the user identification, userID
         Performs a quick lookup in the mastercsv file
         Example: /api/user?id=1
+        With prefetch=1 the patient's medication labels are warmed in the background
         """
         user_id = request.args.get('id', '').strip()
         if not user_id:
             return jsonify({'ok': False, 'error': "Missing required query parameter 'id'"}), 400
-        #if for some reason df is empty
-        if user_info_df.empty:
+        #if for some reason the csv is missing
+        if not patient_store.loaded:
             return jsonify({'ok': False, 'error': 'User data is not loaded on the server.'}), 500
-        #print(user_id)
-        #access the row given the requested userID
-        obtained_df = user_info_df[user_info_df['Patient_ID'] == int(user_id)]
-        if not obtained_df.empty:
-                user_data = obtained_df.to_dict('records')[0]
-                return jsonify({'ok': True, 'user': user_data}), 200
+        try:
+            patient_id = int(user_id)
+        except ValueError:
+            return jsonify({'ok': False, 'error': f'Invalid user id "{user_id}"'}), 400
+        #row json is serialized once at load time
+        user_json = patient_store.user_json(patient_id)
+        if user_json is not None:
+                body = b'{"ok":true,"user":' + user_json + b'}'
+                response = app.response_class(body, status=200, mimetype='application/json')
+                prefetch = request.args.get('prefetch')
+                if prefetch == '1' or (prefetch is None and prefetch_default):
+                    profile = patient_store.profile(patient_id)
+                    if profile is not None:
+                        queued = label_prefetcher.schedule(profile.medication_keys)
+                        response.headers['X-Label-Prefetch'] = str(queued['scheduled'])
+                return response
         else:
                 return jsonify({'ok': False, 'error': f'User with id "{user_id}" not found'}), 404
 
 
+    @app.route('/api/patients/search', methods=['GET'])
+    def patient_search():
+        """
+        Patients by allergy, condition and medication, from inverted indexes
+        built when patientData.csv is loaded.
+        Example: /api/patients/search?condition=Childhood asthma&medication=budesonide
+        Each of allergy/condition/medication may repeat; match=all (default)
+        requires every term, match=any at least one. Paged with offset/limit.
+        """
+        terms = [(field, value.strip()) for field in SEARCH_FIELDS
+                 for value in request.args.getlist(field) if value.strip()]
+        if not terms:
+            return jsonify({'ok': False, 'error': 'Provide at least one of: ' + ', '.join(SEARCH_FIELDS)}), 400
+        match = request.args.get('match', 'all').strip().lower()
+        if match not in ('all', 'any'):
+            return jsonify({'ok': False, 'error': "match must be 'all' or 'any'"}), 400
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+            limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'offset and limit must be integers'}), 400
+        if not patient_store.loaded:
+            return jsonify({'ok': False, 'error': 'User data is not loaded on the server.'}), 500
+
+        total, page, counts = patient_store.search(terms, match_all=match == 'all', offset=offset, limit=limit)
+        next_offset = offset + len(page)
+        return jsonify({
+            'ok': True,
+            'query': {'terms': [{'field': f, 'term': t} for f, t in terms], 'match': match},
+            'total': total,
+            'counts': counts,
+            'offset': offset,
+            'limit': limit,
+            'next_offset': next_offset if next_offset < total else None,
+            'patients': [p.model_dump() for p in page]
+        }), 200
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({'error': 'Endpoint not found'}), 404
@@ -0,0 +1,133 @@
+"""
+Local SQLite store for PubMed articles (via SQLAlchemy).
+
+Articles are keyed by PMID and hold the bundle entries build_article_bundle
+produces. An FTS5 index over title and abstract serves similar queries
+from disk, and a query -> PMID-list cache with a TTL serves repeat ones.
+"""
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine, event, select, text
+from sqlalchemy.dialects.sqlite import insert
+
+metadata = MetaData()
+
+articles = Table(
+    "articles",
+    metadata,
+    Column("pmid", String, primary_key=True),
+    Column("title", Text),
+    Column("abstract", Text),
+    Column("record", Text, nullable=False),  # JSON bundle entry
+    Column("fetched_at", Float, nullable=False),
+)
+
+query_cache = Table(
+    "query_cache",
+    metadata,
+    Column("query", String, primary_key=True),
+    Column("pmids", Text, nullable=False),  # JSON list, in search order
+    Column("created_at", Float, nullable=False),
+)
+
+_FTS_TOKEN = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+def _fts_query(query: str) -> str:
+    """Free text -> FTS5 OR-query of quoted terms; bm25 ranks the overlap."""
+    terms = {t for t in _FTS_TOKEN.findall(query.casefold()) if len(t) > 2}
+    return " OR ".join(f'"{t}"' for t in sorted(terms))
+
+
+class ArticleStore:
+    def __init__(self, path: str, query_ttl: float = 7 * 24 * 3600):
+        self.query_ttl = query_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 5, "check_same_thread": False})
+
+        @event.listens_for(self.engine, "connect")
+        def _pragmas(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.close()
+
+        metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(pmid UNINDEXED, title, abstract)"
+            ))
+
+    # -----------------------
+    # Articles
+    # -----------------------
+    def put_articles(self, bundle: List[Dict[str, Any]]) -> None:
+        rows = [a for a in bundle if a.get("pmid") and a.get("title")]
+        if not rows:
+            return
+        now = time.time()
+        with self.engine.begin() as conn:
+            for a in rows:
+                stmt = insert(articles).values(
+                    pmid=a["pmid"], title=a["title"], abstract=a.get("abstract") or "",
+                    record=json.dumps(a), fetched_at=now,
+                )
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=["pmid"],
+                    set_={"title": stmt.excluded.title, "abstract": stmt.excluded.abstract,
+                          "record": stmt.excluded.record, "fetched_at": stmt.excluded.fetched_at},
+                ))
+                conn.execute(text("DELETE FROM articles_fts WHERE pmid = :pmid"), {"pmid": a["pmid"]})
+                conn.execute(
+                    text("INSERT INTO articles_fts (pmid, title, abstract) VALUES (:pmid, :title, :abstract)"),
+                    {"pmid": a["pmid"], "title": a["title"], "abstract": a.get("abstract") or ""},
+                )
+
+    def get_articles(self, pmids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not pmids:
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(articles.c.pmid, articles.c.record).where(articles.c.pmid.in_(pmids)))
+            return {pmid: json.loads(record) for pmid, record in rows}
+
+    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Full-text search over stored titles/abstracts, best bm25 match first."""
+        match = _fts_query(query)
+        if not match:
+            return []
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                """SELECT a.record FROM articles_fts f JOIN articles a ON a.pmid = f.pmid
+                   WHERE articles_fts MATCH :match ORDER BY bm25(articles_fts) LIMIT :limit"""
+            ), {"match": match, "limit": limit})
+            return [json.loads(r[0]) for r in rows]
+
+    # -----------------------
+    # Query cache
+    # -----------------------
+    def cached_query(self, query: str, allow_stale: bool = False) -> Optional[List[str]]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(query_cache.c.pmids, query_cache.c.created_at).where(query_cache.c.query == normalize_query(query))
+            ).first()
+        if row is None:
+            return None
+        if not allow_stale and time.time() - row.created_at > self.query_ttl:
+            return None
+        return json.loads(row.pmids)
+
+    def put_query(self, query: str, pmids: List[str]) -> None:
+        stmt = insert(query_cache).values(query=normalize_query(query), pmids=json.dumps(pmids), created_at=time.time())
+        with self.engine.begin() as conn:
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=["query"],
+                set_={"pmids": stmt.excluded.pmids, "created_at": stmt.excluded.created_at},
+            ))
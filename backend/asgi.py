@@ -0,0 +1,401 @@
+"""
+ASGI entry point:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+The LLM-bound endpoints (/api/compatibility, /api/patients/<id>/compatibility
+and /api/research) run on the event loop: upstream calls go through the async
+httpx clients and the chains through ainvoke(), so one worker can hold
+hundreds of requests in flight. SQLite, rerank and token counting run in
+worker threads so they don't stall the loop.
+
+Every other route is served by the Flask app from create_app(), mounted
+with a2wsgi on a thread pool. The Flask routes that call the LLM (batch, SSE streams) get
+their own pool (ASGI_LLM_THREADS) so they can't starve /health and the
+other cheap routes on ASGI_WSGI_THREADS.
+
+All LLM work shares one limit: at most ASYNC_MAX_INFLIGHT async requests,
+bridged LLM routes and research jobs run at once. A request that can't get
+a slot within ASYNC_QUEUE_TIMEOUT seconds, or that runs into the OpenAI
+rate limit, gets 503 with Retry-After; jobs wait for a slot instead.
+
+A client that disconnects cancels its async request (an LLM call shared
+with other requests keeps running for them) and stops its SSE stream.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import metrics
+from app import as_list, create_app
+from langchain_agentic import acheck
+from research_agent import asuggest_alternatives
+
+MAX_INFLIGHT = int(os.environ.get("ASYNC_MAX_INFLIGHT", 256))
+QUEUE_TIMEOUT = float(os.environ.get("ASYNC_QUEUE_TIMEOUT", 5))
+RETRY_AFTER = int(os.environ.get("ASYNC_RETRY_AFTER", 2))
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 16))
+LLM_THREADS = int(os.environ.get("ASGI_LLM_THREADS", 32))
+TIMING_HEADER = os.environ.get("TIMING_HEADER", "False").lower() == "true"
+
+# (status, JSON payload, extra headers)
+Reply = Tuple[int, Dict[str, Any], Dict[str, str]]
+
+
+class Saturated(Exception):
+    pass
+
+
+class InflightLimiter:
+    """
+    Caps concurrent LLM-bound work. Coroutines wait up to `timeout` seconds
+    for a slot; threads (research jobs) take one through thread_slot().
+    """
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.disconnected = 0
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def acquire(self, timeout: Optional[float] = -1) -> bool:
+        """Take a slot; timeout -1 means self.timeout, None waits as long as it takes."""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+            self._loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout == -1 else timeout
+        if self._sem.locked():
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        self.inflight += 1
+        return True
+
+    def release(self) -> None:
+        self.inflight -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        if not await self.acquire():
+            raise Saturated(f"{self.inflight} requests in flight")
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def thread_slot(self):
+        """slot() for a worker thread, waiting without a timeout; free until the loop has served a request."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            yield
+            return
+        asyncio.run_coroutine_threadsafe(self.acquire(timeout=None), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self.release)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "disconnected": self.disconnected,
+        }
+
+
+limiter = InflightLimiter(MAX_INFLIGHT, QUEUE_TIMEOUT)
+metrics.register_stats("asgi_llm", "limiter", lambda: {"llm": limiter.stats()})
+
+flask_app = create_app()
+flask_app.extensions["llm_slot"] = limiter.thread_slot
+patient_store = flask_app.extensions["patient_store"]
+
+
+def _is_rate_limited(e: BaseException) -> bool:
+    # openai.RateLimitError (after the client's own retries) carries status_code 429
+    return getattr(e, "status_code", None) == 429
+
+
+def _error_reply(e: Exception, message: str) -> Reply:
+    if isinstance(e, Saturated) or _is_rate_limited(e):
+        retry_after = str(RETRY_AFTER)
+        response = getattr(e, "response", None)
+        if response is not None and response.headers.get("retry-after"):
+            retry_after = response.headers["retry-after"]
+        return 503, {
+            'ok': False,
+            'error': 'LLM capacity is saturated, please retry shortly',
+            'details': str(e)
+        }, {'Retry-After': retry_after}
+    return 500, {'ok': False, 'error': message, 'details': str(e)}, {}
+
+
+# -----------------------
+# Async views (same request/response shapes as the Flask ones)
+# -----------------------
+async def compatibility_check(args: Dict[str, str]) -> Reply:
+    drug = args.get('drug', '').strip()
+    if not drug:
+        return 400, {'error': "Missing required query parameter 'drug'"}, {}
+    return await _compatibility_response(
+        drug,
+        as_list(args.get('allergies', '')),
+        as_list(args.get('conditions', '')),
+        as_list(args.get('ongoingMeds', ''))
+    )
+
+
+async def patient_compatibility_check(args: Dict[str, str], patient_id: int) -> Reply:
+    drug = args.get('drug', '').strip()
+    if not drug:
+        return 400, {'error': "Missing required query parameter 'drug'"}, {}
+    profile = await asyncio.to_thread(patient_store.profile, patient_id)
+    if profile is None:
+        return 404, {'ok': False, 'error': f'User with id "{patient_id}" not found'}, {}
+    return await _compatibility_response(
+        drug,
+        profile.allergies,
+        profile.conditions,
+        profile.ongoing_meds,
+        patient_id=patient_id
+    )
+
+
+async def _compatibility_response(drug, allergies, conditions, ongoing_meds, **extra_input) -> Reply:
+    try:
+        meta = {}
+        async with limiter.slot():
+            result = await acheck(
+                drug=drug,
+                allergies=allergies,
+                conditions=conditions,
+                ongoingMeds=ongoing_meds,
+                meta=meta
+            )
+    except Exception as e:
+        return _error_reply(e, 'Failed to compute compatibility')
+    return 200, {
+        'ok': True,
+        'input': {
+            **extra_input,
+            'drug': drug,
+            'allergies': allergies,
+            'conditions': conditions,
+            'ongoingMeds': ongoing_meds
+        },
+        'result': result.model_dump(),
+        'meta': meta
+    }, {'X-Result-Cache': 'HIT' if meta.get('cached') else 'MISS'}
+
+
+async def research_check(args: Dict[str, str]) -> Reply:
+    current_option = args.get('current_option', '').strip()
+    if not current_option:
+        return 400, {'error': "Missing required query parameter 'current_option'"}, {}
+    issue = args.get('issue', '').strip()
+    search_hint = args.get('search_hint', '').strip()
+    try:
+        meta = {}
+        async with limiter.slot():
+            result = await asuggest_alternatives(
+                issue=issue,
+                current_option=current_option,
+                search_hint=search_hint,
+                meta=meta
+            )
+    except Exception as e:
+        return _error_reply(e, 'Failed to parse through pubmed accurately')
+    return 200, {
+        'ok': True,
+        'input': {
+            'issue': issue,
+            'current_option': current_option,
+            'search_hint': search_hint,
+        },
+        'result': result.model_dump(),
+        'meta': meta
+    }, {'X-Result-Cache': 'HIT' if meta.get('cached') else 'MISS'}
+
+
+# (method, path pattern, Flask-style rule for metrics, view)
+ROUTES: List[Tuple[str, "re.Pattern[str]", str, Callable[..., Awaitable[Reply]]]] = [
+    ("GET", re.compile(r"^/api/compatibility$"), "/api/compatibility", compatibility_check),
+    ("GET", re.compile(r"^/api/patients/(?P<patient_id>\d+)/compatibility$"),
+     "/api/patients/<int:patient_id>/compatibility", patient_compatibility_check),
+    ("GET", re.compile(r"^/api/research$"), "/api/research", research_check),
+]
+
+
+def _match(scope) -> Optional[Tuple[str, Callable[..., Awaitable[Reply]], Dict[str, Any]]]:
+    for method, pattern, rule, view in ROUTES:
+        m = pattern.match(scope["path"])
+        if m and scope["method"] == method:
+            return rule, view, {k: int(v) for k, v in m.groupdict().items()}
+    return None
+
+
+async def _until_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _send_json(send, status: int, body: bytes, headers: Dict[str, str]) -> None:
+    headers = {**headers, 'Content-Type': 'application/json', 'Content-Length': str(len(body)),
+               'Access-Control-Allow-Origin': '*'}
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _serve(scope, receive, send, rule: str, view, kwargs: Dict[str, Any]) -> None:
+    start = time.perf_counter()
+    metrics.begin_request()
+    flask_app.extensions["start_warm_up"]()
+    args = {k: v[0] for k, v in parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True).items()}
+    # Nobody is left to read the answer once the client goes; cancel the work
+    # (and the LLM call with it) instead of finishing it
+    work = asyncio.ensure_future(view(args, **kwargs))
+    watch = asyncio.ensure_future(_until_disconnect(receive))
+    await asyncio.wait((work, watch), return_when=asyncio.FIRST_COMPLETED)
+    watch.cancel()
+    if not work.done():
+        work.cancel()
+        limiter.disconnected += 1
+        return
+    status, payload, headers = work.result()
+    body = json.dumps(payload).encode()
+
+    elapsed = time.perf_counter() - start
+    metrics.request_seconds.observe(elapsed, endpoint=rule, method=scope["method"], status=status)
+    metrics.response_bytes.observe(len(body), endpoint=rule)
+    request_headers = dict(scope["headers"])
+    if TIMING_HEADER or request_headers.get(b"x-debug-timing") == b"1" or args.get("timing") == "1":
+        headers['Server-Timing'] = metrics.server_timing_header(metrics.breakdown() + [('total', elapsed)])
+
+    headers['Access-Control-Expose-Headers'] = 'X-Result-Cache, Server-Timing'
+    await _send_json(send, status, body, headers)
+
+
+# -----------------------
+# Flask routes, through a2wsgi
+# -----------------------
+_wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_wsgi_llm = WSGIMiddleware(flask_app, workers=LLM_THREADS)
+
+# Flask routes that call the LLM in the request: limiter slot and the LLM pool
+LLM_ROUTES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("POST", re.compile(r"^/api/compatibility/batch$")),
+    ("GET", re.compile(r"^/api/compatibility/stream$")),
+    ("GET", re.compile(r"^/api/research/stream$")),
+]
+
+
+def _llm_bound(scope) -> bool:
+    return any(scope["method"] == method and pattern.match(scope["path"]) for method, pattern in LLM_ROUTES)
+
+
+async def _bridge(scope, receive, send) -> None:
+    """
+    Serve a Flask route. The request body is read here so a task can watch
+    for the disconnect; a Flask SSE stream sees it through
+    environ["asgi.scope"]["disconnected"] and stops at its next event.
+    """
+    body = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    disconnected = threading.Event()
+    gone = asyncio.Event()
+    finished = False
+    scope = {**scope, "disconnected": disconnected}
+
+    async def replay():
+        nonlocal body
+        if body is not None:
+            message, body = {"type": "http.request", "body": b"".join(body), "more_body": False}, None
+            return message
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def tracked_send(message):
+        nonlocal finished
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            finished = True
+        await send(message)
+
+    async def watch():
+        await _until_disconnect(receive)
+        if not finished:
+            limiter.disconnected += 1
+        disconnected.set()
+        gone.set()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        if not _llm_bound(scope):
+            return await _wsgi(scope, replay, tracked_send)
+        try:
+            # Held until the Flask thread returns, so a stream keeps its slot while it runs
+            async with limiter.slot():
+                await _wsgi_llm(scope, replay, tracked_send)
+        except Saturated as e:
+            status, payload, headers = _error_reply(e, "")
+            await _send_json(send, status, json.dumps(payload).encode(), headers)
+    finally:
+        watcher.cancel()
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Each uvicorn worker process warms itself up after it has started
+            flask_app.extensions["start_warm_up"]()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _wsgi.executor.shutdown(wait=False)
+            _wsgi_llm.executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    matched = _match(scope)
+    if matched is None:
+        return await _bridge(scope, receive, send)
+    rule, view, kwargs = matched
+    await _serve(scope, receive, send, rule, view, kwargs)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the backend.
+
+Starts local stand-ins for openFDA, NCBI E-utilities and an OpenAI-compatible
+chat completions endpoint (replaying the recorded responses in
+bench_fixtures/, with configurable artificial latency), points the app at
+them, serves the app on a local threaded server and drives its endpoints at
+the requested concurrency.
+
+    python benchmark.py --requests 200 --concurrency 16 --llm-latency 0.8
+    python benchmark.py --out bench_new.json --compare bench_old.json
+    python benchmark.py --server asgi --concurrency 200
+
+The report lists throughput, p50/p95/p99 latency and the mean per-stage
+breakdown (from the Server-Timing header) for each endpoint. --out writes it
+as JSON, and --compare prints the deltas against an earlier run.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(HERE, "bench_fixtures")
+
+DRUGS = ["aspirin", "amoxicillin", "lisinopril", "ibuprofen", "loratadine", "metformin"]
+RESEARCH_QUERIES = [
+    ("ACE inhibitor contraindicated in pregnancy; need antihypertensive alternative", "lisinopril", "antihypertensive pregnancy"),
+    ("penicillin allergy; need antibiotic for otitis media", "amoxicillin", "penicillin allergy cephalosporin"),
+    ("NSAID gastrointestinal bleeding; need analgesic", "aspirin", "analgesic gastrointestinal bleeding"),
+]
+
+CANNED_OUTPUTS = {
+    "CompatibilityResult": {
+        "verdict": "PROCEED WITH CAUTION",
+        "reasons": [
+            "The label advises caution for patients with the listed condition.",
+            "Monitoring is recommended when combined with the patient's ongoing medications.",
+            "No hard contraindication matched the patient's allergies.",
+        ],
+        "evidence_quotes": ["Ask a doctor before use if you have asthma."],
+    },
+    "AlternativesOut": {
+        "alternatives": [
+            {"name": "Labetalol", "description": "Effective first-line option in the provided trial.", "citation": "Bench A et al. PMID: 30000001.", "recommended_dosage": "200 mg twice daily"},
+            {"name": "Nifedipine", "description": "Comparable blood pressure control in the provided trial.", "citation": "Bench A et al. PMID: 30000001.", "recommended_dosage": None},
+            {"name": "Methyldopa", "description": "Longest safety record in pregnancy per the provided review.", "citation": "Bench A et al. PMID: 30000003.", "recommended_dosage": "250 mg two to three times daily"},
+        ]
+    },
+}
+
+
+# -----------------------
+# Upstream stand-ins
+# -----------------------
+class Fixtures:
+    def __init__(self, root: str):
+        self.labels: Dict[str, bytes] = {}
+        label_dir = os.path.join(root, "openfda")
+        for name in sorted(os.listdir(label_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(label_dir, name), "rb") as f:
+                    self.labels[name[:-5].casefold()] = f.read()
+        with open(os.path.join(root, "esearch.json"), "rb") as f:
+            self.esearch = f.read()
+        with open(os.path.join(root, "efetch.xml"), "rb") as f:
+            self.efetch = f.read()
+        self.not_found = json.dumps({"error": {"code": "NOT_FOUND", "message": "No matches found!"}}).encode()
+
+
+def make_stub_handler(fixtures: Fixtures, upstream_latency: float, llm_latency: float, jitter: float):
+    def sleep(base: float) -> None:
+        if base > 0:
+            time.sleep(max(0.0, random.gauss(base, base * jitter)))
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            sleep(upstream_latency)
+            if url.path == "/drug/label.json":
+                search = parse_qs(url.query).get("search", [""])[0]
+                name = search.split(":", 1)[-1].strip('"').casefold()
+                body = fixtures.labels.get(name)
+                if body is None:
+                    return self._send(404, fixtures.not_found, "application/json")
+                return self._send(200, body, "application/json")
+            if url.path.endswith("/esearch.fcgi"):
+                return self._send(200, fixtures.esearch, "application/json")
+            if url.path.endswith("/efetch.fcgi"):
+                return self._send(200, fixtures.efetch, "text/xml")
+            self._send(404, b"{}", "application/json")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not url.path.endswith("/chat/completions"):
+                return self._send(404, b"{}", "application/json")
+            sleep(llm_latency)
+            self._chat_completion(body)
+
+        def _chat_completion(self, body: Dict[str, Any]) -> None:
+            fmt = (body.get("response_format") or {}).get("json_schema") or {}
+            tools = body.get("tools") or []
+            schema_name = fmt.get("name") or (tools[0]["function"]["name"] if tools else "CompatibilityResult")
+            content = json.dumps(CANNED_OUTPUTS.get(schema_name, CANNED_OUTPUTS["CompatibilityResult"]))
+            prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4,
+                     "total_tokens": prompt_chars // 4 + len(content) // 4}
+            base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model", "gpt-4o-mini")}
+
+            if tools and not fmt:
+                message = {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": "call_bench", "type": "function", "function": {"name": schema_name, "arguments": content}}
+                ]}
+            else:
+                message = {"role": "assistant", "content": content, "refusal": None}
+
+            if not body.get("stream"):
+                payload = {**base, "object": "chat.completion", "usage": usage,
+                           "choices": [{"index": 0, "message": message, "finish_reason": "stop", "logprobs": None}]}
+                return self._send(200, json.dumps(payload).encode(), "application/json")
+
+            # Stream the content in a handful of chunks, like the real API
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            pieces = [content[i:i + 24] for i in range(0, len(content), 24)]
+            for i, piece in enumerate(pieces):
+                delta = {"content": piece}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None, "logprobs": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(0.005)
+            final = {**base, "object": "chat.completion.chunk", "usage": usage,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop", "logprobs": None}]}
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+            self.close_connection = True
+
+    return StubHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 stalls high-concurrency runs
+
+
+def start_server(server) -> str:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def start_uvicorn():
+    import socket
+
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config("asgi:app", host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+# -----------------------
+# Load driver
+# -----------------------
+def build_plan(mix: Dict[str, int], total: int, seed: int) -> List[Tuple[str, str, str, Optional[Dict[str, Any]]]]:
+    """(endpoint name, method, path, json body) for each request."""
+    rng = random.Random(seed)
+    names = [name for name, weight in mix.items() for _ in range(weight)]
+    plan = []
+    for _ in range(total):
+        name = rng.choice(names)
+        drug = rng.choice(DRUGS)
+        patient = rng.randint(1, 100)
+        if name == "compatibility":
+            plan.append((name, "GET", f"/api/compatibility?drug={drug}&allergies=Penicillin&conditions=Childhood asthma", None))
+        elif name == "patient":
+            plan.append((name, "GET", f"/api/patients/{patient}/compatibility?drug={drug}", None))
+        elif name == "user":
+            plan.append((name, "GET", f"/api/user?id={patient}", None))
+        elif name == "research":
+            issue, option, hint = rng.choice(RESEARCH_QUERIES)
+            plan.append((name, "GET", f"/api/research?issue={issue}&current_option={option}&search_hint={hint}", None))
+        elif name == "batch":
+            body = {"drugs": rng.sample(DRUGS, 5), "allergies": ["Penicillin"], "conditions": ["Childhood asthma"]}
+            plan.append((name, "POST", "/api/compatibility/batch", body))
+        else:
+            raise SystemExit(f"Unknown endpoint in --mix: {name}")
+    return plan
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.startswith("dur="):
+            out[name] = out.get(name, 0.0) + float(params[4:])
+    return out
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def wait_until_ready(base_url: str, timeout: float = 60) -> float:
+    """Poll /ready so warm-up isn't counted against the first requests."""
+    import requests
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if requests.get(base_url + "/ready", timeout=5).status_code == 200:
+                break
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    return time.perf_counter() - start
+
+
+def drive(base_url: str, plan, concurrency: int):
+    import requests
+
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one(item):
+        name, method, path, body = item
+        start = time.perf_counter()
+        try:
+            r = session().request(method, base_url + path, json=body, headers={"X-Debug-Timing": "1"}, timeout=120)
+            ok = r.status_code < 400 and r.json().get("ok", True)
+            timing = parse_server_timing(r.headers.get("Server-Timing", ""))
+        except Exception:
+            ok, timing = False, {}
+        return name, time.perf_counter() - start, ok, timing
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, plan))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, wall: float) -> Dict[str, Any]:
+    groups: Dict[str, List] = {}
+    for s in samples:
+        groups.setdefault(s[0], []).append(s)
+    groups["ALL"] = list(samples)
+
+    report = {}
+    for name, items in groups.items():
+        latencies = sorted(1000 * s[1] for s in items)
+        stages: Dict[str, float] = {}
+        for s in items:
+            for stage, ms in s[3].items():
+                stages[stage] = stages.get(stage, 0.0) + ms
+        report[name] = {
+            "requests": len(items),
+            "errors": sum(1 for s in items if not s[2]),
+            "throughput_rps": round(len(items) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50), 1),
+            "p95_ms": round(percentile(latencies, 0.95), 1),
+            "p99_ms": round(percentile(latencies, 0.99), 1),
+            "stages_mean_ms": {k: round(v / len(items), 1) for k, v in sorted(stages.items(), key=lambda kv: -kv[1])},
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"\n{'endpoint':<14}{'reqs':>6}{'err':>5}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in report["endpoints"].items():
+        print(f"{name:<14}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>8}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+    print("\nmean per-stage ms:")
+    for name, r in report["endpoints"].items():
+        if name != "ALL" and r["stages_mean_ms"]:
+            print(f"  {name}: " + ", ".join(f"{k}={v}" for k, v in r["stages_mean_ms"].items()))
+
+    if baseline:
+        print(f"\ncompared with {baseline.get('meta', {}).get('commit', '?')}:")
+        for name, r in report["endpoints"].items():
+            old = baseline.get("endpoints", {}).get(name)
+            if not old:
+                continue
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+                if old.get(key):
+                    deltas.append(f"{key} {100 * (r[key] - old[key]) / old[key]:+.1f}%")
+            print(f"  {name}: " + ", ".join(deltas))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default="compatibility=4,patient=2,user=4,research=1,batch=1",
+                        help="endpoint=weight list (compatibility, patient, user, research, batch)")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per chat completion")
+    parser.add_argument("--upstream-latency", type=float, default=0.08, help="seconds per openFDA/NCBI call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative std-dev of the artificial latency")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="directory of recorded upstream responses")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi",
+                        help="threaded werkzeug server, or uvicorn with asgi:app (needs uvicorn)")
+    parser.add_argument("--cache", action="store_true", help="keep the label/LLM/article caches on (default: cold pipeline)")
+    parser.add_argument("--real-rate-limits", action="store_true", help="keep the NCBI/openFDA client rate limits")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--compare", help="earlier --out report to diff against")
+    args = parser.parse_args(argv)
+
+    stub = StubServer(("127.0.0.1", 0), make_stub_handler(
+        Fixtures(args.fixtures), args.upstream_latency, args.llm_latency, args.jitter))
+    stub_url = start_server(stub)
+
+    # The app reads its configuration at import time, so set it up first
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "OPENFDA_BASE_URL": stub_url,
+        "NCBI_EUTILS_URL": f"{stub_url}/entrez/eutils",
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAI_API_BASE": f"{stub_url}/v1",
+        "OPENAI_API_KEY": "bench",
+        "FLASK_DEBUG": "False",
+        "TIMING_HEADER": "true",
+    })
+    if args.cache:
+        os.environ.update({
+            "LABEL_CACHE_PATH": os.path.join(workdir, "labels.sqlite3"),
+            "LLM_CACHE_PATH": os.path.join(workdir, "llm.sqlite3"),
+            "ARTICLE_STORE_PATH": os.path.join(workdir, "articles.sqlite3"),
+        })
+    else:
+        os.environ.update({
+            "LABEL_CACHE_PATH": "", "LABEL_CACHE_SIZE": "0",
+            "LLM_CACHE_BACKEND": "memory", "LLM_CACHE_SIZE": "0",
+            "ARTICLE_STORE_PATH": "",
+        })
+    if not args.real_rate_limits:
+        os.environ.update({"NCBI_RATE": "10000", "OPENFDA_RATE": "10000"})
+
+    sys.path.insert(0, HERE)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if args.server == "asgi":
+        app_server, app_url = start_uvicorn()
+    else:
+        from werkzeug.serving import make_server
+        from app import create_app
+
+        app_server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+        app_url = start_server(app_server)
+
+    print(f"App ready after {wait_until_ready(app_url):.2f}s")
+
+    mix = {k.strip(): int(v) for k, v in (part.split("=") for part in args.mix.split(",") if part.strip())}
+    plan = build_plan(mix, args.requests, args.seed)
+    print(f"Driving {len(plan)} requests at concurrency {args.concurrency} "
+          f"(llm {args.llm_latency}s, upstream {args.upstream_latency}s, cache {'on' if args.cache else 'off'})")
+    samples, wall = drive(app_url, plan, args.concurrency)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_s": round(wall, 2),
+            "args": vars(args),
+        },
+        "endpoints": summarize(samples, wall),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nreport written to {args.out}")
+
+    if args.server == "asgi":
+        app_server.should_exit = True
+    else:
+        app_server.shutdown()
+    stub.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+Two-tier TTL cache: a small in-process LRU in front of an optional SQLite
+file that every gunicorn worker on the host can share.
+
+Values must be JSON-serializable. Entries older than their TTL are still
+served for `stale_ttl` seconds while a background thread refreshes them
+(stale-while-revalidate). Values the caller flags as negative (failed or
+empty lookups) are kept for the shorter `negative_ttl`.
+
+Disk rows past their TTL (plus `stale_ttl`) are deleted by sweep(), which
+writes run at most every CACHE_SWEEP_INTERVAL seconds per namespace; the
+same sweep trims a namespace to its `max_rows` newest rows.
+
+The SQLite file is opened on first use, one connection per thread and
+process, so a cache created before gunicorn --preload forks never hands a
+connection across fork().
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# (value, stored_at, ttl, negative)
+Entry = Tuple[Any, float, float, bool]
+
+SWEEP_INTERVAL = float(os.environ.get("CACHE_SWEEP_INTERVAL", 600))
+MAX_ROWS = int(os.environ.get("CACHE_MAX_ROWS", 100_000))
+
+# Connections opened in a parent process. SQLite must not use them after
+# fork(), and closing one in the child can drop the parent's file locks, so
+# they are kept referenced and never touched again.
+_inherited: list = []
+
+
+def abandon_inherited(conn: sqlite3.Connection) -> None:
+    """Retire a connection this process inherited through fork() without closing it."""
+    _inherited.append(conn)
+
+
+class TieredCache:
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 256,
+        ttl: float = 7 * 24 * 3600,
+        stale_ttl: float = 0,
+        negative_ttl: float = 300,
+        path: Optional[str] = None,
+        max_rows: int = MAX_ROWS,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.path = path or None
+        self.max_rows = max_rows
+
+        self._mem: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refreshing: set = set()
+        self._tasks: set = set()  # async refreshes, referenced until done
+        self._swept_at = time.monotonic()
+        self._counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "swept": 0,
+        }
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+    # -----------------------
+    # Disk tier
+    # -----------------------
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread and process; WAL lets workers read while another writes."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            abandon_inherited(conn)
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS cache (
+                       ns TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       value TEXT NOT NULL,
+                       stored_at REAL NOT NULL,
+                       ttl REAL NOT NULL,
+                       negative INTEGER NOT NULL,
+                       PRIMARY KEY (ns, key)
+                   );
+                   CREATE INDEX IF NOT EXISTS cache_stored ON cache (ns, stored_at);"""
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _disk_get(self, key: str) -> Optional[Entry]:
+        if not self.path:
+            return None
+        try:
+            row = self._db().execute(
+                "SELECT value, stored_at, ttl, negative FROM cache WHERE ns = ? AND key = ?",
+                (self.name, key),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[cache:{self.name}] disk read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], bool(row[3])
+
+    def _disk_put(self, key: str, entry: Entry) -> None:
+        if not self.path:
+            return
+        value, stored_at, ttl, negative = entry
+        try:
+            self._db().execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, stored_at, ttl, negative) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.name, key, json.dumps(value), stored_at, ttl, int(negative)),
+            )
+        except sqlite3.Error as e:
+            print(f"[cache:{self.name}] disk write failed: {e}")
+
+    # -----------------------
+    # Memory tier
+    # -----------------------
+    def _mem_put(self, key: str, entry: Entry) -> None:
+        with self._lock:
+            self._mem[key] = entry
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._count("disk_hits")
+            self._mem_put(key, entry)
+        return entry
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    # -----------------------
+    # Public API
+    # -----------------------
+    def set(self, key: str, value: Any, negative: bool = False) -> None:
+        entry = (value, time.time(), self.negative_ttl if negative else self.ttl, negative)
+        self._mem_put(key, entry)
+        self._disk_put(key, entry)
+        if self.path and time.monotonic() - self._swept_at >= SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """
+        Delete this namespace's disk rows that can no longer be served, then
+        the oldest ones beyond max_rows; returns the count.
+        """
+        self._swept_at = time.monotonic()
+        if not self.path:
+            return 0
+        try:
+            db = self._db()
+            deleted = db.execute(
+                "DELETE FROM cache WHERE ns = ? AND stored_at + ttl + (CASE WHEN negative THEN 0 ELSE ? END) < ?",
+                (self.name, self.stale_ttl, time.time()),
+            ).rowcount
+            excess = db.execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.name,)).fetchone()[0] - self.max_rows
+            if self.max_rows and excess > 0:
+                deleted += db.execute(
+                    """DELETE FROM cache WHERE ns = ? AND key IN (
+                           SELECT key FROM cache WHERE ns = ? ORDER BY stored_at LIMIT ?
+                       )""",
+                    (self.name, self.name, excess),
+                ).rowcount
+        except sqlite3.Error as e:
+            print(f"[cache:{self.name}] sweep failed: {e}")
+            return 0
+        with self._lock:
+            self._counters["swept"] += deleted
+        return deleted
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a fresh value for key, or None. Does not load or refresh."""
+        entry = self._lookup(key)
+        if entry is not None and time.time() - entry[1] < entry[2]:
+            self._count("negative_hits" if entry[3] else "hits")
+            return entry[0]
+        self._count("misses")
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Whether key has a fresh value; unlike get() it isn't counted as a hit or miss."""
+        entry = self._lookup(key)
+        return entry is not None and time.time() - entry[1] < entry[2]
+
+    def _peek(self, key: str) -> Tuple[Optional[str], Any]:
+        """("fresh" | "stale" | None, value) for key; counts the lookup."""
+        entry = self._lookup(key)
+        if entry is not None:
+            value, stored_at, ttl, negative = entry
+            age = time.time() - stored_at
+            if age < ttl:
+                self._count("negative_hits" if negative else "hits")
+                return "fresh", value
+            if not negative and age < ttl + self.stale_ttl:
+                self._count("stale_hits")
+                return "stale", value
+        self._count("misses")
+        return None, None
+
+    def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Any],
+        is_negative: Callable[[Any], bool] = lambda v: not v,
+    ) -> Any:
+        """
+        Return the cached value for key, calling loader() on a miss.
+        Stale (but not negative) entries are returned immediately and
+        refreshed in the background.
+        """
+        state, value = self._peek(key)
+        if state == "stale":
+            self._refresh_in_background(key, loader, is_negative)
+        if state is not None:
+            return value
+        value = loader()
+        self.set(key, value, negative=is_negative(value))
+        return value
+
+    async def aget_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        is_negative: Callable[[Any], bool] = lambda v: not v,
+    ) -> Any:
+        """
+        get_or_load() for a coroutine loader; stale entries are refreshed in a
+        task on the running loop. Disk reads and writes run in a thread.
+        """
+        state, value = await asyncio.to_thread(self._peek, key) if self.path else self._peek(key)
+        if state == "stale" and self._claim_refresh(key):
+            task = asyncio.get_running_loop().create_task(self._arefresh(key, loader, is_negative))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if state is not None:
+            return value
+        value = await loader()
+        await self.aset(key, value, negative=is_negative(value))
+        return value
+
+    async def aset(self, key: str, value: Any, negative: bool = False) -> None:
+        """set() from a coroutine, with the disk write in a thread."""
+        if self.path:
+            await asyncio.to_thread(self.set, key, value, negative)
+        else:
+            self.set(key, value, negative)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() from a coroutine, with the disk read in a thread."""
+        return await asyncio.to_thread(self.get, key) if self.path else self.get(key)
+
+    def _claim_refresh(self, key: str) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _refreshed(self, key: str, value: Any, is_negative: Callable[[Any], bool]) -> None:
+        # Keep serving the stale copy rather than replacing it with a failure
+        if not is_negative(value):
+            self.set(key, value)
+        self._count("refreshes")
+
+    def _refresh_failed(self, key: str, e: Exception) -> None:
+        print(f"[cache:{self.name}] refresh of {key!r} failed: {e}")
+        self._count("refresh_errors")
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any], is_negative: Callable[[Any], bool]) -> None:
+        if not self._claim_refresh(key):
+            return
+
+        def run():
+            try:
+                self._refreshed(key, loader(), is_negative)
+            except Exception as e:
+                self._refresh_failed(key, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name=f"cache-refresh-{self.name}", daemon=True).start()
+
+    async def _arefresh(self, key: str, loader: Callable[[], Awaitable[Any]], is_negative: Callable[[Any], bool]) -> None:
+        try:
+            value = await loader()
+            await asyncio.to_thread(self._refreshed, key, value, is_negative)
+        except Exception as e:
+            self._refresh_failed(key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self) -> None:
+        """Drop every entry in this cache's namespace, in memory and on disk."""
+        with self._lock:
+            self._mem.clear()
+        if self.path:
+            try:
+                self._db().execute("DELETE FROM cache WHERE ns = ?", (self.name,))
+            except sqlite3.Error as e:
+                print(f"[cache:{self.name}] disk clear failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out["size"] = len(self._mem)
+        lookups = out["hits"] + out["stale_hits"] + out["negative_hits"] + out["misses"]
+        out["hit_rate"] = round((lookups - out["misses"]) / lookups, 4) if lookups else 0.0
+        out["maxsize"] = self.maxsize
+        out["disk"] = self.path
+        out["max_rows"] = self.max_rows if self.path else None
+        return out
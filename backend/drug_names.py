@@ -0,0 +1,233 @@
+"""
+Drug name normalization.
+
+Turns the free-form names that reach the backend (RxNorm-style strings
+from patientData.csv, brand names typed by users) into canonical generic
+names, so every spelling of a drug shares one cache key and one openFDA
+lookup:
+
+    normalize("Loratadine 5 MG Chewable Tablet")                       -> "loratadine"
+    normalize("NDA020800 0.3 ML Epinephrine 1 MG/ML Auto-Injector")    -> "epinephrine"
+    normalize("Acetaminophen 325 MG / Oxycodone Hydrochloride 5 MG Oral Tablet [Percocet]")
+                                                                       -> "acetaminophen and oxycodone"
+    normalize("Tylenol")                                               -> "acetaminophen"
+
+Dose, unit, dosage-form and NDA tokens are dropped, then brand names and
+synonyms are mapped through a token trie (longest match wins), then salt
+words are stripped. Combination products become their ingredients, sorted
+and joined with " and ".
+
+Salt words only go when they qualify another active ("naproxen sodium" ->
+"naproxen"). When the salt is the drug itself ("sodium chloride",
+"potassium chloride", "calcium carbonate") or its cation is a mineral
+("zinc sulfate", "lithium carbonate"), the whole name is kept, so
+different salts never share a key.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Bump when normalize() output changes; stores keyed by it (label_index) rebuild their keys
+VERSION = 3
+
+# brand name / synonym -> canonical generic (combinations joined with " and ")
+SYNONYMS: Dict[str, str] = {
+    # analgesics
+    "tylenol": "acetaminophen", "paracetamol": "acetaminophen", "apap": "acetaminophen",
+    "advil": "ibuprofen", "motrin": "ibuprofen", "ibu": "ibuprofen",
+    "aleve": "naproxen", "naprosyn": "naproxen", "anaprox": "naproxen",
+    "bayer": "aspirin", "ecotrin": "aspirin", "acetylsalicylic acid": "aspirin", "asa": "aspirin",
+    "celebrex": "celecoxib", "mobic": "meloxicam", "voltaren": "diclofenac",
+    "percocet": "acetaminophen and oxycodone", "vicodin": "acetaminophen and hydrocodone",
+    "norco": "acetaminophen and hydrocodone",
+    "oxycontin": "oxycodone", "ultram": "tramadol", "demerol": "meperidine", "duragesic": "fentanyl",
+    # antihistamines
+    "claritin": "loratadine", "zyrtec": "cetirizine", "allegra": "fexofenadine", "benadryl": "diphenhydramine",
+    "xyzal": "levocetirizine", "chlor-trimeton": "chlorpheniramine",
+    # anti-infectives
+    "amoxil": "amoxicillin", "augmentin": "amoxicillin and clavulanate", "zithromax": "azithromycin",
+    "z-pak": "azithromycin", "keflex": "cephalexin", "cipro": "ciprofloxacin", "levaquin": "levofloxacin",
+    "bactrim": "sulfamethoxazole and trimethoprim", "septra": "sulfamethoxazole and trimethoprim",
+    "vibramycin": "doxycycline", "flagyl": "metronidazole",
+    # V (oral) and G (parenteral) are different products with different labels; G's depot salts likewise
+    "penicillin v": "penicillin v", "penicillin vk": "penicillin v", "penicillin g": "penicillin g",
+    "penicillin g benzathine": "penicillin g benzathine", "penicillin g procaine": "penicillin g procaine",
+    # cardiovascular
+    "zestril": "lisinopril", "prinivil": "lisinopril", "vasotec": "enalapril", "altace": "ramipril",
+    "cozaar": "losartan", "norvasc": "amlodipine", "lopressor": "metoprolol", "toprol": "metoprolol",
+    "toprol xl": "metoprolol", "tenormin": "atenolol", "coreg": "carvedilol", "lasix": "furosemide",
+    "hctz": "hydrochlorothiazide", "microzide": "hydrochlorothiazide", "lipitor": "atorvastatin",
+    "zocor": "simvastatin", "crestor": "rosuvastatin", "plavix": "clopidogrel", "effient": "prasugrel",
+    "coumadin": "warfarin", "jantoven": "warfarin", "eliquis": "apixaban", "xarelto": "rivaroxaban",
+    "nitrostat": "nitroglycerin", "activase": "alteplase", "lanoxin": "digoxin",
+    # respiratory
+    "ventolin": "albuterol", "proair": "albuterol", "proventil": "albuterol", "salbutamol": "albuterol",
+    "flovent": "fluticasone", "advair": "fluticasone and salmeterol", "pulmicort": "budesonide",
+    "singulair": "montelukast",
+    "epipen": "epinephrine", "auvi-q": "epinephrine", "adrenaline": "epinephrine",
+    # endocrine
+    "glucophage": "metformin", "synthroid": "levothyroxine", "levoxyl": "levothyroxine",
+    "humulin": "insulin human", "fosamax": "alendronate", "alendronic acid": "alendronate",
+    # gastrointestinal
+    "prilosec": "omeprazole", "nexium": "esomeprazole", "pepcid": "famotidine", "zantac": "ranitidine",
+    # psychiatric / neurologic
+    "zoloft": "sertraline", "prozac": "fluoxetine", "lexapro": "escitalopram", "xanax": "alprazolam",
+    "ativan": "lorazepam", "valium": "diazepam", "ambien": "zolpidem", "neurontin": "gabapentin",
+    "lyrica": "pregabalin", "ritalin": "methylphenidate", "concerta": "methylphenidate",
+    # transplant
+    "prograf": "tacrolimus", "envarsus": "tacrolimus", "astagraf": "tacrolimus",
+    # hormonal contraceptives (packs are listed by brand only)
+    "levora": "ethinyl estradiol and levonorgestrel", "seasonique": "ethinyl estradiol and levonorgestrel",
+    "trinessa": "ethinyl estradiol and norgestimate", "yaz": "drospirenone and ethinyl estradiol",
+    "natazia": "dienogest and estradiol valerate", "nuvaring": "ethinyl estradiol and etonogestrel",
+    # vitamins and minerals
+    "vitamin b12": "cyanocobalamin", "ferrous sulfate": "ferrous sulfate",
+    "estradiol valerate": "estradiol valerate",
+    "insulin isophane human": "insulin human", "insulin regular human": "insulin human",
+}
+# Generic names the table resolves to; anything else might still be a brand
+GENERICS = frozenset(part for canonical in SYNONYMS.values() for part in canonical.split(" and "))
+
+_UNITS = {
+    "mg", "mcg", "ug", "g", "kg", "ml", "l", "unt", "unit", "units", "iu", "meq", "mmol", "actuat", "hr", "hour",
+    "day", "days", "per", "%",
+}
+_FORMS = {
+    "oral", "tablet", "tablets", "capsule", "capsules", "chewable", "extended", "release", "delayed", "sustained",
+    "injection", "injectable", "solution", "suspension", "inhaler", "inhalation", "metered", "dose", "dry",
+    "powder", "transdermal", "system", "mucosal", "spray", "auto-injector", "injector", "vaginal", "pack",
+    "abuse-deterrent", "topical", "cream", "ointment", "patch", "prefilled", "syringe", "film", "coated",
+    "disintegrating", "sublingual", "ophthalmic", "otic", "nasal", "drops", "kit", "pen", "cartridge", "vial",
+    "lotion", "gel", "elixir", "syrup", "liquid", "effervescent", "buccal", "rectal", "suppository", "enteric",
+    "er", "xr", "sr", "dr", "xl", "cr", "la", "odt", "product",
+}
+_SALTS = {
+    "hydrochloride", "hcl", "sodium", "potassium", "calcium", "magnesium", "sulfate", "citrate", "maleate",
+    "tartrate", "succinate", "besylate", "mesylate", "acetate", "phosphate", "bromide", "bitartrate",
+    "propionate", "fumarate", "hyclate", "monohydrate", "dihydrate", "trihydrate", "anhydrous", "disodium",
+    "chloride", "carbonate", "bicarbonate", "oxide", "hydroxide", "gluconate", "lactate", "iodide",
+    "fluoride", "nitrate",
+}
+# Cations whose salt is the active ingredient: "zinc sulfate" and "zinc oxide" are different drugs
+_MINERALS = {
+    "zinc", "ferrous", "ferric", "iron", "lithium", "aluminum", "silver", "selenium", "copper", "manganese",
+    "chromium", "barium", "bismuth", "cupric", "stannous", "strontium", "ammonium",
+}
+_CODE = re.compile(r"^(?:a?nda|bla)\d+$")
+_NUMBER = re.compile(r"^[\d.,]+([a-z%]*)$")
+_BRACKETED = re.compile(r"\[([^\]]*)\]")
+_TOKEN = re.compile(r"[^\s,;+()]+")
+_SEPARATORS = {"/", "and", "&", "with", "plus"}
+
+
+# -----------------------
+# Token trie
+# -----------------------
+_END = "\x00"
+
+
+def _build_trie(entries: Dict[str, str]) -> Dict[str, dict]:
+    root: Dict[str, dict] = {}
+    for phrase, canonical in entries.items():
+        node = root
+        for token in phrase.split():
+            node = node.setdefault(token, {})
+        node[_END] = canonical  # type: ignore[assignment]
+    return root
+
+
+_TRIE = _build_trie(SYNONYMS)
+
+
+def _longest_match(tokens: List[str], start: int) -> Tuple[int, Optional[str]]:
+    """(tokens consumed, canonical name) for the longest synonym starting at tokens[start]."""
+    node, best = _TRIE, (0, None)
+    for i in range(start, len(tokens)):
+        node = node.get(tokens[i])
+        if node is None:
+            break
+        if _END in node:
+            best = (i - start + 1, node[_END])
+    return best
+
+
+# -----------------------
+# Normalization
+# -----------------------
+def _is_dose(token: str) -> bool:
+    """Numbers, units and unit ratios such as "0.09", "mg/actuat", "0.12/0.015", "24hr"."""
+    def dose_part(part: str) -> bool:
+        m = _NUMBER.match(part)
+        return part in _UNITS or (m is not None and (not m.group(1) or m.group(1) in _UNITS))
+
+    parts = [p for p in token.split("/") if p]
+    return bool(parts) and all(dose_part(p) for p in parts)
+
+
+def _tokens(name: str) -> List[str]:
+    out: List[str] = []
+    for token in _TOKEN.findall(name):
+        # A unit that continues a synonym is part of the name: the "g" in "penicillin g"
+        if out and token in _TRIE.get(out[-1], {}):
+            out.append(token)
+            continue
+        if _CODE.match(token) or _is_dose(token) or token in _FORMS:
+            continue
+        # "acetaminophen/hydrocodone": a bare slash between names separates ingredients
+        pieces = token.split("/")
+        for i, piece in enumerate(pieces):
+            if i:
+                out.append("/")
+            if piece and not _is_dose(piece) and piece not in _FORMS:
+                out.append(piece)
+    return out
+
+
+def _ingredient(tokens: List[str]) -> List[str]:
+    """Canonical names for one ingredient's tokens (a synonym may expand to several)."""
+    names: List[str] = []
+    rest: List[str] = []
+    i = 0
+    while i < len(tokens):
+        consumed, canonical = _longest_match(tokens, i)
+        if consumed:
+            names.extend(canonical.split(" and "))
+            i += consumed
+        else:
+            rest.append(tokens[i])
+            i += 1
+    if rest and not names:
+        actives = [t for t in rest if t not in _SALTS]
+        # Only strip salt words that qualify another active; otherwise the salt is the drug
+        if not actives or any(t in _MINERALS for t in actives):
+            actives = rest
+        names.append(" ".join(actives))
+    return names
+
+
+@lru_cache(maxsize=4096)
+def ingredients(name: str) -> Tuple[str, ...]:
+    """Canonical generic ingredient names in name, sorted; empty if nothing is left."""
+    text = " ".join((name or "").split()).casefold()
+    bracketed = _BRACKETED.findall(text)
+    tokens = _tokens(_BRACKETED.sub(" ", text))
+    if not any(t not in _SEPARATORS for t in tokens):
+        tokens = _tokens(" ".join(bracketed))  # only a brand name was given, e.g. "[Tylenol]"
+
+    found: List[str] = []
+    group: List[str] = []
+    for token in tokens + ["/"]:
+        if token in _SEPARATORS:
+            found.extend(_ingredient(group))
+            group = []
+        else:
+            group.append(token)
+    return tuple(sorted(set(found)))
+
+
+def normalize(name: str) -> str:
+    """Canonical key for a drug name; falls back to the case-folded input if nothing is recognizable."""
+    found = ingredients(name)
+    if found:
+        return " and ".join(found)
+    return " ".join((name or "").split()).casefold()
@@ -0,0 +1,320 @@
+"""
+Shared HTTP client for the upstream APIs (openFDA, NCBI E-utilities).
+
+Each upstream gets its own keep-alive connection pool, a token-bucket rate
+limit shared by every thread in the process (buckets are per process, so
+the configured rate is split across the WEB_CONCURRENCY workers gunicorn
+runs; set it to the worker count to keep the host within the limit), jittered exponential backoff
+on 429/5xx and connection errors (tenacity), optional api_key injection
+from the environment, and latency/retry counters.
+
+    r = http_client.get("ncbi", ESEARCH, params={...})
+    r = await http_client.aget("ncbi", ESEARCH, params={...})
+    async with http_client.astream("ncbi", EFETCH, params={...}) as r:
+        async for chunk in r.aiter_bytes(): ...
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+import metrics
+
+MAX_ATTEMPTS = int(os.environ.get("HTTP_MAX_ATTEMPTS", 4))
+BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.5))
+BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 8))
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+# gunicorn's worker count setting; each process takes its share of a rate limit
+WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket. reserve() claims a token and returns how long to wait for it."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class Upstream:
+    def __init__(self, name: str, rate: float, api_key_env: str, keyed_rate: Optional[float] = None,
+                 api_key_param: str = "api_key"):
+        self.name = name
+        self.api_key = os.environ.get(api_key_env) or None
+        self.api_key_param = api_key_param
+        self.bucket = TokenBucket((keyed_rate if (self.api_key and keyed_rate) else rate) / WORKERS)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # httpx clients are bound to an event loop, so keep one per loop
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Any] = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "throttled_s": 0.0,
+            "latency_s": 0.0,
+            "latency_max_s": 0.0,
+            "status": {},
+        }
+
+    def params(self, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        params = dict(params or {})
+        if self.api_key:
+            params.setdefault(self.api_key_param, self.api_key)
+        return params
+
+    def async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+            client = httpx.AsyncClient(limits=limits)
+            self._async_clients[loop] = client
+        return client
+
+    def record(self, status: Optional[int], elapsed: float, throttled: float, size: Optional[int] = None) -> None:
+        metrics.upstream_seconds.observe(elapsed, upstream=self.name)
+        metrics.upstream_requests.inc(upstream=self.name, status=status if status is not None else "error")
+        if size is not None:
+            metrics.upstream_bytes.observe(size, upstream=self.name)
+        with self._lock:
+            c = self._counters
+            c["requests"] += 1
+            c["throttled_s"] += throttled
+            c["latency_s"] += elapsed
+            c["latency_max_s"] = max(c["latency_max_s"], elapsed)
+            key = str(status) if status is not None else "error"
+            c["status"][key] = c["status"].get(key, 0) + 1
+
+    def count(self, name: str) -> None:
+        if name == "retries":
+            metrics.upstream_retries.inc(upstream=self.name)
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counters)
+            c["status"] = dict(c["status"])
+        n = c["requests"]
+        return {
+            "requests": n,
+            "retries": c["retries"],
+            "failures": c["failures"],
+            "status": c["status"],
+            "latency_avg_ms": round(1000 * c["latency_s"] / n, 1) if n else 0.0,
+            "latency_max_ms": round(1000 * c["latency_max_s"], 1),
+            "throttled_ms": round(1000 * c["throttled_s"], 1),
+            "rate_limit_per_s": self.bucket.rate,
+            "api_key": bool(self.api_key),
+        }
+
+
+# NCBI allows 3 req/s, 10 with an API key; openFDA allows 240 req/min per IP or key
+UPSTREAMS: Dict[str, Upstream] = {
+    "openfda": Upstream("openfda", rate=float(os.environ.get("OPENFDA_RATE", 4)), api_key_env="OPENFDA_API_KEY"),
+    "ncbi": Upstream("ncbi", rate=float(os.environ.get("NCBI_RATE", 3)), keyed_rate=10, api_key_env="NCBI_API_KEY"),
+}
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _is_retryable(e: BaseException) -> bool:
+    return isinstance(e, (RetryableStatus, requests.ConnectionError, requests.Timeout, httpx.TransportError))
+
+
+def _retry_kwargs(up: Upstream) -> Dict[str, Any]:
+    return dict(
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        wait=wait_random_exponential(multiplier=BACKOFF, max=BACKOFF_MAX),
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=lambda state: up.count("retries"),
+        reraise=True,
+    )
+
+
+def get(upstream: str, url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 20, **kwargs) -> requests.Response:
+    """
+    Rate-limited, retrying GET. After the last attempt a 429/5xx response is
+    returned as-is; connection errors are raised.
+    """
+    up = UPSTREAMS[upstream]
+    params = up.params(params)
+
+    def attempt() -> requests.Response:
+        wait = up.bucket.reserve()
+        if wait:
+            time.sleep(wait)
+        start = time.perf_counter()
+        try:
+            r = up.session.get(url, params=params, timeout=timeout, **kwargs)
+        except Exception:
+            up.record(None, time.perf_counter() - start, wait)
+            raise
+        up.record(r.status_code, time.perf_counter() - start, wait, len(r.content))
+        if r.status_code in RETRY_STATUSES:
+            raise RetryableStatus(r)
+        return r
+
+    try:
+        for state in Retrying(**_retry_kwargs(up)):
+            with state:
+                return attempt()
+    except RetryableStatus as e:
+        up.count("failures")
+        return e.response
+    except Exception:
+        up.count("failures")
+        raise
+
+
+async def aget(upstream: str, url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 20) -> httpx.Response:
+    """Async counterpart of get(), on a pooled httpx.AsyncClient for the running loop."""
+    up = UPSTREAMS[upstream]
+    params = up.params(params)
+    client = up.async_client()
+
+    async def attempt() -> httpx.Response:
+        wait = up.bucket.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        start = time.perf_counter()
+        try:
+            r = await client.get(url, params=params, timeout=timeout)
+        except Exception:
+            up.record(None, time.perf_counter() - start, wait)
+            raise
+        up.record(r.status_code, time.perf_counter() - start, wait, len(r.content))
+        if r.status_code in RETRY_STATUSES:
+            raise RetryableStatus(r)
+        return r
+
+    try:
+        async for state in AsyncRetrying(**_retry_kwargs(up)):
+            with state:
+                return await attempt()
+    except RetryableStatus as e:
+        up.count("failures")
+        return e.response
+    except Exception:
+        up.count("failures")
+        raise
+
+
+@asynccontextmanager
+async def astream(upstream: str, url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 20) -> AsyncIterator[httpx.Response]:
+    """
+    aget() that yields the response once its headers arrive, for reading the
+    body with aiter_bytes(); the response is closed on exit.
+    """
+    up = UPSTREAMS[upstream]
+    params = up.params(params)
+    client = up.async_client()
+
+    async def attempt() -> httpx.Response:
+        wait = up.bucket.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        start = time.perf_counter()
+        try:
+            # What client.stream() does, without tying the retry loop to a context block
+            r = await client.send(client.build_request("GET", url, params=params, timeout=timeout), stream=True)
+        except Exception:
+            up.record(None, time.perf_counter() - start, wait)
+            raise
+        size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+        up.record(r.status_code, time.perf_counter() - start, wait, size)
+        if r.status_code in RETRY_STATUSES:
+            await r.aclose()
+            raise RetryableStatus(r)
+        return r
+
+    try:
+        async for state in AsyncRetrying(**_retry_kwargs(up)):
+            with state:
+                r = await attempt()
+    except RetryableStatus as e:
+        up.count("failures")
+        r = e.response
+    except Exception:
+        up.count("failures")
+        raise
+    try:
+        yield r
+    finally:
+        await r.aclose()
+
+
+# -----------------------
+# Background event loop
+# -----------------------
+# Sync callers (Flask views) run async pipelines here instead of asyncio.run(),
+# so the per-loop httpx pools stay warm across requests.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="http-client-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+async def _in_context(ctx: contextvars.Context, coro):
+    # Carry the caller's context vars (e.g. the request's timing breakdown) onto the loop
+    for var, value in ctx.items():
+        var.set(value)
+    return await coro
+
+
+def submit(coro) -> "concurrent.futures.Future":
+    """Schedule a coroutine on the shared background loop."""
+    return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), _background_loop())
+
+
+def run(coro):
+    """Run a coroutine on the shared background loop and block for its result."""
+    return submit(coro).result()
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {name: up.stats() for name, up in UPSTREAMS.items()}
@@ -0,0 +1,227 @@
+"""
+Background jobs for slow endpoints (research: NCBI plus the LLM).
+
+submit() queues a callable on a bounded thread pool and returns the job
+record at once; the caller polls get(job_id) until its status is "done" or
+"failed". Records live in a TieredCache namespace, so with a SQLite path
+any gunicorn worker on the host can answer the poll, and finished records
+are kept for `ttl` seconds.
+
+Jobs are keyed by their canonical inputs: a submit whose key matches a
+queued or running job attaches to it instead of starting new work.
+
+The worker that owns a job refreshes its record's heartbeat_at every
+`heartbeat` seconds. A queued or running record whose heartbeat is older
+than `stale_after` belongs to a worker that died or was recycled: get()
+reports it as failed, and an identical submit marks it failed and runs
+the job again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import metrics
+from cache import TieredCache
+from llm_cache import canonical
+
+ACTIVE = ("queued", "running")
+
+
+class QueueFull(Exception):
+    """Too many jobs are queued or running in this worker."""
+
+
+def job_key(kind: str, inputs: Dict[str, Any]) -> str:
+    payload = {"kind": kind, "inputs": canonical(inputs)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class JobQueue:
+    def __init__(
+        self,
+        name: str,
+        workers: int = 4,
+        max_pending: int = 64,
+        ttl: float = 600,
+        path: Optional[str] = None,
+        heartbeat: float = 5,
+        stale_after: float = 30,
+    ):
+        self.name = name
+        self.max_pending = max_pending
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        # With a shared file, skip the memory tier: another worker may have updated the record
+        self.records = TieredCache(
+            f"jobs:{name}", maxsize=0 if path else max(4 * max_pending, 256), ttl=ttl, path=path
+        )
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-job")
+        self._lock = threading.Lock()
+        self._active: Dict[str, str] = {}  # job key -> job id, queued or running in this worker
+        self._records: Dict[str, Dict[str, Any]] = {}  # job id -> latest record, for the heartbeat
+        self._heartbeat_pid: Optional[int] = None
+        self._counters = {"submitted": 0, "attached": 0, "rejected": 0, "done": 0, "failed": 0, "stale": 0}
+        self.workers = workers
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        self.records.set(f"job:{job['id']}", job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.records.get(f"job:{job_id}")
+        if job is not None and self._is_stale(job):
+            with self._lock:
+                job = self._mark_stale_locked(job)
+        return job
+
+    def _is_stale(self, job: Dict[str, Any]) -> bool:
+        if job["status"] not in ACTIVE or job["id"] in self._records:
+            return False
+        return time.time() - (job.get("heartbeat_at") or job["created_at"]) > self.stale_after
+
+    def _mark_stale_locked(self, job: Dict[str, Any], replaced_by: Optional[str] = None) -> Dict[str, Any]:
+        """Record a job whose worker stopped heartbeating as failed."""
+        job = {
+            **job,
+            "status": "failed",
+            "error": "the worker running this job stopped before it finished",
+            "finished_at": time.time(),
+        }
+        if replaced_by:
+            job["replaced_by"] = replaced_by
+        self._save(job)
+        self._counters["stale"] += 1
+        return job
+
+    def submit(
+        self,
+        key: str,
+        inputs: Dict[str, Any],
+        fn: Callable[[Dict[str, Any]], Any],
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Queue fn(meta) unless a job with the same key is already queued or
+        running. Returns (job record, attached). Raises QueueFull when this
+        worker already has max_pending jobs.
+        """
+        self._start_heartbeat()
+        with self._lock:
+            running, stale = self._running_job_locked(key)
+            if running is None:
+                if len(self._active) >= self.max_pending:
+                    self._counters["rejected"] += 1
+                    raise QueueFull(f"{len(self._active)} {self.name} jobs pending")
+                now = time.time()
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "status": "queued",
+                    "input": inputs,
+                    "created_at": now,
+                    "started_at": None,
+                    "heartbeat_at": now,
+                    "finished_at": None,
+                }
+                # Saved before the lock drops so an identical submit finds it
+                self._save(job)
+                self.records.set(f"key:{key}", job["id"])
+                self._active[key] = job["id"]
+                self._records[job["id"]] = job
+                self._counters["submitted"] += 1
+                if stale is not None:
+                    self._mark_stale_locked(stale, replaced_by=job["id"])
+        if running is not None:
+            self._count("attached")
+            return running, True
+
+        self._pool.submit(self._run, key, job, fn)
+        return job, False
+
+    def _running_job_locked(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        (job already working on key, in this worker or via the shared records
+        another one; or a stale active record for key whose worker is gone).
+        """
+        job_id = self._active.get(key)
+        if job_id is not None:
+            return self._records[job_id], None
+        shared_id = self.records.get(f"key:{key}")
+        job = self.records.get(f"job:{shared_id}") if shared_id else None
+        if job is None or job["status"] not in ACTIVE:
+            return None, None
+        if self._is_stale(job):
+            return None, job
+        return job, None
+
+    def _start_heartbeat(self) -> None:
+        """One heartbeat thread per process, started on first use (so after any fork)."""
+        if self._heartbeat_pid == os.getpid():
+            return
+        with self._lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+        threading.Thread(target=self._beat, name=f"{self.name}-job-heartbeat", daemon=True).start()
+
+    def _beat(self) -> None:
+        while True:
+            time.sleep(self.heartbeat)
+            now = time.time()
+            with self._lock:
+                for job_id, job in list(self._records.items()):
+                    job = self._records[job_id] = {**job, "heartbeat_at": now}
+                    self._save(job)
+
+    def _update(self, job: Dict[str, Any]) -> None:
+        # Under the lock, so a heartbeat never writes back an older copy
+        with self._lock:
+            self._records[job["id"]] = job
+            self._save(job)
+
+    def _run(self, key: str, job: Dict[str, Any], fn: Callable[[Dict[str, Any]], Any]) -> None:
+        job = {**job, "status": "running", "started_at": time.time(), "heartbeat_at": time.time()}
+        self._update(job)
+        job = dict(job)  # the heartbeat copies the stored record; finish on our own
+        metrics.begin_request()
+        meta: Dict[str, Any] = {}
+        try:
+            job["result"] = fn(meta)
+            job["status"] = "done"
+        except Exception as e:
+            print(f"[jobs:{self.name}] job {job['id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["meta"] = meta
+        job["timing"] = {
+            stage: round(seconds * 1000, 1)
+            for stage, seconds in _sum_stages(metrics.breakdown()).items()
+        }
+        job["finished_at"] = time.time()
+        with self._lock:
+            self._save(job)
+            self._records.pop(job["id"], None)
+            self._active.pop(key, None)
+        self._count(job["status"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out["active"] = len(self._active)
+        out["workers"] = self.workers
+        out["max_pending"] = self.max_pending
+        out["stale_after"] = self.stale_after
+        return out
+
+
+def _sum_stages(timings) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return totals
@@ -0,0 +1,130 @@
+"""
+Builds the FDA label text that goes into the compatibility prompt.
+
+Only the clinically relevant label sections are kept. Their sentences are
+ranked by how well they match the patient's allergies, conditions and
+ongoing meds, then packed into a token budget.
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+from tokens import count_tokens
+
+# Sections in priority order; ties in relevance go to the earlier section.
+# "warnings" is the OTC/older-label counterpart of warnings_and_cautions, and
+# the OTC monograph sections (do_not_use, ask_doctor, stop_use) hold an OTC
+# drug's actual restrictions.
+SECTIONS = [
+    "boxed_warning",
+    "contraindications",
+    "do_not_use",
+    "warnings_and_cautions",
+    "warnings",
+    "ask_doctor",
+    "ask_doctor_or_pharmacist",
+    "stop_use",
+    "drug_interactions",
+    "precautions",
+    "pregnancy",
+]
+
+DEFAULT_BUDGET = int(os.environ.get("LABEL_CONTEXT_TOKENS", 1500))
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(•])|\s*•\s*")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "and", "the", "with", "for", "from", "not", "none", "other", "acute", "chronic",
+    "disorder", "finding", "substance", "organism", "tablet", "oral", "solution",
+}
+
+
+def sentences(text: str) -> List[str]:
+    """Split label text into sentences and bullet items."""
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s and len(s.strip()) > 2]
+
+
+def section_text(value: Any) -> str:
+    """A label section's text; openFDA sends most sections as a list of strings."""
+    if isinstance(value, list):
+        return " ".join(v for v in value if isinstance(v, str))
+    return value if isinstance(value, str) else ""
+
+
+def label_tokens(label: Dict[str, Any]) -> int:
+    """Token count of a whole label record; stored with the label once, when it is fetched or indexed."""
+    return count_tokens(json.dumps(label))
+
+
+def _patient_terms(*groups: List[str]) -> Tuple[List[str], set]:
+    """Lower-cased phrases and their informative words."""
+    phrases, words = [], set()
+    for group in groups:
+        for term in group or []:
+            phrase = " ".join(_WORD.findall(term.casefold()))
+            if not phrase:
+                continue
+            phrases.append(phrase)
+            words.update(w for w in phrase.split() if len(w) > 2 and w not in _STOPWORDS)
+    return phrases, words
+
+
+def _score(sentence: str, phrases: List[str], words: set) -> float:
+    lowered = " ".join(_WORD.findall(sentence.casefold()))
+    if not lowered:
+        return 0.0
+    score = 3.0 * sum(1 for p in phrases if f" {p} " in f" {lowered} ")
+    score += len(words.intersection(lowered.split()))
+    return score
+
+
+def build_label_context(
+    label: Dict[str, Any],
+    allergies: List[str] | None = None,
+    conditions: List[str] | None = None,
+    ongoingMeds: List[str] | None = None,
+    budget: int = DEFAULT_BUDGET,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Return (context_text, stats). stats reports the token count of the raw
+    label (as stored with it under "label_tokens"), of the context actually
+    sent, and the difference.
+    """
+    label = label or {}
+    phrases, words = _patient_terms(allergies, conditions, ongoingMeds)
+
+    candidates = []  # (score, section_rank, position, section, sentence, tokens)
+    for rank, section in enumerate(SECTIONS):
+        for pos, sentence in enumerate(sentences(section_text(label.get(section)))):
+            candidates.append((_score(sentence, phrases, words), rank, pos, section, sentence, count_tokens(sentence) + 1))
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+
+    used = 0
+    kept: Dict[str, List[Tuple[int, str]]] = {}
+    for score, rank, pos, section, sentence, tokens in candidates:
+        header = 0 if section in kept else count_tokens(section) + 2
+        if used + tokens + header > budget:
+            continue
+        used += tokens + header
+        kept.setdefault(section, []).append((pos, sentence))
+
+    blocks = []
+    for section in SECTIONS:
+        if section in kept:
+            body = " ".join(s for _, s in sorted(kept[section]))
+            blocks.append(f"{section.upper()}: {body}")
+    context = "\n\n".join(blocks) if blocks else "(no relevant FDA label sections found)"
+
+    full_tokens = label.get("label_tokens")
+    context_tokens = count_tokens(context)
+    stats = {
+        "label_tokens": full_tokens,
+        "context_tokens": context_tokens,
+        "tokens_saved": max(full_tokens - context_tokens, 0) if full_tokens is not None else None,
+        "token_budget": budget,
+        "sentences_kept": sum(len(v) for v in kept.values()),
+        "sentences_total": len(candidates),
+        "sections": [s for s in SECTIONS if s in kept],
+    }
+    return context, stats
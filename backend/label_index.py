@@ -0,0 +1,392 @@
+"""
+Offline index of the openFDA drug label bulk download.
+
+openFDA publishes every drug label as zipped JSON partitions
+(drug-label-0001-of-00NN.json.zip, see https://open.fda.gov/apis/downloads/).
+`ingest` streams each partition record by record, keeps only the fields the
+compatibility check reads (the label sections in KEPT_SECTIONS plus id,
+effective_time and openfda names) and writes them to a SQLite file keyed by
+canonical generic and brand name (drug_names.normalize), so lookups need
+no network:
+
+    python label_index.py ingest ~/openfda/drug-label-*.json.zip
+    python label_index.py lookup "Tylenol 500 MG Oral Tablet"
+    python label_index.py stats
+
+Re-running ingest skips partitions whose size and mtime are unchanged and
+replaces the labels of the ones that changed; --force re-reads everything.
+Name keys are rebuilt from the stored records when drug_names.VERSION
+changes, so an index never answers with another drug's keys.
+When several labels share a name, the most recently effective one wins.
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import drug_names
+from cache import abandon_inherited
+from label_context import SECTIONS, label_tokens
+from prescreen import HARD_SECTIONS
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "label_index.sqlite3")
+
+KEPT_SECTIONS = tuple(dict.fromkeys([*SECTIONS, *HARD_SECTIONS]))
+KEPT_OPENFDA = ("generic_name", "brand_name", "substance_name")
+
+_CHUNK = 1 << 20
+_BATCH = 500
+
+
+# -----------------------
+# Streaming partition reader
+# -----------------------
+class _Stream:
+    """Character buffer over a text file that grows as the JSON decoder asks for more."""
+
+    def __init__(self, fp: io.TextIOBase):
+        self.fp = fp
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_ws(self) -> str:
+        """Next non-whitespace character (not consumed), or "" at end of input."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.skip_ws() != char:
+            raise ValueError(f"expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self, decoder: json.JSONDecoder) -> Any:
+        self.skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the buffer edge may be cut short; make sure it ended
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_results(fp: io.TextIOBase) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of the top-level "results" array one at a time."""
+    stream, decoder = _Stream(fp), json.JSONDecoder()
+    stream.expect("{")
+    while stream.skip_ws() not in ("}", ""):
+        key = stream.value(decoder)
+        stream.expect(":")
+        if key != "results":
+            stream.value(decoder)  # "meta" and anything else openFDA adds
+        else:
+            stream.expect("[")
+            while stream.skip_ws() != "]":
+                yield stream.value(decoder)
+                if stream.skip_ws() == ",":
+                    stream.pos += 1
+            stream.pos += 1
+        if stream.skip_ws() == ",":
+            stream.pos += 1
+
+
+def _open_partition(path: str) -> Iterator[Dict[str, Any]]:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for member in zf.namelist():
+                if member.endswith(".json"):
+                    with zf.open(member) as raw:
+                        yield from iter_results(io.TextIOWrapper(raw, encoding="utf-8"))
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield from iter_results(f)
+
+
+def slim_label(label: Dict[str, Any]) -> Dict[str, Any]:
+    """The subset of an openFDA label record that check() uses."""
+    openfda = label.get("openfda") or {}
+    out = {"id": label.get("id"), "effective_time": label.get("effective_time"), "label_tokens": label_tokens(label)}
+    out.update({s: label[s] for s in KEPT_SECTIONS if label.get(s)})
+    out["openfda"] = {k: openfda[k] for k in KEPT_OPENFDA if openfda.get(k)}
+    return out
+
+
+def _label_names(label: Dict[str, Any]) -> Iterable[Tuple[str, str]]:
+    """(canonical name, kind) pairs a label is filed under."""
+    openfda = label.get("openfda") or {}
+    seen = set()
+    for kind, field in (("generic", "generic_name"), ("generic", "substance_name"), ("brand", "brand_name")):
+        for name in openfda.get(field) or []:
+            if not isinstance(name, str) or not name.strip():
+                continue
+            key = (drug_names.normalize(name), kind)
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+
+# -----------------------
+# Index
+# -----------------------
+class LabelIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db().executescript(
+            """CREATE TABLE IF NOT EXISTS labels (
+                   id TEXT PRIMARY KEY,
+                   partition TEXT NOT NULL,
+                   effective_time TEXT,
+                   record TEXT NOT NULL
+               );
+               CREATE TABLE IF NOT EXISTS names (
+                   name TEXT NOT NULL,
+                   kind TEXT NOT NULL,
+                   effective_time TEXT NOT NULL,
+                   label_id TEXT NOT NULL,
+                   PRIMARY KEY (name, kind, effective_time, label_id)
+               ) WITHOUT ROWID;
+               CREATE INDEX IF NOT EXISTS names_label ON names (label_id);
+               CREATE INDEX IF NOT EXISTS labels_partition ON labels (partition);
+               CREATE TABLE IF NOT EXISTS partitions (
+                   name TEXT PRIMARY KEY,
+                   size INTEGER NOT NULL,
+                   mtime REAL NOT NULL,
+                   labels INTEGER NOT NULL,
+                   ingested_at REAL NOT NULL
+               );
+               CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"""
+        )
+        if self._meta("normalizer") != str(drug_names.VERSION):
+            self.rebuild_names()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def rebuild_names(self) -> int:
+        """Re-derive every name key from the stored records with the current normalizer."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM names")
+            count = 0
+            for label_id, effective_time, record in db.execute("SELECT id, effective_time, record FROM labels").fetchall():
+                names = [(n, kind, effective_time or "", label_id) for n, kind in _label_names(json.loads(record)) if n]
+                db.executemany(
+                    "INSERT OR REPLACE INTO names (name, kind, effective_time, label_id) VALUES (?, ?, ?, ?)", names
+                )
+                count += 1
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('normalizer', ?)", (str(drug_names.VERSION),)
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if count:
+            print(f"[label_index] rebuilt name keys for {count} labels (normalizer v{drug_names.VERSION})")
+        return count
+
+    def _db(self) -> sqlite3.Connection:
+        """One connection per thread and process; WAL lets the server read while ingest writes."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            abandon_inherited(conn)
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # -----------------------
+    # Lookups
+    # -----------------------
+    def lookup(self, drug: str) -> Optional[Dict[str, Any]]:
+        """Most recent label filed under drug's canonical name, generic names before brands."""
+        name = drug_names.normalize(drug)
+        row = None
+        try:
+            for kind in ("generic", "brand"):
+                row = self._db().execute(
+                    """SELECT l.record FROM names n JOIN labels l ON l.id = n.label_id
+                       WHERE n.name = ? AND n.kind = ? ORDER BY n.effective_time DESC LIMIT 1""",
+                    (name, kind),
+                ).fetchone()
+                if row is not None:
+                    break
+        except sqlite3.Error as e:
+            print(f"[label_index] lookup failed: {e}")
+        with self._lock:
+            self._counters["hits" if row else "misses"] += 1
+        return json.loads(row[0]) if row else None
+
+    def contains(self, drug: str) -> bool:
+        """Whether any label is filed under drug's canonical name; not counted as a hit or miss."""
+        try:
+            return self._db().execute(
+                "SELECT 1 FROM names WHERE name = ? LIMIT 1", (drug_names.normalize(drug),)
+            ).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._db()
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+        total = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / total, 4) if total else None
+        out["labels"] = db.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+        out["names"] = db.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+        out["partitions"] = db.execute("SELECT COUNT(*) FROM partitions").fetchone()[0]
+        return out
+
+    # -----------------------
+    # Ingest
+    # -----------------------
+    def _unchanged(self, name: str, size: int, mtime: float) -> bool:
+        row = self._db().execute("SELECT size, mtime FROM partitions WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def ingest(self, path: str, force: bool = False) -> Optional[int]:
+        """Load one partition file; returns the label count, or None if it was unchanged."""
+        name = os.path.basename(path)
+        st = os.stat(path)
+        if not force and self._unchanged(name, st.st_size, st.st_mtime):
+            return None
+
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Drop what this partition held before; a label that moved is re-added below
+            db.execute(
+                "DELETE FROM names WHERE label_id IN (SELECT id FROM labels WHERE partition = ?)", (name,)
+            )
+            db.execute("DELETE FROM labels WHERE partition = ?", (name,))
+            count = 0
+            labels: List[Tuple[str, str, Optional[str], str]] = []
+            names: List[Tuple[str, str, str, str]] = []
+            for label in _open_partition(path):
+                if not label.get("id"):
+                    continue
+                slim = slim_label(label)
+                labels.append((slim["id"], name, slim["effective_time"], json.dumps(slim, separators=(",", ":"))))
+                names += [(n, kind, slim["effective_time"] or "", slim["id"]) for n, kind in _label_names(label) if n]
+                count += 1
+                if len(labels) >= _BATCH:
+                    self._write(db, labels, names)
+                    labels, names = [], []
+            self._write(db, labels, names)
+            db.execute(
+                "INSERT OR REPLACE INTO partitions (name, size, mtime, labels, ingested_at) VALUES (?, ?, ?, ?, ?)",
+                (name, st.st_size, st.st_mtime, count, time.time()),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return count
+
+    @staticmethod
+    def _write(db: sqlite3.Connection, labels: List[tuple], names: List[tuple]) -> None:
+        db.executemany("DELETE FROM names WHERE label_id = ?", [(row[0],) for row in labels])
+        db.executemany(
+            "INSERT OR REPLACE INTO labels (id, partition, effective_time, record) VALUES (?, ?, ?, ?)", labels
+        )
+        db.executemany(
+            "INSERT OR REPLACE INTO names (name, kind, effective_time, label_id) VALUES (?, ?, ?, ?)", names
+        )
+
+
+def open_index(path: Optional[str] = None) -> Optional[LabelIndex]:
+    """The index at path (default LABEL_INDEX_PATH), or None if it hasn't been built."""
+    path = os.environ.get("LABEL_INDEX_PATH", DEFAULT_PATH) if path is None else path
+    if not path or not os.path.exists(path):
+        return None
+    return LabelIndex(path)
+
+
+def _partition_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, f) for f in os.listdir(path) if f.endswith((".json.zip", ".json"))
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=os.environ.get("LABEL_INDEX_PATH") or DEFAULT_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ingest = sub.add_parser("ingest", help="load bulk partitions (.json.zip files or directories of them)")
+    p_ingest.add_argument("paths", nargs="+")
+    p_ingest.add_argument("--force", action="store_true", help="re-read partitions even if unchanged")
+    p_lookup = sub.add_parser("lookup", help="print the label a drug name resolves to")
+    p_lookup.add_argument("drug")
+    sub.add_parser("stats", help="print index counts")
+    args = parser.parse_args(argv)
+
+    index = LabelIndex(args.index)
+    if args.command == "ingest":
+        for path in _partition_files(args.paths):
+            start = time.perf_counter()
+            count = index.ingest(path, force=args.force)
+            if count is None:
+                print(f"{os.path.basename(path)}: unchanged, skipped")
+            else:
+                print(f"{os.path.basename(path)}: {count} labels in {time.perf_counter() - start:.1f}s")
+        print(json.dumps(index.stats()))
+    elif args.command == "lookup":
+        start = time.perf_counter()
+        label = index.lookup(args.drug)
+        elapsed = (time.perf_counter() - start) * 1000
+        if label is None:
+            print(f"{drug_names.normalize(args.drug)!r}: not in index")
+            return 1
+        print(json.dumps(label, indent=2)[:2000])
+        print(f"({elapsed:.3f} ms)", file=sys.stderr)
+    else:
+        print(json.dumps(index.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,139 @@
+import asyncio
+import contextvars
 import json
-import requests
-from typing import Optional, List, Dict
+import os
+import drug_names
+import http_client
+import metrics
+import prescreen
+import singleflight
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, NamedTuple, Optional, List, Dict, Tuple
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 import dotenv
+from cache import TieredCache
+from label_context import build_label_context, label_tokens
+from lazy import Lazy
+from llm_cache import ResultCache, prompt_version
+from streaming import ListItemTracker
 
 dotenv.load_dotenv()
 
-OPENFDA = "https://api.fda.gov/drug/label.json?search=openfda.generic_name:"
+# Max label fetches / LLM calls in flight for one batch request
+BATCH_CONCURRENCY = int(os.environ.get("COMPAT_BATCH_CONCURRENCY", 8))
+
+OPENFDA_BASE_URL = os.environ.get("OPENFDA_BASE_URL", "https://api.fda.gov")
+OPENFDA_LABELS = OPENFDA_BASE_URL + "/drug/label.json"
+
+# Label cache: in-process LRU backed by a SQLite file shared by all workers.
+# Set LABEL_CACHE_PATH to an empty string to keep the cache in memory only.
+label_cache = TieredCache(
+    "openfda_labels",
+    maxsize=int(os.environ.get("LABEL_CACHE_SIZE", 512)),
+    ttl=float(os.environ.get("LABEL_CACHE_TTL", 7 * 24 * 3600)),
+    stale_ttl=float(os.environ.get("LABEL_CACHE_STALE_TTL", 24 * 3600)),
+    negative_ttl=float(os.environ.get("LABEL_CACHE_NEGATIVE_TTL", 15 * 60)),
+    path=os.environ.get(
+        "LABEL_CACHE_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "labels.sqlite3"),
+    ),
+)
+
+# Offline label index built by `python label_index.py ingest ...`; consulted
+# before the cache and the live API. LABEL_INDEX_PATH="" disables it. While
+# there is no index file, it is looked for again every LABEL_INDEX_RECHECK
+# seconds, so an index built after startup is picked up.
+def _open_label_index():
+    from label_index import open_index
+    return open_index()
+
+label_index = Lazy(_open_label_index, recheck_none=float(os.environ.get("LABEL_INDEX_RECHECK", 60)))
+
+# Concurrent identical misses share one openFDA request / one LLM call
+label_flight = singleflight.Group("openfda_label")
+check_flight = singleflight.Group("compatibility_llm")
+
+def normalize_drug_name(drug: str) -> str:
+    """Cache key for a drug: its canonical generic name(s), see drug_names.normalize."""
+    return drug_names.normalize(drug)
+
+def _label_searches(name: str) -> List[str]:
+    """openFDA search expressions for a normalized name, most specific first."""
+    parts = drug_names.ingredients(name) or (name,)
+    searches = [" AND ".join(f'openfda.generic_name:"{p}"' for p in parts)]
+    if len(parts) == 1 and parts[0] not in drug_names.GENERICS:
+        # Names the synonym table doesn't know are often brands ("Junel", "Kyleena")
+        searches.append(f'openfda.brand_name:"{parts[0]}"')
+    return searches
+
+def _first_label(j: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    return (j.get("results") or [{}])[0]
+
+def _missing_label() -> Dict[str, Optional[str]]:
+    return {"id": None, "warnings": None, "precautions": None, "effective_time": None}
+
+def _fetch_label_live(name: str) -> Dict[str, Optional[str]]:
+    for search in _label_searches(name):
+        print(f"Fetching from {OPENFDA_LABELS}?search={search}")
+        try:
+            with metrics.span("openfda.label"):
+                r = http_client.get("openfda", OPENFDA_LABELS, params={"search": search, "limit": 1}, timeout=20)
+            label = _first_label(r.json())
+        except Exception:
+            return _missing_label()
+        if label.get("id"):
+            label["label_tokens"] = label_tokens(label)
+            return label
+    return _missing_label()
+
+async def _afetch_label_live(name: str) -> Dict[str, Optional[str]]:
+    for search in _label_searches(name):
+        print(f"Fetching from {OPENFDA_LABELS}?search={search}")
+        try:
+            with metrics.span("openfda.label"):
+                r = await http_client.aget("openfda", OPENFDA_LABELS, params={"search": search, "limit": 1}, timeout=20)
+            label = _first_label(r.json())
+        except Exception:
+            return _missing_label()
+        if label.get("id"):
+            label["label_tokens"] = label_tokens(label)
+            return label
+    return _missing_label()
+
+def _is_negative_label(label: Dict[str, Any]) -> bool:
+    # Failed and empty lookups have no label id; they get a short negative entry
+    return not label.get("id")
+
+def _indexed_label(name: str) -> Optional[Dict[str, Any]]:
+    index = label_index.get()
+    if index is None:
+        return None
+    with metrics.span("label_index"):
+        return index.lookup(name)
+
+def label_cached(drug: str) -> bool:
+    """Whether fetch_warn_prec(drug) would be answered locally (index or fresh cache entry)."""
+    name = normalize_drug_name(drug)
+    index = label_index.get()
+    return (index is not None and index.contains(name)) or label_cache.contains(name)
+
 def fetch_warn_prec(drug: str) -> Dict[str, Optional[str]]:
-    url = OPENFDA + drug
-    print(f"Fetching from {url}")
-    try:
-        r = requests.get(url, timeout=20)
-        j = r.json()
-        first = (j.get("results") or [{}])[0]
-        return first
-    except Exception:
-        return {"id": None, "warnings": None, "precautions": None, "effective_time": None}
+    name = normalize_drug_name(drug)
+    label = _indexed_label(name)
+    if label is not None:
+        return label
+    return label_cache.get_or_load(
+        name, lambda: label_flight.do(name, lambda: _fetch_label_live(name))[0], is_negative=_is_negative_label
+    )
+
+async def afetch_warn_prec(drug: str) -> Dict[str, Optional[str]]:
+    name = normalize_drug_name(drug)
+    label = await asyncio.to_thread(_indexed_label, name)
+    if label is not None:
+        return label
+    async def load():
+        return (await label_flight.ado(name, lambda: _afetch_label_live(name)))[0]
+    return await label_cache.aget_or_load(name, load, is_negative=_is_negative_label)
     
 
 class CompatibilityResult(BaseModel):
@@ -27,6 +141,9 @@ class CompatibilityResult(BaseModel):
     reasons: List[str]
     evidence_quotes: List[str] = []
 
+# (prompt inputs, result-cache key, pre-screen verdict or None)
+Prepared = Tuple[Dict[str, Any], str, Optional[CompatibilityResult]]
+
 # LLM + prompt (STRICT: use only warnings/precautions)
 SYSTEM = """You are a STRICT drug compatibility judge.
 
@@ -40,46 +157,312 @@ Rules:
 Output JSON with keys: verdict, reasons[], evidence_quotes[].
 """
 
-PROMPT = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM),
-    (
-        "user",
-        """ProposedDrug: {drug}
+USER = """ProposedDrug: {drug}
         PatientAllergies: {allergies}
         PatientConditions: {conditions}
         PatientOngoingMeds: {ongoingMeds}
 
-        FDA Label Sections: all information about the drug from the FDA label. {fda_label}
-        """,
-    ),
-])
+        FDA Label Sections: the clinically relevant sections of the drug's FDA label. {fda_label}
+        """
+
+MODEL = "gpt-4o-mini"
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0).with_structured_output(CompatibilityResult)
+class _Chains(NamedTuple):
+    prompt: Any
+    llm: Any
+    stream_llm: Any
+    config: Dict[str, Any]
+
+def _build_chains() -> _Chains:
+    # langchain_openai takes about a second to import, so it waits for the first use (or warmup())
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+
+    model = ChatOpenAI(model=MODEL, temperature=0)
+    return _Chains(
+        prompt=ChatPromptTemplate.from_messages([
+            ("system", SYSTEM),
+            ("user", USER),
+        ]),
+        llm=model.with_structured_output(CompatibilityResult),
+        # Same model with a JSON-schema (dict) output, whose parser yields partial
+        # dicts while tokens arrive; used by stream_check()
+        stream_llm=model.with_structured_output(CompatibilityResult.model_json_schema()),
+        config={"callbacks": [metrics.llm_usage_handler("compatibility")]},
+    )
+
+chains: Lazy[_Chains] = Lazy(_build_chains)
+
+def warmup(stores: bool = True) -> None:
+    """
+    Import LangChain and build the prompt and clients ahead of the first
+    request, and open the offline label index unless stores=False.
+    """
+    chains.get()
+    if stores:
+        label_index.get()
+
+def __getattr__(name: str) -> Any:
+    # PROMPT / llm / stream_llm used to be built at import; keep them reachable
+    if name in ("PROMPT", "llm", "stream_llm"):
+        c = chains.get()
+        return {"PROMPT": c.prompt, "llm": c.llm, "stream_llm": c.stream_llm}[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Bump PROMPT_REVISION for changes the prompt fingerprint can't see (e.g. schema or rules in code)
+PROMPT_REVISION = "1"
+result_cache = ResultCache("compatibility", MODEL, prompt_version(PROMPT_REVISION, SYSTEM, USER))
 
 # Chain:
 #   1) grab warn/prec via tool
 #   2) feed into prompt
 #   3) get structured verdict JSON
-def check(drug: str, allergies: List[str] | None = None, conditions: List[str] | None = None, ongoingMeds: List[str] | None = None) -> CompatibilityResult:
-    allergies = allergies or []
-    conditions = conditions or []
-
+def _prepare_inputs(
+    drug: str,
+    allergies: List[str],
+    conditions: List[str],
+    ongoingMeds: List[str],
+    meta: Dict[str, Any] | None = None,
+) -> Prepared:
+    """Prompt inputs for one drug, their result-cache key and any pre-screen verdict."""
     # Step 1: tool
     sections = fetch_warn_prec(drug)
-    print(sections)
+    return _label_inputs(drug, sections, allergies, conditions, ongoingMeds, meta)
+
+async def _aprepare_inputs(
+    drug: str,
+    allergies: List[str],
+    conditions: List[str],
+    ongoingMeds: List[str],
+    meta: Dict[str, Any] | None = None,
+) -> Prepared:
+    sections = await afetch_warn_prec(drug)
+    # Pre-screen, sentence ranking and token counting are CPU work; keep them off the loop
+    return await asyncio.to_thread(_label_inputs, drug, sections, allergies, conditions, ongoingMeds, meta)
+
+def _label_inputs(
+    drug: str,
+    sections: Dict[str, Any],
+    allergies: List[str],
+    conditions: List[str],
+    ongoingMeds: List[str],
+    meta: Dict[str, Any] | None,
+) -> Prepared:
+    with metrics.span("prescreen"):
+        verdict = prescreen.screen(drug, sections, allergies, conditions, ongoingMeds)
+    screened = CompatibilityResult(
+        verdict=verdict.verdict, reasons=verdict.reasons, evidence_quotes=verdict.evidence_quotes
+    ) if verdict is not None else None
+    if meta is not None:
+        meta["prescreen"] = verdict.rule if verdict is not None else None
+    with metrics.span("label_context"):
+        fda_label, context_stats = build_label_context(sections, allergies, conditions, ongoingMeds)
+    if meta is not None:
+        meta["label_context"] = context_stats
     # Step 2: if both missing → we can short-circuit to UNKNOWN (still via LLM to keep it uniform)
     inputs = {
         "drug": drug,
         "allergies": ", ".join(allergies) if allergies else "(none)",
         "conditions": ", ".join(conditions) if conditions else "(none)",
         "ongoingMeds": ", ".join(ongoingMeds) if ongoingMeds else "(none)",
-        "fda_label": json.dumps(sections),
+        "fda_label": fda_label,
     }
+    # Hash the lists themselves so their order and case don't matter, and
+    # canonical drug names so "Tylenol" and "Acetaminophen 500 MG" share a key
+    key = result_cache.key({
+        **inputs,
+        "drug": normalize_drug_name(drug),
+        "allergies": allergies,
+        "conditions": conditions,
+        "ongoingMeds": [normalize_drug_name(m) for m in ongoingMeds],
+    })
+    return inputs, key, screened
+
+def _cached_result(key: str, meta: Dict[str, Any] | None) -> Optional[CompatibilityResult]:
+    cached = result_cache.get(key)
+    if meta is not None:
+        meta["cached"] = cached is not None
+    return CompatibilityResult.model_validate(cached) if cached is not None else None
+
+def _local_result(key: str, screened: Optional[CompatibilityResult], meta: Dict[str, Any] | None) -> Optional[CompatibilityResult]:
+    """The pre-screen verdict or a result-cache hit, when either settles the check without the LLM."""
+    if screened is not None:
+        if meta is not None:
+            meta["cached"] = False
+        return screened
+    return _cached_result(key, meta)
 
-    # Step 3: run LLM with structured output
-    result: CompatibilityResult = (PROMPT | llm).invoke(inputs)
+def check(
+    drug: str,
+    allergies: List[str] | None = None,
+    conditions: List[str] | None = None,
+    ongoingMeds: List[str] | None = None,
+    meta: Dict[str, Any] | None = None,
+) -> CompatibilityResult:
+    """
+    Judge drug compatibility for a patient. If `meta` is given it is filled
+    with per-request diagnostics (e.g. meta["label_context"] token savings,
+    meta["cached"] for result-cache hits, meta["prescreen"] for the rule
+    that decided it without the LLM, meta["coalesced"] when the LLM result
+    came from an identical check already in flight).
+    """
+    inputs, key, screened = _prepare_inputs(drug, allergies or [], conditions or [], ongoingMeds or [], meta)
+    cached = _local_result(key, screened, meta)
+    if cached is not None:
+        return cached
+
+    # Step 3: run LLM with structured output (identical checks in flight share the call)
+    c = chains.get()
+    def invoke() -> CompatibilityResult:
+        result = (c.prompt | c.llm).invoke(inputs, config=c.config)
+        result_cache.set(key, result.model_dump())
+        return result
+    with metrics.span("llm.compatibility"):
+        result, shared = check_flight.do(key, invoke)
+    if meta is not None:
+        meta["coalesced"] = shared
     return result
 
+async def acheck(
+    drug: str,
+    allergies: List[str] | None = None,
+    conditions: List[str] | None = None,
+    ongoingMeds: List[str] | None = None,
+    meta: Dict[str, Any] | None = None,
+) -> CompatibilityResult:
+    """
+    check() on the running event loop: async label fetch and ainvoke(), with
+    the SQLite and CPU-bound steps in worker threads.
+    """
+    inputs, key, screened = await _aprepare_inputs(drug, allergies or [], conditions or [], ongoingMeds or [], meta)
+    cached = await asyncio.to_thread(_local_result, key, screened, meta)
+    if cached is not None:
+        return cached
+
+    # Building the chains imports LangChain; keep that off the loop if warm-up hasn't run
+    c = chains.get() if chains.ready else await asyncio.to_thread(chains.get)
+    async def ainvoke() -> CompatibilityResult:
+        result = await (c.prompt | c.llm).ainvoke(inputs, config=c.config)
+        await result_cache.aset(key, result.model_dump())
+        return result
+    with metrics.span("llm.compatibility"):
+        result, shared = await check_flight.ado(key, ainvoke)
+    if meta is not None:
+        meta["coalesced"] = shared
+    return result
+
+def stream_check(
+    drug: str,
+    allergies: List[str] | None = None,
+    conditions: List[str] | None = None,
+    ongoingMeds: List[str] | None = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    check() as a sequence of (event, data) pairs: "stage" progress events,
+    then "verdict", each "reason" and "evidence" as soon as the model has
+    produced it, and finally the validated "result".
+    """
+    meta: Dict[str, Any] = {}
+    inputs, key, screened = _prepare_inputs(drug, allergies or [], conditions or [], ongoingMeds or [], meta)
+    yield "stage", {"stage": "label_fetched", "label_context": meta["label_context"]}
+
+    result = _local_result(key, screened, meta)
+    if result is None:
+        yield "stage", {"stage": "llm_started"}
+        reasons, quotes = ListItemTracker("reasons"), ListItemTracker("evidence_quotes")
+        verdict_sent = False
+        partial: Dict[str, Any] = {}
+        c = chains.get()
+        for partial in (c.prompt | c.stream_llm).stream(inputs, config=c.config):
+            # The verdict string is complete once the model has moved on to the next key
+            if not verdict_sent and partial.get("verdict") and "reasons" in partial:
+                yield "verdict", {"verdict": partial["verdict"]}
+                verdict_sent = True
+            for reason in reasons.completed(partial):
+                yield "reason", {"reason": reason}
+            for quote in quotes.completed(partial):
+                yield "evidence", {"quote": quote}
+        result = CompatibilityResult.model_validate(partial)
+        result_cache.set(key, result.model_dump())
+        if not verdict_sent:
+            yield "verdict", {"verdict": result.verdict}
+        for reason in reasons.completed(partial, final=True):
+            yield "reason", {"reason": reason}
+        for quote in quotes.completed(partial, final=True):
+            yield "evidence", {"quote": quote}
+    else:
+        yield "verdict", {"verdict": result.verdict}
+        for reason in result.reasons:
+            yield "reason", {"reason": reason}
+        for quote in result.evidence_quotes:
+            yield "evidence", {"quote": quote}
+
+    yield "result", {"result": result.model_dump(), "meta": meta}
+
+def check_many(
+    drugs: List[str],
+    allergies: List[str] | None = None,
+    conditions: List[str] | None = None,
+    ongoingMeds: List[str] | None = None,
+    max_concurrency: int = BATCH_CONCURRENCY,
+) -> List[Tuple[CompatibilityResult | Exception, Dict[str, Any]]]:
+    """
+    check() for several drugs against one patient. Labels are fetched
+    concurrently and the LLM calls go through one chain.batch(), so the
+    wall-clock time is close to the slowest drug. Checks already in flight
+    (from check() or another batch) are joined through check_flight, and
+    only the rest are batched. Returns one (result or exception, meta)
+    pair per drug, in input order.
+    """
+    allergies, conditions, ongoingMeds = allergies or [], conditions or [], ongoingMeds or []
+    metas: List[Dict[str, Any]] = [{} for _ in drugs]
+    if not drugs:
+        return []
+
+    def prepare(i: int):
+        try:
+            return _prepare_inputs(drugs[i], allergies, conditions, ongoingMeds, metas[i])
+        except Exception as e:
+            return e
+
+    workers = max(1, min(max_concurrency, len(drugs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="label-fetch") as pool:
+        # Run each fetch in a copy of this thread's context so the request's timing breakdown follows it
+        futures = [pool.submit(contextvars.copy_context().run, prepare, i) for i in range(len(drugs))]
+        prepared = [f.result() for f in futures]
+
+    results: List[Any] = list(prepared)
+    ready = []
+    for i, p in enumerate(prepared):
+        if isinstance(p, Exception):
+            continue
+        cached = _local_result(p[1], p[2], metas[i])
+        if cached is not None:
+            results[i] = cached
+        else:
+            ready.append(i)
+
+    inputs_by_key = {prepared[i][1]: prepared[i][0] for i in ready}
+
+    def invoke(keys: List[str]) -> List[Any]:
+        c = chains.get()
+        outputs = (c.prompt | c.llm).batch(
+            [inputs_by_key[key] for key in keys],
+            config={**c.config, "max_concurrency": workers},
+            return_exceptions=True,
+        )
+        for key, out in zip(keys, outputs):
+            if isinstance(out, CompatibilityResult):
+                result_cache.set(key, out.model_dump())
+        return outputs
+
+    with metrics.span("llm.compatibility_batch"):
+        outcomes = check_flight.do_many([prepared[i][1] for i in ready], invoke) if ready else []
+    for i, (out, shared) in zip(ready, outcomes):
+        results[i] = out
+        metas[i]["coalesced"] = shared
+    return list(zip(results, metas))
+
 if __name__ == "__main__":
     out = check(
         drug="aspirin",
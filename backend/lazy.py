@@ -0,0 +1,54 @@
+"""
+Thread-safe lazily built singletons, for objects that are slow to import or
+construct (LangChain chains and their OpenAI clients, database engines).
+
+    chains = Lazy(_build_chains)
+    chains.get()   # built on first use, exactly once across threads
+    chains.ready   # True once built
+
+A factory that raises is retried on the next get(). With `recheck_none`, a
+factory that returns None (e.g. an index file that hasn't been built yet)
+is called again once that many seconds have passed.
+"""
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_UNSET = object()
+
+
+class Lazy(Generic[T]):
+    def __init__(self, factory: Callable[[], T], recheck_none: Optional[float] = None):
+        self._factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+        self._recheck_none = recheck_none
+        self._recheck_at = 0.0
+        self.error: Optional[BaseException] = None
+
+    def _stale(self, value) -> bool:
+        if value is _UNSET:
+            return True
+        return value is None and self._recheck_none is not None and time.monotonic() >= self._recheck_at
+
+    def get(self) -> T:
+        value = self._value
+        if self._stale(value):
+            with self._lock:
+                value = self._value
+                if self._stale(value):
+                    try:
+                        value = self._value = self._factory()
+                        self.error = None
+                    except BaseException as e:
+                        self.error = e
+                        raise
+                    if value is None and self._recheck_none is not None:
+                        self._recheck_at = time.monotonic() + self._recheck_none
+        return value  # type: ignore[return-value]
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not _UNSET
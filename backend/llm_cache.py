@@ -0,0 +1,72 @@
+"""
+Result cache for the temperature-0 structured-output chains.
+
+Keys are a SHA-256 over the model name, the prompt version and the rendered
+prompt inputs in canonical form (strings whitespace-collapsed and
+case-folded, lists of strings also sorted). The prompt version includes a
+fingerprint of the prompt text, so editing SYSTEM moves lookups to new keys;
+entries under the old ones simply expire and are swept from disk.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from cache import TieredCache
+
+BACKEND = os.environ.get("LLM_CACHE_BACKEND", "disk").lower()  # "memory" or "disk"
+_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm.sqlite3")
+
+
+def canonical(value: Any) -> Any:
+    """Normalize inputs for a cache key: whitespace and case folded, string lists sorted."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        items = [canonical(v) for v in value]
+        return sorted(items) if all(isinstance(v, str) for v in items) else items
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in value.items()}
+    return value
+
+
+def prompt_version(revision: str, *prompt_texts: str) -> str:
+    digest = hashlib.sha256("\x1e".join(prompt_texts).encode()).hexdigest()[:12]
+    return f"{revision}-{digest}"
+
+
+class ResultCache:
+    def __init__(self, name: str, model: str, version: str):
+        self.model = model
+        self.version = version
+        self.cache = TieredCache(
+            f"llm:{name}",
+            maxsize=int(os.environ.get("LLM_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("LLM_CACHE_TTL", 24 * 3600)),
+            path=os.environ.get("LLM_CACHE_PATH", _DEFAULT_PATH) if BACKEND == "disk" else None,
+        )
+
+    def key(self, inputs: Dict[str, Any]) -> str:
+        payload = {"model": self.model, "prompt_version": self.version, "inputs": canonical(inputs)}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.cache.set(key, value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self.cache.aget(key)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        await self.cache.aset(key, value)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        out = self.cache.stats()
+        out["backend"] = BACKEND
+        out["prompt_version"] = self.version
+        return out
@@ -0,0 +1,216 @@
+"""
+In-process metrics rendered in the Prometheus text format on /metrics.
+
+    with metrics.span("openfda.label"):
+        ...
+
+span() observes stage_duration_seconds{stage=...} and, inside a request,
+adds the stage to that request's timing breakdown (served as a
+Server-Timing header when asked for). Other modules record counters and
+histograms directly; stats() dicts from the caches and the HTTP client are
+exported as gauges through register_stats().
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series: Dict[LabelKey, List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = "+Inf" if math.isinf(bound) else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', le))} {_fmt_value(count)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(series[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {_fmt_value(series[-1])}")
+        return lines
+
+
+# -----------------------
+# Registry
+# -----------------------
+_metrics: List[Any] = []
+# prefix -> (label, source); registering a prefix again (another create_app()) replaces it
+_stats_sources: Dict[str, Tuple[str, Callable[[], Dict[str, Dict[str, Any]]]]] = {}
+
+
+def counter(name: str, help: str) -> Counter:
+    m = Counter(name, help)
+    _metrics.append(m)
+    return m
+
+
+def histogram(name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+    m = Histogram(name, help, buckets)
+    _metrics.append(m)
+    return m
+
+
+def register_stats(prefix: str, label: str, source: Callable[[], Dict[str, Dict[str, Any]]]) -> None:
+    """
+    Export the numeric fields of source() -> {label_value: stats_dict} as
+    gauges named {prefix}_{field}. The latest registration of a prefix wins.
+    """
+    _stats_sources[prefix] = (label, source)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _metrics:
+        lines += m.render()
+    for prefix, (label, source) in list(_stats_sources.items()):
+        try:
+            groups = source()
+        except Exception as e:
+            lines.append(f"# {prefix} stats unavailable: {e}")
+            continue
+        series: Dict[str, List[str]] = {}
+        for label_value, stats in groups.items():
+            for field, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{field}"
+                series.setdefault(name, []).append(f'{name}{{{label}="{label_value}"}} {_fmt_value(value)}')
+        for name, samples in series.items():
+            lines += [f"# TYPE {name} gauge"] + samples
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------
+# Standard metrics
+# -----------------------
+stage_seconds = histogram("stage_duration_seconds", "Time spent per pipeline stage.")
+request_seconds = histogram("http_request_duration_seconds", "Request latency by endpoint and status.")
+response_bytes = histogram("http_response_bytes", "Response payload size by endpoint.", BYTES_BUCKETS)
+upstream_seconds = histogram("upstream_request_duration_seconds", "Upstream HTTP latency per attempt.")
+upstream_bytes = histogram("upstream_response_bytes", "Upstream response payload size.", BYTES_BUCKETS)
+upstream_requests = counter("upstream_requests_total", "Upstream HTTP attempts by status.")
+upstream_retries = counter("upstream_retries_total", "Upstream HTTP retries.")
+llm_tokens = counter("llm_tokens_total", "LLM tokens by chain and type (prompt/completion).")
+llm_prompt_tokens = histogram("llm_prompt_tokens", "Prompt tokens per LLM call.", TOKEN_BUCKETS)
+
+
+# -----------------------
+# Spans and per-request breakdown
+# -----------------------
+_breakdown: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("timing_breakdown", default=None)
+
+
+def begin_request() -> None:
+    _breakdown.set([])
+
+
+def breakdown() -> List[Tuple[str, float]]:
+    return list(_breakdown.get() or [])
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _breakdown.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """Sum repeated stages and format them for a Server-Timing header."""
+    totals: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={1000 * elapsed:.1f}" for stage, elapsed in totals.items())
+
+
+# -----------------------
+# LLM token usage
+# -----------------------
+def llm_usage_handler(chain: str):
+    """LangChain callback that counts prompt/completion tokens for one chain."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class _UsageHandler(BaseCallbackHandler):
+        def on_llm_end(self, response, **kwargs) -> None:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            if not usage:
+                for generations in response.generations:
+                    for gen in generations:
+                        meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                        usage = {"prompt_tokens": meta.get("input_tokens", 0), "completion_tokens": meta.get("output_tokens", 0)}
+            prompt, completion = usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+            if prompt or completion:
+                llm_tokens.inc(prompt, chain=chain, type="prompt")
+                llm_tokens.inc(completion, chain=chain, type="completion")
+                llm_prompt_tokens.observe(prompt, chain=chain)
+
+    return _UsageHandler()
@@ -0,0 +1,351 @@
+"""
+Patient profiles parsed from patientData.csv.
+
+The CSV keeps each patient's allergies, conditions and active medications
+as one comma-joined string with SNOMED-style semantic tags, e.g.
+"Childhood asthma (disorder), Fish (substance)". They are split and
+cleaned once at load time so requests can pass them straight to check().
+
+PatientStore holds the parsed CSV for request handlers: an O(1) id index,
+the /api/user JSON pre-serialized for every row, a search index, and the
+profiles above with each medication's canonical generic name precomputed.
+"""
+import csv
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+import drug_names
+
+# Trailing SNOMED semantic tag: "(disorder)", "(finding)", "(substance)", ...
+_SEMANTIC_TAG = re.compile(r"\s*\([a-z][a-z ]*\)\s*$")
+_EMPTY = {"", "none", "nan", "null", "n/a"}
+
+
+class PatientProfile(BaseModel):
+    patient_id: int
+    allergies: List[str] = []
+    conditions: List[str] = []
+    ongoing_meds: List[str] = []
+    # Canonical generic names of ongoing_meds (drug_names.normalize), the
+    # same keys the label and result caches use
+    medication_keys: List[str] = []
+
+
+def parse_terms(value: Any) -> List[str]:
+    """
+    Split a comma-joined CSV cell into clean terms: semantic tags stripped,
+    whitespace collapsed, "None" placeholders dropped and duplicates removed
+    (case-insensitively, keeping the first spelling).
+    """
+    if not isinstance(value, str):
+        return []
+    out, seen = [], set()
+    for part in value.split(","):
+        term = " ".join(_SEMANTIC_TAG.sub("", part).split())
+        key = term.casefold()
+        if key in _EMPTY or key in seen:
+            continue
+        seen.add(key)
+        out.append(term)
+    return out
+
+
+def build_profile(row: Dict[str, Any]) -> Optional[PatientProfile]:
+    """PatientProfile for one CSV row (a dict keyed by column), or None without a valid Patient_ID."""
+    try:
+        patient_id = int(row["Patient_ID"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    ongoing_meds = parse_terms(row.get("Active_Medications"))
+    return PatientProfile(
+        patient_id=patient_id,
+        allergies=parse_terms(row.get("Allergies")),
+        conditions=parse_terms(row.get("Conditions")),
+        ongoing_meds=ongoing_meds,
+        medication_keys=list(dict.fromkeys(drug_names.normalize(m) for m in ongoing_meds)),
+    )
+
+
+def build_profiles(rows: Iterable[Dict[str, Any]]) -> Dict[int, PatientProfile]:
+    """Map Patient_ID -> PatientProfile for CSV rows (dicts keyed by column)."""
+    profiles: Dict[int, PatientProfile] = {}
+    for row in rows:
+        profile = build_profile(row)
+        if profile is not None:
+            profiles[profile.patient_id] = profile
+    return profiles
+
+
+# Query field -> how its terms are split into index keys
+SEARCH_FIELDS = ("allergy", "condition", "medication")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _search_keys(field: str, term: str) -> List[str]:
+    """
+    Index keys for a term: medications by canonical ingredient ("Pulmicort"
+    and "budesonide 0.25 MG/ML Inhalation Suspension" both -> budesonide),
+    allergies and conditions by word, so "asthma" finds "Childhood asthma".
+    """
+    if field == "medication":
+        return list(drug_names.ingredients(term))
+    return list(dict.fromkeys(_WORD.findall(_SEMANTIC_TAG.sub("", term).casefold())))
+
+
+class _InvertedIndex:
+    """
+    field -> key -> bitmap of row numbers, one Python int per posting list,
+    so AND/OR are single big-int operations and counts are bit_count().
+
+    Multi-key terms must match within one entry ("childhood asthma" is not a
+    patient with "Childhood obesity" and "Adult-onset asthma"), so every
+    distinct entry (its key set) also gets a bitmap of the rows that have it.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, PatientProfile]]):
+        row_lists: Dict[str, Dict[str, List[int]]] = {field: {} for field in SEARCH_FIELDS}
+        entry_lists: Dict[str, Dict[FrozenSet[str], List[int]]] = {field: {} for field in SEARCH_FIELDS}
+        for row_no, profile in rows:
+            for field, terms in (
+                ("allergy", profile.allergies),
+                ("condition", profile.conditions),
+                ("medication", profile.ongoing_meds),
+            ):
+                lists = row_lists[field]
+                for term in terms:
+                    keys = _search_keys(field, term)
+                    for key in keys:
+                        lists.setdefault(key, []).append(row_no)
+                    if len(keys) > 1:
+                        entry_lists[field].setdefault(frozenset(keys), []).append(row_no)
+        self.postings: Dict[str, Dict[str, int]] = {
+            field: {key: _bitmap(row_nos) for key, row_nos in lists.items()}
+            for field, lists in row_lists.items()
+        }
+        self.entries: Dict[str, Dict[FrozenSet[str], int]] = {
+            field: {keys: _bitmap(row_nos) for keys, row_nos in lists.items()}
+            for field, lists in entry_lists.items()
+        }
+        # key -> the multi-key entries holding it, to find an entry's candidates without a full scan
+        self.entries_by_key: Dict[str, Dict[str, List[FrozenSet[str]]]] = {field: {} for field in SEARCH_FIELDS}
+        for field, entries in self.entries.items():
+            for keys in entries:
+                for key in keys:
+                    self.entries_by_key[field].setdefault(key, []).append(keys)
+
+    def term(self, field: str, term: str) -> int:
+        """Rows whose field has an entry containing every key of term."""
+        keys = _search_keys(field, term)
+        if not keys:
+            return 0
+        if len(keys) == 1:
+            return self.postings[field].get(keys[0], 0)
+        wanted = frozenset(keys)
+        by_key = self.entries_by_key[field]
+        candidates = min((by_key.get(key, []) for key in wanted), key=len)
+        entries = self.entries[field]
+        bits = 0
+        for entry in candidates:
+            if wanted <= entry:
+                bits |= entries[entry]
+        return bits
+
+
+def _bitmap(row_nos: List[int]) -> int:
+    # Set bits in a byte buffer and convert once; OR-ing into an int bit by bit is quadratic
+    buf = bytearray(max(row_nos) // 8 + 1)
+    for row_no in row_nos:
+        buf[row_no >> 3] |= 1 << (row_no & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _rows(bits: int, offset: int, limit: int) -> List[int]:
+    """Row numbers of the set bits, ascending, skipping the first `offset`."""
+    if bits <= 0 or limit <= 0:
+        return []
+    out: List[int] = []
+    words = memoryview(bits.to_bytes((bits.bit_length() + 63) // 64 * 8, "little")).cast("Q")
+    for i, word in enumerate(words):
+        if not word:
+            continue
+        if offset:
+            n = word.bit_count()
+            if offset >= n:
+                offset -= n
+                continue
+        while word:
+            low = word & -word
+            if offset:
+                offset -= 1
+            else:
+                out.append(i * 64 + low.bit_length() - 1)
+                if len(out) == limit:
+                    return out
+            word ^= low
+    return out
+
+
+class _Snapshot:
+    """
+    One immutable load of the CSV, built once (in create_app, so before
+    gunicorn forks with --preload) and then only read.
+
+    Row JSON lives in a single bytes blob sliced by an offsets array, a few
+    large objects whose pages forked workers keep sharing. Profiles and the
+    search index are ordinary Python objects, materialised up front so no
+    request re-parses a row; the trade-off is memory, since a worker that
+    reads them bumps refcounts and so gets private copies of the pages it
+    touches, over time up to a full copy per worker.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], mtime: Optional[float]):
+        self.mtime = mtime
+        self.loaded = mtime is not None
+        self.ids = array("q")
+        self.offsets = array("Q", [0])
+        chunks = []
+        for row in rows:
+            try:
+                patient_id = int(row["Patient_ID"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            record = {k: (None if (v or "").strip() in ("", "None") else v) for k, v in row.items()}
+            record["Patient_ID"] = patient_id
+            chunk = json.dumps(record, sort_keys=True, separators=(",", ":")).encode()
+            chunks.append(chunk)
+            self.ids.append(patient_id)
+            self.offsets.append(self.offsets[-1] + len(chunk))
+        self.blob = b"".join(chunks)
+        # A repeated Patient_ID keeps its last row, the one row_json() returns
+        self.profiles = build_profiles(rows)
+
+        # Dense ids (the usual case) get a direct-address table, sparse ones a dict
+        n = len(self.ids)
+        max_id = max(self.ids) if n else -1
+        if n and min(self.ids) >= 0 and max_id < 2 * n + 1024:
+            slots = array("l", [-1]) * (max_id + 1)
+            for row_no, patient_id in enumerate(self.ids):
+                slots[patient_id] = row_no
+            self._slots = slots
+            self._index = None
+        else:
+            self._slots = None
+            self._index = {patient_id: row_no for row_no, patient_id in enumerate(self.ids)}
+        self.search_index = _InvertedIndex((self.row_no(pid), p) for pid, p in self.profiles.items())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_no(self, patient_id: int) -> int:
+        if self._slots is not None:
+            return self._slots[patient_id] if 0 <= patient_id < len(self._slots) else -1
+        return self._index.get(patient_id, -1)
+
+    def row_json(self, patient_id: int) -> Optional[bytes]:
+        row_no = self.row_no(patient_id)
+        if row_no < 0:
+            return None
+        return self.blob[self.offsets[row_no]:self.offsets[row_no + 1]]
+
+    def profile(self, patient_id: int) -> Optional[PatientProfile]:
+        return self.profiles.get(patient_id)
+
+    def search(
+        self, terms: List[Tuple[str, str]], match_all: bool = True, offset: int = 0, limit: int = 50
+    ) -> Tuple[int, List[PatientProfile], Dict[str, int]]:
+        """(total matches, one page of profiles in Patient_ID file order, match count per term)."""
+        counts: Dict[str, int] = {}
+        bits = -1 if match_all else 0
+        for field, term in terms:
+            term_bits = self.search_index.term(field, term)
+            counts[f"{field}:{term}"] = term_bits.bit_count()
+            bits = bits & term_bits if match_all else bits | term_bits
+        if not terms:
+            bits = 0
+        page = [self.profile(self.ids[row_no]) for row_no in _rows(bits, offset, limit)]
+        return bits.bit_count(), page, counts
+
+
+class PatientStore:
+    """
+    Patient lookups backed by patientData.csv. The file is read on first
+    use (create_app asks at once, so before any fork), then its mtime is
+    checked at most every
+    `check_interval` seconds; when it changes, a new snapshot is built off
+    to the side and swapped in with a single assignment, so readers always
+    see either the old or the new data in full.
+    """
+
+    def __init__(self, path: str, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._snapshot: Optional[_Snapshot] = None
+
+    def _load(self) -> _Snapshot:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+        except FileNotFoundError:
+            print(f"We have an issue, the user data CSV was not found at {self.path}. Our user endpoint fails.")
+            return _Snapshot([], None)
+        print(f"The user data loading worked {self.path} ({len(rows)} rows)")
+        return _Snapshot(rows, mtime)
+
+    def snapshot(self) -> _Snapshot:
+        if self._snapshot is None:
+            # First use: everyone waits for the initial load
+            with self._lock:
+                if self._snapshot is None:
+                    self._checked_at = time.monotonic()
+                    self._snapshot = self._load()
+            return self._snapshot
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._snapshot
+        # Only one thread stats/reloads; the rest keep using the current snapshot
+        if not self._lock.acquire(blocking=False):
+            return self._snapshot
+        try:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != self._snapshot.mtime:
+                try:
+                    self._snapshot = self._load()
+                except Exception as e:
+                    print(f"Reloading {self.path} failed, keeping the previous data: {e}")
+        finally:
+            self._lock.release()
+        return self._snapshot
+
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot().loaded
+
+    def __len__(self) -> int:
+        return len(self.snapshot())
+
+    def user_json(self, patient_id: int) -> Optional[bytes]:
+        """Pre-serialized CSV row for /api/user, or None."""
+        return self.snapshot().row_json(patient_id)
+
+    def profile(self, patient_id: int) -> Optional[PatientProfile]:
+        return self.snapshot().profile(patient_id)
+
+    def search(
+        self, terms: List[Tuple[str, str]], match_all: bool = True, offset: int = 0, limit: int = 50
+    ) -> Tuple[int, List[PatientProfile], Dict[str, int]]:
+        """Patients matching (field, term) pairs, field in SEARCH_FIELDS; see _Snapshot.search."""
+        return self.snapshot().search(terms, match_all, offset, limit)
@@ -0,0 +1,140 @@
+"""
+Background prefetch of openFDA labels for a patient's medications.
+
+Opening a patient profile is usually followed by compatibility checks
+against that patient's active medications. schedule() queues label fetches
+for those drugs, plus candidates commonly prescribed alongside them
+(CO_PRESCRIBED), on a small thread pool, so the follow-up check() finds
+the label already cached.
+
+Names already queued are skipped; whether a name is already cached is
+checked on the pool (it can mean SQLite reads), and cached names are
+dropped there without spending a fetch token. Fetches are paced by
+their own token bucket so prefetching can't use up the openFDA budget that
+live requests need, and anything past `max_pending` is dropped instead of
+queued.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
+
+from http_client import TokenBucket
+
+# Canonical generic -> drugs often started alongside it or offered instead,
+# i.e. the likely next compatibility check. Keep names as drug_names.normalize
+# returns them.
+CO_PRESCRIBED: Dict[str, List[str]] = {
+    # cardiovascular
+    "simvastatin": ["atorvastatin", "ezetimibe", "aspirin"],
+    "atorvastatin": ["rosuvastatin", "ezetimibe", "aspirin"],
+    "lisinopril": ["amlodipine", "hydrochlorothiazide", "losartan"],
+    "losartan": ["amlodipine", "hydrochlorothiazide"],
+    "amlodipine": ["lisinopril", "hydrochlorothiazide"],
+    "hydrochlorothiazide": ["lisinopril", "amlodipine", "potassium chloride"],
+    "metoprolol": ["carvedilol", "aspirin", "nitroglycerin"],
+    "nitroglycerin": ["aspirin", "metoprolol", "clopidogrel"],
+    "clopidogrel": ["aspirin", "omeprazole", "prasugrel"],
+    "prasugrel": ["aspirin", "clopidogrel"],
+    "warfarin": ["apixaban", "acetaminophen"],
+    # analgesics
+    "naproxen": ["ibuprofen", "acetaminophen", "omeprazole"],
+    "ibuprofen": ["acetaminophen", "naproxen"],
+    "acetaminophen": ["ibuprofen", "naproxen"],
+    "acetaminophen and hydrocodone": ["acetaminophen", "ibuprofen", "naloxone"],
+    "acetaminophen and oxycodone": ["acetaminophen", "ibuprofen", "naloxone"],
+    "fentanyl": ["naloxone", "acetaminophen"],
+    # respiratory and allergy
+    "albuterol": ["budesonide", "fluticasone", "montelukast"],
+    "budesonide": ["albuterol", "montelukast"],
+    "fluticasone": ["albuterol", "montelukast"],
+    "epinephrine": ["diphenhydramine", "cetirizine", "prednisone"],
+    "loratadine": ["cetirizine", "fexofenadine", "diphenhydramine"],
+    "cetirizine": ["loratadine", "fexofenadine"],
+    # endocrine and other
+    "metformin": ["glipizide", "atorvastatin", "lisinopril"],
+    "insulin human": ["metformin", "insulin glargine"],
+    "alendronate": ["calcium carbonate", "cholecalciferol"],
+    "ferrous sulfate": ["docusate", "ascorbic acid"],
+    "cyanocobalamin": ["folic acid"],
+    "amoxicillin": ["azithromycin", "cephalexin", "doxycycline"],
+}
+
+
+class LabelPrefetcher:
+    def __init__(
+        self,
+        fetch: Callable[[str], Any],
+        is_cached: Callable[[str], bool],
+        workers: int = 2,
+        rate: float = 2.0,
+        max_pending: int = 64,
+        co_prescribed: int = 2,
+    ):
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.workers = workers
+        self.max_pending = max_pending
+        self.co_prescribed = co_prescribed
+        self.bucket = TokenBucket(rate)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="label-prefetch")
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._counters = {"scheduled": 0, "already_cached": 0, "already_pending": 0, "dropped": 0, "fetched": 0, "failed": 0}
+
+    def candidates(self, medications: Iterable[str]) -> List[str]:
+        """The medications themselves first, then up to `co_prescribed` companions of each."""
+        meds = list(dict.fromkeys(medications))
+        extra = [c for m in meds for c in CO_PRESCRIBED.get(m, [])[:self.co_prescribed]]
+        return list(dict.fromkeys(meds + extra))
+
+    def schedule(self, medications: Iterable[str]) -> Dict[str, int]:
+        """
+        Queue label fetches for medications (canonical names) and their
+        companions; never blocks, and does no I/O on the caller's thread.
+        """
+        out = {"scheduled": 0, "skipped": 0}
+        for name in self.candidates(medications):
+            with self._lock:
+                if name in self._pending:
+                    self._counters["already_pending"] += 1
+                    out["skipped"] += 1
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self._counters["dropped"] += 1
+                    out["skipped"] += 1
+                    continue
+                self._pending.add(name)
+                self._counters["scheduled"] += 1
+            self._pool.submit(self._run, name)
+            out["scheduled"] += 1
+        return out
+
+    def _run(self, name: str) -> None:
+        try:
+            if self.is_cached(name):
+                self._count("already_cached")
+                return
+            wait = self.bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            self.fetch(name)
+            self._count("fetched")
+        except Exception as e:
+            print(f"[prefetch] {name}: {e}")
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out["pending"] = len(self._pending)
+        out["workers"] = self.workers
+        out["rate_per_s"] = self.bucket.rate
+        return out
@@ -0,0 +1,297 @@
+"""
+Rule-based pre-screen that runs before the compatibility LLM.
+
+Only clear-cut hard stops are decided locally:
+
+- allergy_class: the patient is allergic to the proposed drug, or to a drug
+  class it belongs to (penicillin allergy -> amoxicillin).
+- contraindicated_condition / contraindicated_medication: a sentence in the
+  label's contraindications (or a "do not use" sentence in the boxed
+  warning, warnings or OTC do-not-use section) names one of the patient's
+  conditions or ongoing meds, directly or through the synonym tables.
+
+Anything softer goes to the LLM. That includes caution-level wording,
+restrictions qualified by severity, activity or history ("severe renal
+impairment", "active peptic ulcer"), and restrictions that only apply
+together with another drug or to a population such as children.
+"""
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import drug_names
+import metrics
+from label_context import section_text, sentences
+
+ENABLED = os.environ.get("PRESCREEN", "true").lower() == "true"
+
+# class -> (names for the class in labels and allergy lists, member generic names)
+DRUG_CLASSES: Dict[str, Tuple[List[str], List[str]]] = {
+    "penicillins": (
+        ["penicillin", "penicillins"],
+        ["amoxicillin", "ampicillin", "penicillin", "penicillin v", "penicillin g", "piperacillin", "nafcillin",
+         "oxacillin", "dicloxacillin"],
+    ),
+    "cephalosporins": (
+        ["cephalosporin", "cephalosporins"],
+        ["cephalexin", "cefazolin", "cefuroxime", "ceftriaxone", "cefdinir", "cefpodoxime", "cefadroxil", "cefepime"],
+    ),
+    "sulfonamide antibiotics": (
+        ["sulfa", "sulfonamide", "sulfonamides"],
+        ["sulfamethoxazole", "sulfadiazine", "sulfasalazine"],
+    ),
+    "macrolides": (["macrolide", "macrolides"], ["erythromycin", "azithromycin", "clarithromycin"]),
+    "fluoroquinolones": (
+        ["fluoroquinolone", "fluoroquinolones", "quinolone", "quinolones"],
+        ["ciprofloxacin", "levofloxacin", "moxifloxacin", "ofloxacin"],
+    ),
+    "tetracyclines": (["tetracycline", "tetracyclines"], ["doxycycline", "minocycline", "tetracycline"]),
+    "NSAIDs": (
+        ["nsaid", "nsaids", "nonsteroidal anti-inflammatory", "salicylate", "salicylates"],
+        ["aspirin", "ibuprofen", "naproxen", "diclofenac", "celecoxib", "meloxicam", "ketorolac", "indomethacin"],
+    ),
+    "ACE inhibitors": (
+        ["ace inhibitor", "ace inhibitors", "angiotensin converting enzyme inhibitor",
+         "angiotensin-converting enzyme inhibitor"],
+        ["lisinopril", "enalapril", "ramipril", "captopril", "benazepril", "quinapril", "fosinopril"],
+    ),
+    "opioids": (
+        ["opioid", "opioids", "opiate", "opiates"],
+        ["codeine", "morphine", "oxycodone", "hydrocodone", "tramadol", "fentanyl", "hydromorphone", "methadone"],
+    ),
+    "MAO inhibitors": (
+        ["maoi", "maois", "monoamine oxidase inhibitor", "monoamine oxidase inhibitors"],
+        ["phenelzine", "selegiline", "tranylcypromine", "isocarboxazid", "rasagiline"],
+    ),
+    "statins": (
+        ["statin", "statins", "hmg-coa reductase inhibitor"],
+        ["atorvastatin", "simvastatin", "rosuvastatin", "pravastatin", "lovastatin"],
+    ),
+    "anticoagulants": (
+        ["anticoagulant", "anticoagulants", "blood thinner", "blood thinners"],
+        ["warfarin", "apixaban", "rivaroxaban", "dabigatran", "heparin", "enoxaparin"],
+    ),
+}
+
+# concept -> (regex for how patient condition lists phrase it, regex for how labels phrase it).
+# Both sides must name the same concept: "ulcer" alone would take a pressure
+# ulcer for a peptic one, and "kidney" a kidney stone for renal impairment.
+CONDITION_SYNONYMS: Dict[str, Tuple[str, str]] = {
+    "asthma": (r"\basthma", r"asthma"),
+    "angioedema": (r"\bangioedema", r"angioedema"),
+    "pregnancy": (r"\bpregnan(?:t|cy)\b", r"pregnan\w*"),
+    "renal impairment": (
+        r"\brenal (?:impairment|failure|insufficiency|disease)|\bkidney (?:failure|disease)",
+        r"renal (?:impairment|failure|disease|insufficiency)|kidney (?:disease|failure)",
+    ),
+    "hepatic impairment": (
+        r"\bhepatic (?:impairment|failure|insufficiency|disease)|\bliver (?:failure|disease)|\bcirrhosis",
+        r"hepatic (?:impairment|failure|disease|insufficiency)|liver (?:disease|failure)|cirrhosis",
+    ),
+    "bleeding disorder": (
+        r"\bbleeding disorder|\bhemophilia|\bhaemophilia|\bcoagulopathy|\bvon willebrand",
+        r"bleeding disorders?|hemophilia|coagulopathy",
+    ),
+    "peptic ulcer": (
+        r"\b(?:peptic|stomach|gastric|duodenal|gastrointestinal|gi) ulcer",
+        r"(?:peptic|stomach|gastric|duodenal|gastrointestinal|gi) ulcers?|ulcer disease",
+    ),
+    "heart failure": (r"\bheart failure|\bcardiac failure", r"heart failure"),
+    "seizure disorder": (r"\bseizure disorder|\bepilep", r"seizure disorders?|epilep\w*"),
+    "myasthenia gravis": (r"\bmyasthenia", r"myasthenia gravis"),
+    "glaucoma": (r"\bglaucoma", r"glaucoma"),
+    "porphyria": (r"\bporphyria", r"porphyria"),
+    "mononucleosis": (r"\bmononucleosis", r"mononucleosis"),
+}
+
+HARD_SECTIONS = ("contraindications", "do_not_use", "boxed_warning", "warnings")
+# Every contraindications / do-not-use sentence is a restriction; elsewhere it needs this wording
+_ALWAYS_RESTRICTIVE = ("contraindications", "do_not_use")
+_RESTRICTION = re.compile(
+    r"\b(?:contraindicated|do not (?:use|take|give)|must not|never (?:use|take)"
+    r"|should not (?:be used|be given|use|take))\b",
+    re.IGNORECASE,
+)
+_NEGATED = re.compile(r"\bnot contraindicated\b", re.IGNORECASE)
+# Restrictions that hinge on a population, or (for conditions) on a second
+# drug, are left to the LLM
+_POPULATION = re.compile(r"\b(?:children|teenagers|pediatric|infants?|elderly|geriatric)\b", re.IGNORECASE)
+_WITH_OTHER_DRUG = re.compile(
+    r"\b(?:co-?administ\w*|in combination with|concomitant\w*|together with)\b", re.IGNORECASE
+)
+# Restrictions that only hold at some severity, activity or history ("severe
+# renal impairment", "active peptic ulcer", "history of asthma after NSAIDs")
+# need judgement about the patient's own condition; the LLM makes that call
+_QUALIFIED = re.compile(
+    r"\b(?:severe|severely|moderate|mild|active|history of|uncontrolled|untreated|advanced|decompensated"
+    r"|end-stage|acute|recent|recently|significant|stage \d|creatinine clearance|crcl|egfr|child-pugh)\b",
+    re.IGNORECASE,
+)
+# Patient entries that are not current conditions
+_PAST_CONDITION = re.compile(r"\b(?:history of|resolved|in remission)\b", re.IGNORECASE)
+_PATIENT_QUALIFIER = re.compile(r"\bin patients (?:with|who)\b", re.IGNORECASE)
+_HYPERSENSITIVITY = re.compile(r"hypersensitiv|allerg|anaphyla", re.IGNORECASE)
+_lock = threading.Lock()
+_counters: Dict[str, Any] = {"screened": 0, "decided": 0, "rules": {}}
+prescreen_total = metrics.counter("prescreen_total", "Compatibility checks by pre-screen outcome.")
+
+
+class Verdict(NamedTuple):
+    verdict: str
+    reasons: List[str]
+    evidence_quotes: List[str]
+    rule: str
+
+
+@lru_cache(maxsize=1024)
+def _alternation(fragments: Tuple[str, ...]) -> "re.Pattern[str]":
+    # Longest first, so "ace inhibitors" wins over "ace inhibitor"
+    ordered = sorted(set(fragments), key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(ordered) + r")\b", re.IGNORECASE)
+
+
+def _contains(text: str, words: Iterable[str]) -> bool:
+    words = tuple(re.escape(w) for w in words if w)
+    return bool(words) and _alternation(words).search(text) is not None
+
+
+def _classes_in(text: str) -> List[str]:
+    """Drug classes named in text, by class name or by member drug."""
+    return [c for c, (aliases, members) in DRUG_CLASSES.items() if _contains(text, aliases + members)]
+
+
+def _drug_names(drug: str, label: Dict[str, Any]) -> List[str]:
+    openfda = label.get("openfda") or {}
+    names = [drug, *drug_names.ingredients(drug)] + list(openfda.get("generic_name") or []) + list(openfda.get("substance_name") or [])
+    return sorted({" ".join(n.split()).casefold() for n in names if isinstance(n, str) and n.strip()})
+
+
+def _med_names(med: str) -> List[str]:
+    """Generic ingredients of a med list entry, e.g. "Loratadine 5 MG Chewable Tablet" -> ["loratadine"]."""
+    return [name for name in drug_names.ingredients(med) if len(name) >= 4]
+
+
+def _hard_sentences(label: Dict[str, Any]) -> Iterable[Tuple[str, str]]:
+    for section in HARD_SECTIONS:
+        for sentence in sentences(section_text(label.get(section))):
+            if _NEGATED.search(sentence) or _POPULATION.search(sentence):
+                continue
+            if section in _ALWAYS_RESTRICTIVE or _RESTRICTION.search(sentence):
+                yield section, sentence
+
+
+def _quote(sentence: str, limit: int = 300) -> str:
+    return sentence if len(sentence) <= limit else sentence[: limit - 1].rstrip() + "…"
+
+
+def _allergy_rule(drug: str, names: List[str], label: Dict[str, Any], allergies: List[str]) -> Optional[Verdict]:
+    drug_classes = set(_classes_in(" ; ".join(names)))
+    for allergy in allergies:
+        same_drug = any(_contains(allergy, [n]) for n in names)
+        shared = [c for c in _classes_in(allergy) if c in drug_classes]
+        if not same_drug and not shared:
+            continue
+        evidence = [
+            _quote(s) for _, s in _hard_sentences(label)
+            if _HYPERSENSITIVITY.search(s) or _contains(s, [allergy])
+        ][:2]
+        relation = "is that drug" if same_drug else f"belongs to the same class ({shared[0]})"
+        return Verdict(
+            verdict="STRONGLY ADVISE AGAINST",
+            reasons=[
+                f"The patient has a recorded allergy to {allergy}, and {drug} {relation}.",
+                "The label restricts use after a hypersensitivity reaction to the drug or its class."
+                if evidence else "Re-exposure after an allergic reaction risks a severe hypersensitivity reaction.",
+                "Decided by the local rule pre-screen (no model call).",
+            ],
+            evidence_quotes=evidence,
+            rule="allergy_class",
+        )
+    return None
+
+
+def _contraindication_rule(
+    drug: str, names: List[str], label: Dict[str, Any], conditions: List[str], ongoingMeds: List[str]
+) -> Optional[Verdict]:
+    # (patient term, kind, label pattern) for every condition concept and med/class name
+    targets: List[Tuple[str, str, "re.Pattern[str]"]] = []
+    for condition in conditions:
+        if _PAST_CONDITION.search(condition):
+            continue
+        fragments = [label_re for patient_re, label_re in CONDITION_SYNONYMS.values()
+                     if re.search(patient_re, condition, re.IGNORECASE)]
+        if len(condition) >= 6:
+            fragments.append(re.escape(" ".join(condition.split())))
+        if fragments:
+            targets.append((condition, "condition", _alternation(tuple(fragments))))
+    for med in ongoingMeds:
+        meds = [m for m in _med_names(med) if not any(_contains(n, [m]) for n in names)]
+        if not meds:
+            continue
+        fragments = [re.escape(m) for m in meds]
+        for c in _classes_in(" ".join(meds)):
+            fragments += [re.escape(a) for a in DRUG_CLASSES[c][0]]
+        targets.append((med, "medication", _alternation(tuple(fragments))))
+    if not targets:
+        return None
+
+    for section, sentence in _hard_sentences(label):
+        if _QUALIFIED.search(sentence):
+            continue
+        with_other_drug = _WITH_OTHER_DRUG.search(sentence) is not None
+        for term, kind, pattern in targets:
+            # "Do not co-administer X with Y in patients with Z" needs both Y and Z; leave it to the LLM
+            if with_other_drug and (kind == "condition" or _PATIENT_QUALIFIER.search(sentence)):
+                continue
+            if pattern.search(sentence):
+                where = "contraindications" if section == "contraindications" else section.replace("_", " ")
+                return Verdict(
+                    verdict="STRONGLY ADVISE AGAINST",
+                    reasons=[
+                        f"The {drug} label ({where}) rules out use with the patient's {kind} \"{term}\".",
+                        "This is a hard restriction in the label, not a caution or monitoring advice.",
+                        "Decided by the local rule pre-screen (no model call).",
+                    ],
+                    evidence_quotes=[_quote(sentence)],
+                    rule=f"contraindicated_{kind}",
+                )
+    return None
+
+
+def screen(
+    drug: str,
+    label: Dict[str, Any],
+    allergies: List[str],
+    conditions: List[str],
+    ongoingMeds: List[str],
+) -> Optional[Verdict]:
+    """A decisive Verdict for clear-cut cases, or None to send the case to the LLM."""
+    if not ENABLED:
+        return None
+    label = label or {}
+    names = _drug_names(drug, label)
+    verdict = _allergy_rule(drug, names, label, allergies) or _contraindication_rule(
+        drug, names, label, conditions, ongoingMeds
+    )
+    with _lock:
+        _counters["screened"] += 1
+        if verdict is not None:
+            _counters["decided"] += 1
+            _counters["rules"][verdict.rule] = _counters["rules"].get(verdict.rule, 0) + 1
+    prescreen_total.inc(outcome=verdict.rule if verdict else "llm")
+    return verdict
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        screened, decided, rules = _counters["screened"], _counters["decided"], dict(_counters["rules"])
+    return {
+        "enabled": ENABLED,
+        "screened": screened,
+        "decided": decided,
+        "sent_to_llm": screened - decided,
+        "llm_skip_rate": round(decided / screened, 4) if screened else 0.0,
+        "rules": rules,
+    }
@@ -0,0 +1,208 @@
+"""
+Local reranking of PubMed candidates for the research prompt.
+
+Retrieval over-fetches a pool of candidates (RESEARCH_CANDIDATES, default
+50). They are scored here with BM25 against the issue, the current option
+and the search hint, weighted by publication type and recency. The best
+sentences of the top articles are then packed into a token budget, so the
+prompt carries the relevant part of each abstract rather than its opening
+780 characters.
+"""
+import os
+import re
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import label_context
+from tokens import count_tokens
+
+CANDIDATES = int(os.environ.get("RESEARCH_CANDIDATES", 50))
+DEFAULT_BUDGET = int(os.environ.get("RESEARCH_CONTEXT_TOKENS", 1500))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Recent papers get up to +RECENCY_WEIGHT, halving every RECENCY_HALF_LIFE years
+RECENCY_WEIGHT = 0.3
+RECENCY_HALF_LIFE = float(os.environ.get("RESEARCH_RECENCY_HALF_LIFE", 8))
+
+# Multiplier by PubMed publication type; an article takes its best one
+PUBLICATION_TYPE_BOOST = {
+    "practice guideline": 1.4,
+    "guideline": 1.4,
+    "meta-analysis": 1.35,
+    "systematic review": 1.3,
+    "randomized controlled trial": 1.25,
+    "controlled clinical trial": 1.15,
+    "clinical trial": 1.1,
+    "comparative study": 1.05,
+    "review": 1.05,
+    "case reports": 0.85,
+    "comment": 0.7,
+    "editorial": 0.7,
+    "letter": 0.7,
+    "retracted publication": 0.0,
+}
+
+_WORD = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+_YEAR = re.compile(r"\b(19\d\d|20\d\d)\b")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "of", "on", "or",
+    "that", "the", "this", "to", "was", "were", "with", "without", "patient", "patients", "need", "needed",
+    "none", "use", "used", "using", "alternative", "alternatives",
+}
+
+
+def _tokens(text: str) -> List[str]:
+    return [w for w in _WORD.findall((text or "").casefold()) if w not in _STOPWORDS and len(w) > 1]
+
+
+def query_weights(issue: str, current_option: str = "", search_hint: Optional[str] = None) -> Dict[str, float]:
+    """Query term -> weight. The option being replaced counts half: papers about it are context, not answers."""
+    weights: Dict[str, float] = {}
+    for text, weight in ((issue, 1.0), (search_hint or "", 1.0), (current_option or "", 0.5)):
+        for term in _tokens(text):
+            weights[term] = max(weights.get(term, 0.0), weight)
+    return weights
+
+
+def bm25(docs: Sequence[List[str]], weights: Dict[str, float]) -> np.ndarray:
+    """BM25 score of every tokenized doc against the weighted query terms."""
+    if not docs or not weights:
+        return np.zeros(len(docs))
+    vocab = {term: i for i, term in enumerate(weights)}
+    tf = np.zeros((len(docs), len(vocab)))
+    for row, tokens in enumerate(docs):
+        ids = [vocab[t] for t in tokens if t in vocab]
+        if ids:
+            tf[row] = np.bincount(ids, minlength=len(vocab))
+    lengths = np.array([len(tokens) for tokens in docs], dtype=float)
+    avg = lengths.mean() or 1.0
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5))
+    saturated = tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths / avg)[:, None])
+    return saturated @ (idf * np.fromiter(weights.values(), dtype=float, count=len(weights)))
+
+
+def _year(pubdate: Optional[str]) -> Optional[int]:
+    m = _YEAR.search(pubdate or "")
+    return int(m.group(1)) if m else None
+
+
+def _type_boost(article: Dict[str, Any]) -> float:
+    boosts = [PUBLICATION_TYPE_BOOST[t.casefold()] for t in article.get("publication_types") or []
+              if t.casefold() in PUBLICATION_TYPE_BOOST]
+    if 0.0 in boosts:
+        return 0.0
+    return max(boosts, default=1.0)
+
+
+def _recency(article: Dict[str, Any], this_year: int) -> float:
+    year = _year(article.get("pubdate"))
+    if year is None:
+        return 1.0
+    return 1.0 + RECENCY_WEIGHT * 0.5 ** (max(this_year - year, 0) / RECENCY_HALF_LIFE)
+
+
+def rank(articles: List[Dict[str, Any]], weights: Dict[str, float]) -> List[Tuple[float, Dict[str, Any]]]:
+    """(score, article) best first; the esearch order breaks ties."""
+    docs = [
+        _tokens(a.get("title") or "") * 2 + _tokens(a.get("abstract") or "") + _tokens(" ".join(a.get("mesh_terms") or []))
+        for a in articles
+    ]
+    relevance = bm25(docs, weights)
+    this_year = date.today().year
+    prior = np.array([_type_boost(a) * _recency(a, this_year) for a in articles])
+    # Keep a trace of relevance-free ordering so papers with no matching terms still sort by quality
+    scores = (relevance + 0.01) * prior
+    order = sorted(range(len(articles)), key=lambda i: (-scores[i], i))
+    return [(float(scores[i]), articles[i]) for i in order if prior[i] > 0]
+
+
+def _passages(article: Dict[str, Any]) -> List[str]:
+    sections = article.get("abstract_sections") or []
+    texts = [s.get("text") or "" for s in sections] if sections else [article.get("abstract") or ""]
+    return [s for text in texts for s in label_context.sentences(text)]
+
+
+def _header(article: Dict[str, Any]) -> str:
+    return f"- {article.get('title')}\n  {article.get('citation')}\n  {article.get('url')}"
+
+
+def build_evidence(
+    articles: List[Dict[str, Any]],
+    issue: str,
+    current_option: str = "",
+    search_hint: Optional[str] = None,
+    k: int = 5,
+    budget: int = DEFAULT_BUDGET,
+) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Return (articles_block, chosen articles, stats). The top k candidates are
+    kept; each gets its best-matching sentence first, then the remaining
+    budget goes to the best sentences overall. Kept sentences stay in
+    abstract order, with "…" marking gaps.
+    """
+    start = time.perf_counter()
+    weights = query_weights(issue, current_option, search_hint)
+    ranked = rank(articles, weights)[:k]
+
+    used = 0
+    chosen: List[Tuple[float, Dict[str, Any]]] = []
+    for score, article in ranked:
+        tokens = count_tokens(_header(article)) + 2
+        if used + tokens > budget:
+            break
+        used += tokens
+        chosen.append((score, article))
+
+    # (article no, sentence no, sentence, tokens) for every sentence of the chosen articles
+    sentences = [(a, s, text, count_tokens(text) + 1)
+                 for a, (_, article) in enumerate(chosen) for s, text in enumerate(_passages(article))]
+    relevance = bm25([_tokens(text) for _, _, text, _ in sentences], weights)
+    top = max((score for score, _ in chosen), default=0.0) or 1.0
+    priority = [relevance[i] * (0.5 + chosen[a][0] / top) for i, (a, _, _, _) in enumerate(sentences)]
+    by_priority = sorted(range(len(sentences)), key=lambda i: (-priority[i], sentences[i][0], sentences[i][1]))
+    first_per_article: Dict[int, int] = {}
+    for i in by_priority:
+        first_per_article.setdefault(sentences[i][0], i)
+
+    kept: Dict[int, List[int]] = {}
+    for i in [*first_per_article.values(), *by_priority]:
+        a, s, _, tokens = sentences[i]
+        if s in kept.get(a, ()) or used + tokens > budget:
+            continue
+        used += tokens
+        kept.setdefault(a, []).append(s)
+
+    lines = []
+    for a, (_, article) in enumerate(chosen):
+        texts = {s: text for b, s, text, _ in sentences if b == a}
+        parts, last = [], -1
+        for s in sorted(kept.get(a, [])):
+            if s != last + 1:
+                parts.append("…")
+            parts.append(texts[s])
+            last = s
+        if parts and last != len(texts) - 1:
+            parts.append("…")
+        snippet = " ".join(parts)
+        lines.append(f"- {article.get('title')}\n  {snippet}\n  {article.get('citation')}\n  {article.get('url')}"
+                     if snippet else _header(article))
+    block = "\n\n".join(lines) if lines else "(no articles found)"
+
+    stats = {
+        "candidates": len(articles),
+        "articles": len(chosen),
+        "pmids": [article.get("pmid") for _, article in chosen],
+        "sentences_kept": sum(len(v) for v in kept.values()),
+        "sentences_total": len(sentences),
+        "context_tokens": count_tokens(block),
+        "token_budget": budget,
+        "rerank_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+    return block, [article for _, article in chosen], stats
@@ -1,8 +1,12 @@
-import os, json, time, requests
-from typing import List, Optional, Dict, Any
+import os, re, json, queue, asyncio, importlib
+import http_client
+import metrics
+import rerank
+from lazy import Lazy
+from llm_cache import ResultCache, prompt_version
+from streaming import ListItemTracker
+from typing import Callable, Iterator, List, NamedTuple, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 import xml.etree.ElementTree as ET
 
@@ -11,63 +15,265 @@ load_dotenv()
 # -----------------------
 # PubMed E-utilities
 # -----------------------
-ESEARCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-ESUMMARY = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-EFETCH   = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+EUTILS = os.environ.get("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+ESEARCH = f"{EUTILS}/esearch.fcgi"
+EFETCH   = f"{EUTILS}/efetch.fcgi"
+# Local article store (set ARTICLE_STORE_PATH="" to disable). With
+# RESEARCH_OFFLINE=true, retrieval never leaves the store.
+RESEARCH_OFFLINE = os.environ.get("RESEARCH_OFFLINE", "false").lower() == "true"
+_ARTICLE_STORE_PATH = os.environ.get(
+    "ARTICLE_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "articles.sqlite3"),
+)
+
+def _open_article_store():
+    if not _ARTICLE_STORE_PATH:
+        return None
+    from article_store import ArticleStore  # SQLAlchemy is only imported when the store is used
+    return ArticleStore(
+        _ARTICLE_STORE_PATH,
+        query_ttl=float(os.environ.get("ARTICLE_QUERY_TTL", 7 * 24 * 3600)),
+    )
+
+article_store = Lazy(_open_article_store)
+
 NCBI_PARAMS = {
     "db": "pubmed",
     "retmode": "json",
 }
 
-def pubmed_search(query: str, retmax: int = 5, sort: str = "relevance") -> List[str]:
-    """Return a list of PMIDs for the query."""
-    params = {**NCBI_PARAMS, "term": query, "retmax": retmax, "sort": sort}
-    r = requests.get(ESEARCH, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    return data.get("esearchresult", {}).get("idlist", [])
-
-def pubmed_summaries(pmids: List[str]) -> Dict[str, Any]:
-    """Return PubMed summaries (title, journal, pubdate) for PMIDs."""
-    if not pmids: return {}
-    params = {**NCBI_PARAMS, "id": ",".join(pmids)}
-    r = requests.get(ESUMMARY, params=params, timeout=20)
-    r.raise_for_status()
-    return r.json().get("result", {})
+# -----------------------
+# EFetch XML (single pass)
+# -----------------------
+# One efetch in XML mode gives everything the bundle needs. Records are
+# parsed incrementally and each PubmedArticle is discarded once read, so
+# memory stays flat however many PMIDs are requested.
+def _text(el: Optional[ET.Element]) -> str:
+    return " ".join("".join(el.itertext()).split()) if el is not None else ""
+
+def _pubdate(article: ET.Element) -> str:
+    pd = article.find("Journal/JournalIssue/PubDate")
+    if pd is None:
+        return ""
+    medline = pd.findtext("MedlineDate")
+    if medline:
+        return medline.strip()
+    return " ".join(p for p in (pd.findtext("Year"), pd.findtext("Month"), pd.findtext("Day")) if p)
+
+def _parse_article(art: ET.Element) -> Optional[Dict[str, Any]]:
+    pmid = (art.findtext("MedlineCitation/PMID") or "").strip()
+    article = art.find("MedlineCitation/Article")
+    if not pmid or article is None:
+        return None
 
-def pubmed_abstracts(pmids: List[str]) -> Dict[str, str]:
-    """Return raw abstracts keyed by PMID."""
-    if not pmids: return {}
-    params = {"db": "pubmed", "id": ",".join(pmids), "retmode": "text", "rettype": "abstract"}
-    r = requests.get(EFETCH, params=params, timeout=20)
+    authors = []
+    for a in article.findall("AuthorList/Author"):
+        collab = _text(a.find("CollectiveName"))
+        if collab:  # sometimes it's a group author
+            authors.append({"name": collab, "full_name": collab})
+            continue
+        last = (a.findtext("LastName") or "").strip()
+        fore = (a.findtext("ForeName") or "").strip()
+        initials = (a.findtext("Initials") or "").strip()
+        if last or fore:
+            # "name" matches esummary's "Last FI" style used by format_citation
+            authors.append({"name": f"{last} {initials}".strip(), "full_name": f"{fore} {last}".strip()})
+
+    sections = [
+        {"label": t.get("Label") or t.get("NlmCategory"), "text": _text(t)}
+        for t in article.findall("Abstract/AbstractText")
+    ]
+    doi = next(
+        (e.text.strip() for e in art.findall("PubmedData/ArticleIdList/ArticleId") if e.get("IdType") == "doi" and e.text),
+        None,
+    ) or next(
+        (e.text.strip() for e in article.findall("ELocationID") if e.get("EIdType") == "doi" and e.text),
+        None,
+    )
+    return {
+        "uid": pmid,
+        "title": _text(article.find("ArticleTitle")),
+        "fulljournalname": _text(article.find("Journal/Title")),
+        "source": _text(article.find("Journal/ISOAbbreviation")),
+        "pubdate": _pubdate(article),
+        "authors": authors,
+        "abstract_sections": sections,
+        "abstract": "\n".join(f"{x['label']}: {x['text']}" if x["label"] else x["text"] for x in sections),
+        "mesh_terms": [_text(d) for d in art.findall("MedlineCitation/MeshHeadingList/MeshHeading/DescriptorName")],
+        "publication_types": [_text(t) for t in article.findall("PublicationTypeList/PublicationType")],
+        "doi": doi,
+    }
+
+class PubmedRecordParser:
+    """Incremental efetch XML parser: feed() byte chunks as they arrive, get back the articles they complete."""
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root: Optional[ET.Element] = None
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        self._parser.feed(chunk)
+        records = []
+        for event, el in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = el
+                continue
+            if el.tag == "PubmedArticle":
+                record = _parse_article(el)
+                el.clear()
+                self._root.clear()  # drop the (now empty) article from PubmedArticleSet
+                if record:
+                    records.append(record)
+        return records
+
+    def close(self) -> None:
+        self._parser.close()
+
+# -----------------------
+# Async E-utilities (httpx)
+# -----------------------
+# Searches post their result set to NCBI's history server (usehistory=y), so
+# efetch references it by WebEnv + query_key instead of re-sending the PMID list.
+class SearchResult(BaseModel):
+    query: str
+    pmids: List[str] = []
+    webenv: Optional[str] = None
+    query_key: Optional[str] = None
+
+def _history_params(result: SearchResult) -> Dict[str, Any]:
+    if result.webenv and result.query_key:
+        return {"WebEnv": result.webenv, "query_key": result.query_key, "retstart": 0, "retmax": len(result.pmids)}
+    return {"id": ",".join(result.pmids)}
+
+async def apubmed_search(query: str, retmax: int = 5, sort: str = "relevance") -> SearchResult:
+    params = {**NCBI_PARAMS, "term": query, "retmax": retmax, "sort": sort, "usehistory": "y"}
+    with metrics.span("ncbi.esearch"):
+        r = await http_client.aget("ncbi", ESEARCH, params=params)
     r.raise_for_status()
-    # efetch returns concatenated text; we split heuristically on PMID lines
-    text = r.text
-    out: Dict[str, str] = {}
-    # Simple splitter: look for lines starting with "PMID: "
-    chunks = [c.strip() for c in text.split("\n\n") if c.strip()]
-    cur_pmid = None
-    buf = []
-    for line in text.splitlines():
-        if line.startswith("PMID:"):
-            if cur_pmid and buf:
-                out[cur_pmid] = "\n".join(buf).strip()
-                buf = []
-            cur_pmid = line.replace("PMID:", "").strip()
-        else:
-            buf.append(line)
-    if cur_pmid and buf:
-        out[cur_pmid] = "\n".join(buf).strip()
-    # Fallback: if parsing fails, just put the whole thing under the first PMID
-    if not out and pmids:
-        out[pmids[0]] = text.strip()
+    data = r.json().get("esearchresult", {})
+    return SearchResult(
+        query=query,
+        pmids=data.get("idlist", []),
+        webenv=data.get("webenv"),
+        query_key=data.get("querykey"),
+    )
+
+async def apubmed_records(result: SearchResult) -> Dict[str, Dict[str, Any]]:
+    if not result.pmids: return {}
+    params = {"db": "pubmed", "retmode": "xml", **_history_params(result)}
+    parser = PubmedRecordParser()
+    records: Dict[str, Dict[str, Any]] = {}
+    # Download and parse overlap, so one span covers both
+    with metrics.span("ncbi.efetch"):
+        async with http_client.astream("ncbi", EFETCH, params=params) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes(64 * 1024):
+                for rec in parser.feed(chunk):
+                    records[rec["uid"]] = rec
+        parser.close()
+    return records
+
+def query_variants(query: str) -> List[str]:
+    """The query plus progressively looser fallbacks, most specific first."""
+    variants = [query, query.split(";")[0], re.sub(r"[^\w\s-]", " ", query)]
+    out = []
+    for v in variants:
+        v = " ".join(v.split())
+        if v and v not in out:
+            out.append(v)
     return out
 
+async def asearch_with_fallbacks(query: str, retmax: int = 5) -> SearchResult:
+    """
+    Run esearch for the query; only if it finds nothing (or fails), run the
+    looser fallbacks in parallel and keep the most specific one with hits.
+    The usual hit costs one esearch of NCBI's 3 req/s budget, not one per variant.
+    """
+    primary, *fallbacks = query_variants(query) or [query]
+    try:
+        res = await apubmed_search(primary, retmax=retmax)
+        if res.pmids or not fallbacks:
+            return res
+        results: List[Any] = [res]
+    except Exception as e:
+        if not fallbacks:
+            raise
+        results = [e]
+    results += await asyncio.gather(
+        *(apubmed_search(v, retmax=retmax) for v in fallbacks),
+        return_exceptions=True,
+    )
+    for res in results:
+        if isinstance(res, SearchResult) and res.pmids:
+            return res
+    errors = [res for res in results if isinstance(res, Exception)]
+    if len(errors) == len(results):
+        raise errors[0]
+    return SearchResult(query=query)
+
+async def abuild_article_bundle(result: SearchResult) -> List[Dict[str, Any]]:
+    return _bundle(result.pmids, await apubmed_records(result))
+
+async def aretrieve_articles(
+    query: str,
+    k: int = 5,
+    progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Articles for a query. Repeat queries are served from the local article
+    store; otherwise one parallel esearch wave, then a single efetch. In
+    offline mode nothing goes to NCBI and unseen queries use the FTS index.
+    progress(stage, data) is called once the PMIDs are known ("search") and
+    once the articles are in hand ("articles").
+    """
+    def report(stage: str, **data):
+        if progress is not None:
+            progress(stage, {"stage": stage, **data})
+
+    def done(articles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        report("articles", count=len(articles))
+        return articles
+
+    # The store is SQLite (via SQLAlchemy); every call on it runs in a worker thread
+    store = article_store.get() if article_store.ready else await asyncio.to_thread(article_store.get)
+    if store is None:
+        result = await asearch_with_fallbacks(query, retmax=k)
+        report("search", query=result.query, pmids=result.pmids, source="ncbi")
+        return done(await abuild_article_bundle(result))
+
+    cache_key = f"{query} |k={k}"
+    pmids = await asyncio.to_thread(store.cached_query, cache_key, allow_stale=RESEARCH_OFFLINE)
+    if pmids is not None:
+        report("search", query=query, pmids=pmids, source="store")
+        stored = await asyncio.to_thread(store.get_articles, pmids)
+        missing = [p for p in pmids if p not in stored]
+        if missing and not RESEARCH_OFFLINE:
+            fetched = await abuild_article_bundle(SearchResult(query=query, pmids=missing))
+            await asyncio.to_thread(store.put_articles, fetched)
+            stored.update((a["pmid"], a) for a in fetched)
+        return done([stored[p] for p in pmids if p in stored])
+
+    if RESEARCH_OFFLINE:
+        articles = await asyncio.to_thread(store.search, query, limit=k)
+        report("search", query=query, pmids=[a["pmid"] for a in articles], source="fts")
+        return done(articles)
+
+    result = await asearch_with_fallbacks(query, retmax=k)
+    report("search", query=result.query, pmids=result.pmids, source="ncbi")
+    bundle = await abuild_article_bundle(result)
+
+    def save():
+        store.put_articles(bundle)
+        store.put_query(cache_key, result.pmids)
+    await asyncio.to_thread(save)
+    return done(bundle)
+
 def format_citation(s: Dict[str, Any]) -> str:
     """
     Build a concise citation string: Authors. Title. Journal (Year). PMID: NNN.
     """
-    title = s.get("title") or s.get("sorttitle") or ""
+    title = (s.get("title") or s.get("sorttitle") or "").rstrip(".")
     journal = s.get("fulljournalname") or s.get("source") or ""
     pubdate = (s.get("pubdate") or "").split(" ")[0]  # take year if present
     authors = s.get("authors", [])
@@ -80,42 +286,10 @@ def format_citation(s: Dict[str, Any]) -> str:
     return f"{author_str} {title}. {journal} ({pubdate}). PMID: {pmid}."
 
 
-def pubmed_first_authors_full(pmids: List[str]) -> Dict[str, str]:
-    """
-    Return {pmid: "First Last"} using EFetch XML AuthorList.
-    Falls back to initials if ForeName missing.
-    """
-    if not pmids:
-        return {}
-    params = {"db": "pubmed", "id": ",".join(pmids), "retmode": "xml"}
-    r = requests.get(EFETCH, params=params, timeout=20)
-    r.raise_for_status()
-    authors: Dict[str, str] = {}
-
-    root = ET.fromstring(r.text)
-    # XML structure: PubmedArticleSet/PubmedArticle/MedlineCitation/PMID, Article/AuthorList/Author[0]/ForeName, LastName
-    for art in root.findall(".//PubmedArticle"):
-        pmid_el = art.find(".//MedlineCitation/PMID")
-        pmid = pmid_el.text.strip() if pmid_el is not None else None
-        if not pmid:
-            continue
-        first_author = art.find(".//Article/AuthorList/Author")
-        if first_author is not None:
-            fore = (first_author.findtext("ForeName") or "").strip()
-            last = (first_author.findtext("LastName") or "").strip()
-            collab = (first_author.findtext("CollectiveName") or "").strip()
-            if collab:  # sometimes it's a group author
-                authors[pmid] = collab
-            elif fore or last:
-                authors[pmid] = f"{fore} {last}".strip()
-    return authors
-
-def build_article_bundle(pmids: List[str]) -> List[Dict[str, Any]]:
-    summaries = pubmed_summaries(pmids)
-    abstracts = pubmed_abstracts(pmids)
+def _bundle(pmids: List[str], records: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
     bundle = []
     for pid in pmids:
-        meta = summaries.get(pid) or {}
+        meta = records.get(pid) or {}
         bundle.append({
             "pmid": pid,
             "title": meta.get("title"),
@@ -123,11 +297,18 @@ def build_article_bundle(pmids: List[str]) -> List[Dict[str, Any]]:
             "pubdate": meta.get("pubdate"),
             "authors": meta.get("authors"),
             "citation": format_citation(meta),
-            "abstract": abstracts.get(pid, ""),
+            "abstract": meta.get("abstract", ""),
+            "abstract_sections": meta.get("abstract_sections", []),
+            "mesh_terms": meta.get("mesh_terms", []),
+            "publication_types": meta.get("publication_types", []),
+            "doi": meta.get("doi"),
             "url": f"https://pubmed.ncbi.nlm.nih.gov/{pid}/",
         })
     return bundle
 
+def build_article_bundle(pmids: List[str]) -> List[Dict[str, Any]]:
+    return http_client.run(abuild_article_bundle(SearchResult(query="", pmids=pmids)))
+
 # -----------------------
 # LLM schema & prompt
 # -----------------------
@@ -153,10 +334,7 @@ Constraints:
 
 Be conservative: if evidence is weak or indirect, say so in the description."""
 
-PROMPT = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM),
-    ("user",
-     """Clinical issue (what failed / what's needed):
+USER = """Clinical issue (what failed / what's needed):
 {issue}
 
 Current/contraindicated option (if any):
@@ -173,53 +351,191 @@ Return strict JSON with:
     ...
   ]
 }}
-"""),
-])
+"""
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0).with_structured_output(AlternativesOut)
+MODEL = "gpt-4o-mini"
+
+class _Chains(NamedTuple):
+    prompt: Any
+    llm: Any
+    stream_llm: Any
+    config: Dict[str, Any]
+
+def _build_chains() -> _Chains:
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+
+    model = ChatOpenAI(model=MODEL, temperature=0)
+    return _Chains(
+        prompt=ChatPromptTemplate.from_messages([
+            ("system", SYSTEM),
+            ("user", USER),
+        ]),
+        llm=model.with_structured_output(AlternativesOut),
+        # JSON-schema (dict) variant whose parser yields partial dicts; used by stream_alternatives()
+        stream_llm=model.with_structured_output(AlternativesOut.model_json_schema()),
+        config={"callbacks": [metrics.llm_usage_handler("research")]},
+    )
+
+chains: Lazy[_Chains] = Lazy(_build_chains)
+
+def warmup(stores: bool = True) -> None:
+    """
+    Build the prompt and clients ahead of the first request, and open the
+    article store (with stores=False, only import SQLAlchemy: safe before fork).
+    """
+    chains.get()
+    if stores:
+        article_store.get()
+    elif _ARTICLE_STORE_PATH:
+        importlib.import_module("article_store")
+
+def __getattr__(name: str) -> Any:
+    # PROMPT / llm / stream_llm used to be built at import; keep them reachable
+    if name in ("PROMPT", "llm", "stream_llm"):
+        c = chains.get()
+        return {"PROMPT": c.prompt, "llm": c.llm, "stream_llm": c.stream_llm}[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Bump PROMPT_REVISION for changes the prompt fingerprint can't see (e.g. schema or rules in code)
+PROMPT_REVISION = "1"
+result_cache = ResultCache("research", MODEL, prompt_version(PROMPT_REVISION, SYSTEM, USER))
 
 # -----------------------
 # Public function
 # -----------------------
+def _prompt_inputs(
+    issue: str,
+    current_option: str,
+    search_hint: Optional[str],
+    candidates: List[Dict[str, Any]],
+    k: int,
+    meta: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    # 2) Rerank the candidate pool and pack the best passages into the prompt budget
+    with metrics.span("rerank"):
+        articles_block, articles, stats = rerank.build_evidence(candidates, issue, current_option, search_hint, k=k)
+    if meta is not None:
+        meta["evidence"] = stats
+
+    return {
+        "issue": issue,
+        "current_option": current_option or "(none)",
+        "k": len(articles),
+        "articles_block": articles_block,
+    }
+
+def _cached_alternatives(inputs: Dict[str, Any], meta: Optional[Dict[str, Any]]) -> Tuple[str, Optional[AlternativesOut]]:
+    key = result_cache.key(inputs)
+    cached = result_cache.get(key)
+    if meta is not None:
+        meta["cached"] = cached is not None
+    return key, AlternativesOut.model_validate(cached) if cached is not None else None
+
 def suggest_alternatives(
     issue: str,
     current_option: str,
     search_hint: Optional[str] = None,
     k: int = 5,
+    meta: Optional[Dict[str, Any]] = None,
 ) -> AlternativesOut:
     """
     issue: e.g., "ACE inhibitor contraindicated in pregnancy; need antihypertensive alternative"
     current_option: e.g., "lisinopril"
     search_hint: optional keywords to guide PubMed search (drug class, population)
+    meta: optional dict filled with per-request diagnostics (e.g. meta["cached"])
     """
     # 1) Build a conservative search query
     q = search_hint or issue
-    pmids = pubmed_search(q, retmax=k, sort="relevance")
-    if not pmids:
-        # fallback: remove punctuation and retry
-        time.sleep(0.8)
-        pmids = pubmed_search(q.split(";")[0], retmax=k, sort="relevance")
-
-    articles = build_article_bundle(pmids)
-    # 2) Build a compact block for the prompt
-    lines = []
-    for a in articles:
-        abstract_snip = (a["abstract"] or "").strip().replace("\n", " ")
-        if len(abstract_snip) > 800:
-            abstract_snip = abstract_snip[:780] + " …"
-        lines.append(f"- {a['title']}\n  {abstract_snip}\n  {a['citation']}\n  {a['url']}")
-    articles_block = "\n\n".join(lines) if lines else "(no articles found)"
-    
-    inputs = {
-        "issue": issue,
-        "current_option": current_option or "(none)",
-        "k": len(articles),
-        "articles_block": articles_block,
-    }
+    # fallbacks (first clause only, punctuation removed) are searched in parallel
+    with metrics.span("retrieval"):
+        candidates = http_client.run(aretrieve_articles(q, k=max(k, rerank.CANDIDATES)))
+    with metrics.span("prompt_build"):
+        inputs = _prompt_inputs(issue, current_option, search_hint, candidates, k, meta)
 
-    out: AlternativesOut = (PROMPT | llm).invoke(inputs)
+    key, cached = _cached_alternatives(inputs, meta)
+    if cached is not None:
+        return cached
+
+    c = chains.get()
+    with metrics.span("llm.research"):
+        out: AlternativesOut = (c.prompt | c.llm).invoke(inputs, config=c.config)
+    result_cache.set(key, out.model_dump())
+    return out
+
+async def asuggest_alternatives(
+    issue: str,
+    current_option: str,
+    search_hint: Optional[str] = None,
+    k: int = 5,
+    meta: Optional[Dict[str, Any]] = None,
+) -> AlternativesOut:
+    """
+    suggest_alternatives() on the running event loop: async retrieval and
+    ainvoke(), with the store, rerank and result-cache work in worker threads.
+    """
+    q = search_hint or issue
+    with metrics.span("retrieval"):
+        candidates = await aretrieve_articles(q, k=max(k, rerank.CANDIDATES))
+    with metrics.span("prompt_build"):
+        inputs = await asyncio.to_thread(_prompt_inputs, issue, current_option, search_hint, candidates, k, meta)
+
+    key, cached = await asyncio.to_thread(_cached_alternatives, inputs, meta)
+    if cached is not None:
+        return cached
+
+    # Building the chains imports LangChain; keep that off the loop if warm-up hasn't run
+    c = chains.get() if chains.ready else await asyncio.to_thread(chains.get)
+    with metrics.span("llm.research"):
+        out: AlternativesOut = await (c.prompt | c.llm).ainvoke(inputs, config=c.config)
+    await result_cache.aset(key, out.model_dump())
     return out
 
+def stream_alternatives(
+    issue: str,
+    current_option: str,
+    search_hint: Optional[str] = None,
+    k: int = 5,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    suggest_alternatives() as a sequence of (event, data) pairs: "stage"
+    events (search done with PMIDs, articles fetched, LLM started), then
+    each "alternative" as soon as the model has finished it, then "result".
+    """
+    q = search_hint or issue
+    # Retrieval runs on the shared loop; its progress callbacks land in this queue
+    events: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue()
+    future = http_client.submit(aretrieve_articles(
+        q, k=max(k, rerank.CANDIDATES), progress=lambda stage, data: events.put(("stage", data))
+    ))
+    future.add_done_callback(lambda _: events.put(None))
+    while (item := events.get()) is not None:
+        yield item
+    candidates = future.result()
+
+    meta: Dict[str, Any] = {}
+    inputs = _prompt_inputs(issue, current_option, search_hint, candidates, k, meta)
+    evidence = meta["evidence"]
+    yield "stage", {"stage": "reranked", "pmids": evidence["pmids"], "rerank_ms": evidence["rerank_ms"]}
+    key, out = _cached_alternatives(inputs, meta)
+    if out is not None:
+        for alt in out.alternatives:
+            yield "alternative", alt.model_dump()
+    else:
+        yield "stage", {"stage": "llm_started"}
+        tracker = ListItemTracker("alternatives")
+        partial: Dict[str, Any] = {}
+        c = chains.get()
+        for partial in (c.prompt | c.stream_llm).stream(inputs, config=c.config):
+            for item in tracker.completed(partial):
+                yield "alternative", Alternative.model_validate(item).model_dump()
+        out = AlternativesOut.model_validate(partial)
+        result_cache.set(key, out.model_dump())
+        for item in tracker.completed(partial, final=True):
+            yield "alternative", Alternative.model_validate(item).model_dump()
+
+    yield "result", {"result": out.model_dump(), "meta": meta}
+
 
 if __name__ == "__main__":
     result = suggest_alternatives(
@@ -0,0 +1,180 @@
+"""
+In-flight call coalescing ("singleflight").
+
+Group.do(key, fn) runs fn once for every thread that asks for the same key
+while a call is in flight: the first caller runs it, the others block
+until it finishes and get the same result or exception. Nothing is kept
+once the call returns; remembering results is the caches' job.
+Group.do_many does the same for a batch of keys: one fn call runs the keys
+nobody else has in flight, and the rest wait for the calls that do.
+Group.ado is the asyncio counterpart for callers on one event loop. There
+the call runs in its own task, so a caller that is cancelled (a client
+that disconnected) leaves it running for the others. Only when every
+caller has gone is it cancelled.
+
+Every group counts calls, executions and shared results (upstream calls
+saved); stats() reports all of them.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+_groups: List["Group"] = []
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class _ACall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class Group:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._acalls: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], _ACall] = {}
+        self._counters = {"calls": 0, "executions": 0, "shared": 0, "shared_errors": 0}
+        _groups.append(self)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(fn's result, whether it came from another caller's call)."""
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters["executions"] += 1
+            else:
+                self._counters["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                self._count("shared_errors")
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def do_many(
+        self, keys: List[Hashable], fn: Callable[[List[Hashable]], List[Any]]
+    ) -> List[Tuple[Any, bool]]:
+        """
+        do() for several keys: fn(led keys) returns one result or exception
+        per key it is given, in order. Returns (result or exception, shared)
+        per key in `keys`; exceptions are returned, not raised.
+        """
+        led: Dict[Hashable, _Call] = {}
+        calls: Dict[Hashable, _Call] = {}
+        with self._lock:
+            for key in keys:
+                self._counters["calls"] += 1
+                call = calls.get(key) or self._calls.get(key)
+                if call is None:
+                    call = led[key] = calls[key] = self._calls[key] = _Call()
+                    self._counters["executions"] += 1
+                else:
+                    calls[key] = call
+                    self._counters["shared"] += 1
+
+        if led:
+            try:
+                outcomes = fn(list(led))
+            except BaseException as e:
+                outcomes = [e] * len(led)
+            with self._lock:
+                for key, call in led.items():
+                    self._calls.pop(key, None)
+            for (key, call), outcome in zip(led.items(), outcomes):
+                if isinstance(outcome, BaseException):
+                    call.error = outcome
+                else:
+                    call.result = outcome
+                call.done.set()
+
+        out: List[Tuple[Any, bool]] = []
+        first = set()
+        for key in keys:
+            call = calls[key]
+            shared = key not in led or key in first
+            first.add(key)
+            call.done.wait()
+            if call.error is not None and shared:
+                self._count("shared_errors")
+            out.append((call.error if call.error is not None else call.result, shared))
+        return out
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """do() for coroutines; callers on the same event loop share one task running fn()."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._acalls.get((loop, key))
+            leader = call is None
+            if leader:
+                call = self._acalls[(loop, key)] = _ACall(loop.create_task(fn()))
+                call.task.add_done_callback(lambda _: self._forget(loop, key, call))
+                self._counters["executions"] += 1
+            else:
+                self._counters["shared"] += 1
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task), not leader
+        except Exception:
+            if not leader:
+                self._count("shared_errors")
+            raise
+        finally:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.task.done()
+                if abandoned:
+                    self._forget_locked(loop, key, call)
+            if abandoned:
+                call.task.cancel()
+
+    def _forget(self, loop: asyncio.AbstractEventLoop, key: Hashable, call: _ACall) -> None:
+        with self._lock:
+            self._forget_locked(loop, key, call)
+
+    def _forget_locked(self, loop: asyncio.AbstractEventLoop, key: Hashable, call: _ACall) -> None:
+        if self._acalls.get((loop, key)) is call:
+            del self._acalls[(loop, key)]
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            out["in_flight"] = len(self._calls) + len(self._acalls)
+        out["saved_rate"] = round(out["shared"] / out["calls"], 4) if out["calls"] else None
+        return out
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {g.name: g.stats() for g in _groups}
@@ -0,0 +1,28 @@
+"""
+Helpers for the Server-Sent Events endpoints.
+
+The streaming chains produce cumulative partial dicts of the structured
+output. An item of a list field is complete once the model has started the
+next one (or the stream has ended), so it can be sent right away.
+"""
+import json
+from typing import Any, Dict, List
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ListItemTracker:
+    """Tracks how many items of one list field have already been emitted."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.emitted = 0
+
+    def completed(self, partial: Dict[str, Any], final: bool = False) -> List[Any]:
+        items = (partial or {}).get(self.key) or []
+        upto = len(items) if final else len(items) - 1
+        new = items[self.emitted:upto] if upto > self.emitted else []
+        self.emitted += len(new)
+        return new
@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+# Modules read their settings at import, and pytest imports every test module
+# before running any, so the offline setup has to be in place first: the
+# benchmark's openFDA/NCBI/LLM stand-ins, and no cache files on disk.
+LLM_LATENCY = 0.3
+_stub = benchmark.StubServer(
+    ("127.0.0.1", 0),
+    benchmark.make_stub_handler(benchmark.Fixtures(benchmark.DEFAULT_FIXTURES), 0.0, LLM_LATENCY, 0.0),
+)
+STUB_URL = benchmark.start_server(_stub)
+os.environ.update({
+    "OPENFDA_BASE_URL": STUB_URL, "NCBI_EUTILS_URL": STUB_URL + "/entrez/eutils",
+    "OPENAI_BASE_URL": STUB_URL + "/v1", "OPENAI_API_KEY": "test",
+    "LABEL_CACHE_PATH": "", "LLM_CACHE_BACKEND": "memory", "ARTICLE_STORE_PATH": "",
+    "RESEARCH_JOB_PATH": "", "LABEL_INDEX_PATH": "", "WARMUP": "off",
+    "ASYNC_MAX_INFLIGHT": "2", "ASYNC_QUEUE_TIMEOUT": "0.1",
+})
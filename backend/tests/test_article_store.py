@@ -0,0 +1,38 @@
+import time
+
+from article_store import ArticleStore
+
+
+def _article(pmid, title, abstract=""):
+    return {"pmid": pmid, "title": title, "abstract": abstract, "url": f"https://pubmed.example/{pmid}"}
+
+
+def test_full_text_search_ranks_by_overlap(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.sqlite3"))
+    store.put_articles([
+        _article("1", "Statin adherence", "Adherence in older adults."),
+        _article("2", "Cephalosporins after penicillin allergy", "Penicillin allergy and cephalosporin tolerance."),
+        _article("3", "Penicillin skin testing"),
+        {"pmid": "4", "title": ""},
+    ])
+    assert [a["pmid"] for a in store.search("penicillin allergy cephalosporins")][:2] == ["2", "3"]
+    assert store.search("of a") == [] and store.search("warfarin") == []
+    assert set(store.get_articles(["1", "4", "9"])) == {"1"}
+
+
+def test_rewriting_an_article_replaces_its_text(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.sqlite3"))
+    store.put_articles([_article("1", "Old title about aspirin")])
+    store.put_articles([_article("1", "New title about ibuprofen")])
+    assert store.search("aspirin") == []
+    assert [a["title"] for a in store.search("ibuprofen")] == ["New title about ibuprofen"]
+
+
+def test_query_cache_normalizes_and_expires(tmp_path):
+    store = ArticleStore(str(tmp_path / "articles.sqlite3"), query_ttl=0.05)
+    store.put_query("Penicillin  Allergy", ["2", "3"])
+    assert store.cached_query("penicillin allergy") == ["2", "3"]
+    time.sleep(0.06)
+    assert store.cached_query("penicillin allergy") is None
+    assert store.cached_query("penicillin allergy", allow_stale=True) == ["2", "3"]
+    assert store.cached_query("warfarin") is None
@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import LLM_LATENCY
+
+
+@pytest.fixture(scope="module")
+def asgi():
+    """asgi.app against the benchmark stand-ins conftest starts, with two LLM slots."""
+    import asgi
+    return asgi
+
+
+@pytest.fixture(scope="module")
+def run():
+    # One loop for the module: the limiter's semaphore and the httpx pools are bound to it
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+def _client(asgi):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.app), base_url="http://test")
+
+
+def test_async_compatibility_route(asgi, run):
+    async def go():
+        async with _client(asgi) as client:
+            return await client.get("/api/compatibility", params={"drug": "ibuprofen", "conditions": "Scoliosis"})
+
+    r = run(go())
+    assert r.status_code == 200
+    assert r.json()["ok"] and r.json()["input"]["drug"] == "ibuprofen"
+    assert r.headers["x-result-cache"] == "MISS"
+
+
+def test_flask_routes_are_mounted(asgi, run):
+    async def go():
+        async with _client(asgi) as client:
+            health = await client.get("/health")
+            batch = await client.post("/api/compatibility/batch", json={"drugs": ["aspirin", "loratadine"]})
+            stream = await client.get("/api/compatibility/stream", params={"drug": "cetirizine"})
+            return health, batch, stream
+
+    health, batch, stream = run(go())
+    assert health.status_code == 200
+    assert batch.status_code == 200 and batch.json()["ok"]
+    assert stream.headers["content-type"].startswith("text/event-stream")
+    assert "event: done" in stream.text
+
+
+def test_saturated_llm_routes_get_503(asgi, run):
+    async def go():
+        for _ in range(asgi.limiter.limit):
+            await asgi.limiter.acquire()
+        try:
+            async with _client(asgi) as client:
+                return (
+                    await client.get("/api/compatibility", params={"drug": "naproxen"}),
+                    await client.post("/api/compatibility/batch", json={"drugs": ["naproxen"]}),
+                    await client.get("/health"),
+                )
+        finally:
+            for _ in range(asgi.limiter.limit):
+                asgi.limiter.release()
+
+    single, batch, health = run(go())
+    assert single.status_code == 503 and single.headers["retry-after"]
+    assert batch.status_code == 503 and not batch.json()["ok"]
+    assert health.status_code == 200
+
+
+def test_disconnect_cancels_async_request(asgi, run):
+    scope = {
+        "type": "http", "method": "GET", "path": "/api/compatibility", "root_path": "",
+        "query_string": b"drug=warfarin&conditions=Gout", "headers": [], "http_version": "1.1",
+        "scheme": "http", "server": ("test", 80), "client": ("client", 1),
+    }
+    sent = []
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(LLM_LATENCY / 3)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    before = asgi.limiter.disconnected
+    run(asgi.app(scope, receive, send))
+    assert sent == []
+    assert asgi.limiter.disconnected == before + 1
+    assert asgi.limiter.inflight == 0
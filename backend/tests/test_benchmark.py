@@ -0,0 +1,52 @@
+import json
+
+import requests
+
+import benchmark
+from conftest import STUB_URL
+
+
+def test_stub_serves_recorded_labels():
+    r = requests.get(STUB_URL + "/drug/label.json", params={"search": 'openfda.generic_name:"Aspirin"', "limit": 1})
+    assert r.status_code == 200 and r.json()["results"]
+    missing = requests.get(STUB_URL + "/drug/label.json", params={"search": 'openfda.generic_name:"nodrug"'})
+    assert missing.status_code == 404 and missing.json()["error"]["code"] == "NOT_FOUND"
+
+
+def test_stub_serves_pubmed_search_and_fetch():
+    esearch = requests.get(STUB_URL + "/entrez/eutils/esearch.fcgi", params={"term": "anything"})
+    efetch = requests.get(STUB_URL + "/entrez/eutils/efetch.fcgi", params={"id": "1"})
+    assert esearch.json()["esearchresult"]["idlist"]
+    assert efetch.headers["content-type"] == "text/xml" and b"<PubmedArticle" in efetch.content
+
+
+def test_stub_chat_completion_returns_the_requested_schema():
+    body = {"model": "m", "messages": [{"role": "user", "content": "x" * 40}],
+            "response_format": {"type": "json_schema", "json_schema": {"name": "AlternativesOut"}}}
+    r = requests.post(STUB_URL + "/v1/chat/completions", json=body).json()
+    assert json.loads(r["choices"][0]["message"]["content"]) == benchmark.CANNED_OUTPUTS["AlternativesOut"]
+    assert r["usage"]["prompt_tokens"] == 10
+
+    tools = [{"type": "function", "function": {"name": "CompatibilityResult"}}]
+    r = requests.post(STUB_URL + "/v1/chat/completions", json={"messages": [], "tools": tools}).json()
+    call = r["choices"][0]["message"]["tool_calls"][0]["function"]
+    assert call["name"] == "CompatibilityResult" and json.loads(call["arguments"])["verdict"]
+
+
+def test_plan_is_reproducible_and_follows_the_mix():
+    mix = {"compatibility": 3, "batch": 1}
+    plan = benchmark.build_plan(mix, 40, seed=1)
+    assert plan == benchmark.build_plan(mix, 40, seed=1)
+    assert {name for name, *_ in plan} == {"compatibility", "batch"}
+    assert all(method == "POST" and body["drugs"] for name, method, _, body in plan if name == "batch")
+
+
+def test_report_helpers():
+    assert benchmark.parse_server_timing("label;dur=12.5, llm;dur=300, label;dur=2.5, bad") == {
+        "label": 15.0, "llm": 300.0}
+    assert benchmark.percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 3.0 and benchmark.percentile([], 0.99) == 0.0
+    samples = [("user", 0.01, True, {"db": 1.0}), ("user", 0.03, False, {"db": 3.0}), ("research", 0.5, True, {})]
+    report = benchmark.summarize(samples, wall=2.0)
+    assert report["user"]["requests"] == 2 and report["user"]["errors"] == 1
+    assert report["user"]["stages_mean_ms"] == {"db": 2.0}
+    assert report["ALL"]["throughput_rps"] == 1.5
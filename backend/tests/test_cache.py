@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+from cache import TieredCache
+
+
+def test_fresh_value_then_expiry():
+    cache = TieredCache("test_ttl", ttl=0.05)
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    time.sleep(0.06)
+    assert cache.get("k") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = TieredCache("test_lru", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get("b") is None
+
+
+def test_stale_value_is_served_while_it_refreshes():
+    cache = TieredCache("test_stale", ttl=0.05, stale_ttl=60)
+    cache.set("k", "old")
+    time.sleep(0.06)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return "new"
+
+    assert cache.get_or_load("k", loader) == "old"
+    assert refreshed.wait(1)
+    for _ in range(50):
+        if cache.get("k") == "new":
+            break
+        time.sleep(0.01)
+    assert cache.get("k") == "new"
+    assert cache.stats()["stale_hits"] == 1 and cache.stats()["refreshes"] == 1
+
+
+def test_failed_refresh_keeps_the_stale_value():
+    cache = TieredCache("test_stale_fail", ttl=0.05, stale_ttl=60)
+    cache.set("k", "old")
+    time.sleep(0.06)
+    assert cache.get_or_load("k", lambda: None) == "old"
+    for _ in range(50):
+        if cache.stats()["refreshes"]:
+            break
+        time.sleep(0.01)
+    assert cache.get_or_load("k", lambda: "unused") == "old"
+
+
+def test_negative_entries_use_the_short_ttl_and_are_never_stale():
+    cache = TieredCache("test_negative", ttl=60, stale_ttl=60, negative_ttl=0.05)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [] if len(calls) == 1 else ["label"]
+
+    assert cache.get_or_load("k", loader) == []
+    assert cache.get_or_load("k", loader) == []
+    assert cache.stats()["negative_hits"] == 1
+    time.sleep(0.06)
+    assert cache.get_or_load("k", loader) == ["label"]
+    assert len(calls) == 2
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    TieredCache("test_disk", path=path).set("k", {"v": 1})
+    other = TieredCache("test_disk", path=path)
+    assert other.get("k") == {"v": 1}
+    assert other.stats()["disk_hits"] == 1
+    assert TieredCache("test_disk_other_ns", path=path).get("k") is None
+
+
+def test_sweep_drops_expired_rows_and_caps_the_rest(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = TieredCache("test_sweep", ttl=60, negative_ttl=0.01, path=path, max_rows=2)
+    cache.set("gone", None, negative=True)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    time.sleep(0.02)
+    assert cache.sweep() == 2
+    fresh = TieredCache("test_sweep", path=path)
+    assert [fresh.get(k) for k in ("gone", "a", "b", "c")] == [None, None, "b", "c"]
+
+
+def test_async_loader_is_cached(tmp_path):
+    cache = TieredCache("test_async", path=str(tmp_path / "cache.sqlite"))
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return "value"
+
+    async def main():
+        return [await cache.aget_or_load("k", loader) for _ in range(2)] + [await cache.aget("k")]
+
+    assert asyncio.run(main()) == ["value"] * 3
+    assert len(calls) == 1
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import drug_names
+import prefetch
+from label_index import LabelIndex
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Sodium Chloride 0.9% Injectable Solution", "sodium chloride"),
+    ("Potassium Chloride 20 MEQ Extended Release Oral Tablet", "potassium chloride"),
+    ("Calcium Carbonate 500 MG Chewable Tablet", "calcium carbonate"),
+    ("Zinc sulfate 220 MG Oral Capsule", "zinc sulfate"),
+    ("zinc oxide 20% Topical Ointment", "zinc oxide"),
+    ("Lithium Carbonate 300 MG Oral Capsule", "lithium carbonate"),
+    ("Magnesium Oxide 400 MG Oral Tablet", "magnesium oxide"),
+])
+def test_salt_only_actives_keep_their_full_name(name, expected):
+    assert drug_names.normalize(name) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Naproxen sodium 220 MG Oral Tablet", "naproxen"),
+    ("Levothyroxine Sodium 0.075 MG Oral Tablet", "levothyroxine"),
+    ("Diltiazem Hydrochloride 120 MG Extended Release Oral Capsule", "diltiazem"),
+    ("Acetaminophen 325 MG / Oxycodone Hydrochloride 5 MG Oral Tablet [Percocet]", "acetaminophen and oxycodone"),
+])
+def test_salt_words_qualifying_another_active_are_stripped(name, expected):
+    assert drug_names.normalize(name) == expected
+
+
+def test_different_salts_never_share_a_key():
+    names = ["Sodium Chloride", "Potassium Chloride", "Calcium Carbonate", "Calcium Citrate",
+             "Zinc sulfate", "Zinc oxide", "Ferrous sulfate", "Sodium bicarbonate"]
+    keys = [drug_names.normalize(n) for n in names]
+    assert len(set(keys)) == len(keys)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Penicillin V Potassium 250 MG Oral Tablet", "penicillin v"),
+    ("Penicillin VK 500 MG", "penicillin v"),
+    ("penicillin G potassium 5000000 UNT Injection", "penicillin g"),
+    ("Penicillin G Benzathine 2400000 UNT/4ML Prefilled Syringe", "penicillin g benzathine"),
+    ("2 g ceftriaxone", "ceftriaxone"),
+])
+def test_penicillin_products_keep_their_own_key(name, expected):
+    assert drug_names.normalize(name) == expected
+
+
+def test_co_prescribed_names_are_canonical():
+    for generic, companions in prefetch.CO_PRESCRIBED.items():
+        assert drug_names.normalize(generic) == generic
+        for name in companions:
+            assert drug_names.normalize(name) == name
+
+
+def _label(label_id, generic):
+    return {"id": label_id, "effective_time": "20240101", "openfda": {"generic_name": [generic]},
+            "warnings": [f"{generic} warnings"]}
+
+
+def test_label_index_keeps_salt_labels_apart(tmp_path):
+    partition = tmp_path / "drug-label-0001-of-0001.json"
+    labels = [_label("nacl", "SODIUM CHLORIDE"), _label("kcl", "POTASSIUM CHLORIDE"),
+              _label("caco3", "CALCIUM CARBONATE")]
+    partition.write_text(json.dumps({"meta": {}, "results": labels}))
+    index = LabelIndex(str(tmp_path / "index.sqlite3"))
+    assert index.ingest(str(partition)) == 3
+
+    assert index.lookup("Sodium Chloride 0.9% Injectable Solution")["id"] == "nacl"
+    assert index.lookup("Potassium Chloride 20 MEQ")["id"] == "kcl"
+    assert index.lookup("calcium carbonate")["id"] == "caco3"
+    assert index.lookup("chloride") is None
+
+
+def test_label_index_rebuilds_keys_when_the_normalizer_changes(tmp_path):
+    partition = tmp_path / "drug-label-0001-of-0001.json"
+    partition.write_text(json.dumps({"meta": {}, "results": [_label("kcl", "POTASSIUM CHLORIDE")]}))
+    path = str(tmp_path / "index.sqlite3")
+    index = LabelIndex(path)
+    index.ingest(str(partition))
+    # Simulate keys written by an older normalizer
+    db = index._db()
+    db.execute("UPDATE names SET name = 'chloride'")
+    db.execute("UPDATE meta SET value = '1' WHERE key = 'normalizer'")
+
+    reopened = LabelIndex(path)
+    assert reopened.lookup("potassium chloride")["id"] == "kcl"
+    assert reopened.lookup("chloride") is None
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_client
+from http_client import TokenBucket
+
+
+def test_token_bucket_spends_its_burst_then_paces():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+@pytest.fixture
+def flaky_server():
+    """Answers 503 for the first `failures` requests of each test, then 200."""
+    state = {"failures": 2, "seen": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            state["seen"] += 1
+            status, body = (503, b"busy") if state["seen"] <= state["failures"] else (200, b"ok")
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", state
+    server.shutdown()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    up = http_client.Upstream("test", rate=1000, api_key_env="TEST_UPSTREAM_API_KEY")
+    monkeypatch.setitem(http_client.UPSTREAMS, "test", up)
+    monkeypatch.setattr(http_client, "BACKOFF", 0.001)
+    return up
+
+
+def test_get_retries_5xx_then_succeeds(flaky_server, upstream):
+    url, state = flaky_server
+    r = http_client.get("test", url)
+    assert r.status_code == 200 and state["seen"] == 3
+    stats = upstream.stats()
+    assert stats["retries"] == 2 and stats["failures"] == 0 and stats["status"] == {"503": 2, "200": 1}
+
+
+def test_get_returns_the_last_5xx_after_max_attempts(flaky_server, upstream):
+    url, state = flaky_server
+    state["failures"] = 100
+    r = http_client.get("test", url)
+    assert r.status_code == 503 and state["seen"] == http_client.MAX_ATTEMPTS
+    assert upstream.stats()["failures"] == 1
+
+
+def test_astream_retries_and_streams_the_body(flaky_server, upstream):
+    url, state = flaky_server
+
+    async def fetch():
+        async with http_client.astream("test", url) as r:
+            return r.status_code, b"".join([chunk async for chunk in r.aiter_bytes()])
+
+    assert asyncio.run(fetch()) == (200, b"ok")
+    assert upstream.stats()["retries"] == 2
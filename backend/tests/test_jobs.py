@@ -0,0 +1,39 @@
+import threading
+import time
+
+from jobs import JobQueue
+
+
+def _queues(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    return [JobQueue("research", path=path, heartbeat=0.1, stale_after=0.5) for _ in range(2)]
+
+
+def test_identical_submit_attaches_to_live_job(tmp_path):
+    owner, other = _queues(tmp_path)
+    release = threading.Event()
+    first, _ = owner.submit("k", {}, lambda meta: release.wait(2))
+    time.sleep(0.8)  # past stale_after, but the owner keeps heartbeating
+    second, attached = other.submit("k", {}, lambda meta: None)
+    release.set()
+    assert attached and second["id"] == first["id"]
+
+
+def test_stale_job_is_failed_and_rerun(tmp_path):
+    _, queue = _queues(tmp_path)
+    dead = {"id": "dead", "status": "running", "input": {}, "created_at": time.time() - 5,
+            "started_at": time.time() - 5, "heartbeat_at": time.time() - 5, "finished_at": None}
+    queue._save(dead)
+    queue.records.set("key:k", "dead")
+
+    job, attached = queue.submit("k", {}, lambda meta: "rerun")
+    assert not attached and job["id"] != "dead"
+    old = queue.get("dead")
+    assert old["status"] == "failed" and old["replaced_by"] == job["id"]
+
+
+def test_poll_reports_stale_job_failed(tmp_path):
+    _, queue = _queues(tmp_path)
+    queue._save({"id": "dead", "status": "queued", "input": {}, "created_at": time.time() - 5,
+                 "started_at": None, "heartbeat_at": time.time() - 5, "finished_at": None})
+    assert queue.get("dead")["status"] == "failed"
@@ -0,0 +1,41 @@
+from label_context import build_label_context, section_text, sentences
+from tokens import count_tokens
+
+LABEL = {
+    "label_tokens": 5000,
+    "contraindications": ["Do not use in patients with a history of asthma. Not for use in infants."],
+    "warnings": ["Stomach bleeding warning: the chance is higher if you take a blood thinner. Keep out of reach."],
+    "do_not_use": ["• right before or after heart surgery • if you have ever had an allergic reaction to aspirin"],
+    "description": ["Aspirin is an analgesic."],
+}
+
+
+def test_sentences_split_on_stops_and_bullets():
+    assert sentences("First one. Second (2) here! • bullet item • x") == [
+        "First one.", "Second (2) here!", "bullet item"]
+    assert section_text(["a", 1, "b"]) == "a b" and section_text(None) == ""
+
+
+def test_patient_matches_come_first_and_sections_keep_label_order():
+    matched = {
+        "contraindications": "Do not use in patients with a history of asthma.",
+        "warnings": "Stomach bleeding warning: the chance is higher if you take a blood thinner.",
+    }
+    # Room for exactly the two matching sentences and their section headers
+    budget = sum(count_tokens(section) + 2 + count_tokens(sentence) + 1 for section, sentence in matched.items())
+    context, stats = build_label_context(LABEL, conditions=["Childhood asthma (disorder)"],
+                                         ongoingMeds=["Warfarin (blood thinner)"], budget=budget)
+    assert context == f"CONTRAINDICATIONS: {matched['contraindications']}\n\nWARNINGS: {matched['warnings']}"
+    assert stats["sentences_kept"] == 2 and stats["sentences_total"] == 6
+    assert stats["tokens_saved"] == 5000 - stats["context_tokens"]
+
+
+def test_otc_do_not_use_section_is_kept():
+    context, stats = build_label_context(LABEL, allergies=["Aspirin"])
+    assert "allergic reaction to aspirin" in context and "do_not_use" in stats["sections"]
+
+
+def test_empty_label():
+    context, stats = build_label_context({})
+    assert context == "(no relevant FDA label sections found)"
+    assert stats["label_tokens"] is None and stats["tokens_saved"] is None
@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import zipfile
+
+import label_index
+from label_index import LabelIndex, iter_results, open_index
+
+
+def _label(label_id, generic=(), brand=(), effective_time="20240101", **sections):
+    return {"id": label_id, "effective_time": effective_time, "set_id": "unused",
+            "openfda": {"generic_name": list(generic), "brand_name": list(brand), "route": ["ORAL"]},
+            "warnings": [f"{label_id} warnings"], **sections}
+
+
+def _partition(tmp_path, name, labels):
+    path = tmp_path / name
+    path.write_text(json.dumps({"meta": {"results": {"total": len(labels)}}, "results": labels}))
+    return str(path)
+
+
+def test_results_stream_across_chunk_boundaries(monkeypatch):
+    monkeypatch.setattr(label_index, "_CHUNK", 7)
+    labels = [_label(f"id{i}", ["ASPIRIN"], description=["x" * 20, "a \"quoted\" ] } value"]) for i in range(5)]
+    text = json.dumps({"results": labels, "meta": {"disclaimer": "[not] {json}"}}, indent=1)
+    assert list(iter_results(io.StringIO(text))) == labels
+
+
+def test_lookup_prefers_generic_names_then_the_newest_label(tmp_path):
+    index = LabelIndex(str(tmp_path / "index.sqlite3"))
+    index.ingest(_partition(tmp_path, "drug-label-0001-of-0001.json", [
+        _label("old", ["IBUPROFEN"], effective_time="20200101"),
+        _label("new", ["IBUPROFEN"], effective_time="20230101"),
+        _label("brand-only", ["NAPROXEN SODIUM"], brand=["Advil"], effective_time="20250101"),
+    ]))
+    assert index.lookup("Ibuprofen 200 MG Oral Tablet")["id"] == "new"
+    assert index.lookup("Advil")["id"] == "new"
+    assert index.lookup("Aleve")["id"] == "brand-only"
+    assert index.contains("naproxen") and not index.contains("warfarin")
+    assert index.lookup("warfarin") is None
+    stats = index.stats()
+    assert (stats["hits"], stats["misses"], stats["labels"], stats["partitions"]) == (3, 1, 3, 1)
+
+
+def test_stored_records_are_slimmed(tmp_path):
+    index = LabelIndex(str(tmp_path / "index.sqlite3"))
+    index.ingest(_partition(tmp_path, "p.json", [_label("a", ["ASPIRIN"], contraindications=["Do not use."])]))
+    record = index.lookup("aspirin")
+    assert record["contraindications"] == ["Do not use."] and record["label_tokens"] > 0
+    assert "set_id" not in record and record["openfda"] == {"generic_name": ["ASPIRIN"]}
+
+
+def test_reingest_skips_unchanged_and_replaces_changed_partitions(tmp_path):
+    index = LabelIndex(str(tmp_path / "index.sqlite3"))
+    path = _partition(tmp_path, "p.json", [_label("a", ["ASPIRIN"]), _label("b", ["LORATADINE"])])
+    assert index.ingest(path) == 2
+    assert index.ingest(path) is None
+    assert index.ingest(path, force=True) == 2
+
+    _partition(tmp_path, "p.json", [_label("a", ["CETIRIZINE"])])
+    os.utime(path, (1, 1))
+    assert index.ingest(path) == 1
+    assert index.lookup("cetirizine")["id"] == "a"
+    assert index.lookup("aspirin") is None and index.lookup("loratadine") is None
+
+
+def test_zipped_partitions_are_read(tmp_path):
+    path = tmp_path / "drug-label-0001-of-0001.json.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("drug-label-0001-of-0001.json", json.dumps({"results": [_label("z", ["METFORMIN"])]}))
+    index = LabelIndex(str(tmp_path / "index.sqlite3"))
+    assert index.ingest(str(path)) == 1
+    assert index.lookup("metformin hydrochloride")["id"] == "z"
+
+
+def test_open_index_needs_a_built_file(tmp_path):
+    assert open_index("") is None
+    assert open_index(str(tmp_path / "missing.sqlite3")) is None
+    LabelIndex(str(tmp_path / "index.sqlite3"))
+    assert isinstance(open_index(str(tmp_path / "index.sqlite3")), LabelIndex)
@@ -0,0 +1,21 @@
+import app
+import metrics
+
+
+def _type_lines(text):
+    return [line for line in text.splitlines() if line.startswith("# TYPE")]
+
+
+def test_registering_a_prefix_again_replaces_it():
+    metrics.register_stats("test_source", "kind", lambda: {"a": {"size": 1}})
+    metrics.register_stats("test_source", "kind", lambda: {"a": {"size": 2}})
+    text = metrics.render()
+    assert text.count("# TYPE test_source_size gauge") == 1
+    assert 'test_source_size{kind="a"} 2' in text
+
+
+def test_two_apps_export_each_series_once():
+    app.create_app()
+    text = app.create_app().test_client().get("/metrics").get_data(as_text=True)
+    type_lines = _type_lines(text)
+    assert type_lines and len(type_lines) == len(set(type_lines))
@@ -0,0 +1,86 @@
+from patients import _Snapshot, build_profiles
+
+
+def _row(patient_id, allergies="", conditions="", meds=""):
+    return {"Patient_ID": str(patient_id), "Allergies": allergies, "Conditions": conditions,
+            "Active_Medications": meds}
+
+
+ROWS = [
+    _row(1, conditions="Childhood asthma (disorder), Viral sinusitis (disorder)"),
+    _row(2, conditions="Childhood obesity (finding), Adult-onset asthma (disorder)"),
+    _row(3, conditions="Asthma (disorder)",
+         meds="Acetaminophen 325 MG / Oxycodone Hydrochloride 5 MG Oral Tablet [Percocet]"),
+    _row(4, allergies="Tree pollen (substance), House dust mite (organism)",
+         meds="Acetaminophen 500 MG Oral Tablet, Oxycodone Hydrochloride 5 MG Oral Tablet"),
+]
+
+
+def _ids(snapshot, terms, match_all=True):
+    total, page, _ = snapshot.search(terms, match_all)
+    assert total == len(page)
+    return [p.patient_id for p in page]
+
+
+def test_multi_word_term_matches_within_one_entry():
+    snapshot = _Snapshot(ROWS, 0.0)
+    assert _ids(snapshot, [("condition", "childhood asthma")]) == [1]
+    assert _ids(snapshot, [("condition", "Childhood asthma")]) == [1]
+
+
+def test_single_word_term_matches_any_entry():
+    snapshot = _Snapshot(ROWS, 0.0)
+    assert _ids(snapshot, [("condition", "asthma")]) == [1, 2, 3]
+
+
+def test_multi_word_allergy_does_not_join_separate_entries():
+    snapshot = _Snapshot(ROWS, 0.0)
+    assert _ids(snapshot, [("allergy", "dust mite")]) == [4]
+    assert _ids(snapshot, [("allergy", "tree mite")]) == []
+
+
+def test_combination_medication_matches_the_combination_only():
+    snapshot = _Snapshot(ROWS, 0.0)
+    assert _ids(snapshot, [("medication", "Percocet")]) == [3]
+    assert _ids(snapshot, [("medication", "oxycodone")]) == [3, 4]
+
+
+def test_counts_and_any_match():
+    snapshot = _Snapshot(ROWS, 0.0)
+    total, _, counts = snapshot.search([("condition", "childhood asthma"), ("allergy", "pollen")], match_all=False)
+    assert total == 2
+    assert counts == {"condition:childhood asthma": 1, "allergy:pollen": 1}
+
+
+def test_profiles_match_build_profiles():
+    snapshot = _Snapshot(ROWS + [_row(3, conditions="None")], 0.0)
+    expected = build_profiles(ROWS + [_row(3, conditions="None")])
+    assert {pid: snapshot.profile(pid) for pid in expected} == expected
+    assert snapshot.profile(99) is None
+    # A repeated id is searchable only by its last row
+    assert _ids(snapshot, [("condition", "asthma")]) == [1, 2]
+
+
+def test_all_terms_must_match_across_fields():
+    snapshot = _Snapshot(ROWS, 0.0)
+    assert _ids(snapshot, [("condition", "asthma"), ("medication", "acetaminophen")]) == [3]
+    assert _ids(snapshot, [("condition", "asthma"), ("allergy", "pollen")]) == []
+    assert snapshot.search([]) == (0, [], {})
+
+
+def test_brand_and_generic_medication_names_share_a_key():
+    snapshot = _Snapshot(ROWS + [_row(5, meds="Pulmicort 0.25 MG/ML Inhalation Suspension")], 0.0)
+    assert _ids(snapshot, [("medication", "budesonide 0.5 MG/ML Inhalation Suspension")]) == [5]
+
+
+def test_paging_walks_matches_in_file_order():
+    rows = [_row(i, conditions="Asthma (disorder)" if i % 3 else "Gout (disorder)") for i in range(300)]
+    snapshot = _Snapshot(rows, 0.0)
+    expected = [i for i in range(300) if i % 3]
+    seen = []
+    for offset in range(0, len(expected), 70):
+        total, page, counts = snapshot.search([("condition", "asthma")], offset=offset, limit=70)
+        assert total == len(expected) and counts == {"condition:asthma": len(expected)}
+        seen += [p.patient_id for p in page]
+    assert seen == expected
+    assert snapshot.search([("condition", "asthma")], offset=len(expected))[1] == []
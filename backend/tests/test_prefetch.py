@@ -0,0 +1,38 @@
+import threading
+import time
+
+from prefetch import LabelPrefetcher
+
+
+def _wait_idle(prefetcher):
+    for _ in range(100):
+        if prefetcher.stats()["pending"] == 0:
+            return
+        time.sleep(0.01)
+
+
+def test_schedule_checks_the_cache_off_the_caller_thread():
+    checked_on, fetched = [], []
+    prefetcher = LabelPrefetcher(
+        fetch=fetched.append,
+        is_cached=lambda name: checked_on.append(threading.current_thread()) or name == "aspirin",
+        rate=1000,
+        co_prescribed=0,
+    )
+    out = prefetcher.schedule(["aspirin", "metformin"])
+    _wait_idle(prefetcher)
+
+    assert out == {"scheduled": 2, "skipped": 0}
+    assert checked_on and threading.current_thread() not in checked_on
+    assert fetched == ["metformin"]
+    assert prefetcher.stats()["already_cached"] == 1
+
+
+def test_names_already_pending_are_skipped():
+    release = threading.Event()
+    prefetcher = LabelPrefetcher(fetch=lambda name: release.wait(), is_cached=lambda name: False,
+                                 rate=1000, co_prescribed=0)
+    prefetcher.schedule(["warfarin"])
+    assert prefetcher.schedule(["warfarin"]) == {"scheduled": 0, "skipped": 1}
+    release.set()
+    _wait_idle(prefetcher)
@@ -0,0 +1,81 @@
+import pytest
+
+import prescreen
+
+NAPROXEN = {
+    "openfda": {"generic_name": ["NAPROXEN"]},
+    "contraindications": [
+        "Naproxen is contraindicated in patients with active peptic ulcer disease, "
+        "gastrointestinal bleeding or severe renal impairment."
+    ],
+}
+PROPRANOLOL = {
+    "openfda": {"generic_name": ["PROPRANOLOL HYDROCHLORIDE"]},
+    "contraindications": ["Propranolol is contraindicated in bronchial asthma."],
+}
+SELEGILINE_INTERACTION = {
+    "openfda": {"generic_name": ["DEXTROMETHORPHAN HYDROBROMIDE"]},
+    "do_not_use": [
+        "Do not use if you are now taking a prescription monoamine oxidase inhibitor (MAOI)."
+    ],
+}
+METFORMIN = {
+    "openfda": {"generic_name": ["METFORMIN HYDROCHLORIDE"]},
+    "contraindications": ["Metformin is contraindicated in patients with renal impairment."],
+}
+
+
+def _screen(drug, label, allergies=(), conditions=(), meds=()):
+    return prescreen.screen(drug, label, list(allergies), list(conditions), list(meds))
+
+
+@pytest.mark.parametrize("condition", [
+    "Pressure ulcer (disorder)",
+    "Venous leg ulcer (disorder)",
+    "Kidney stone (disorder)",
+    "Chronic kidney disease stage 1 (disorder)",
+    "Peptic ulcer (disorder)",
+])
+def test_qualified_or_different_concepts_go_to_the_llm(condition):
+    assert _screen("naproxen", NAPROXEN, conditions=[condition]) is None
+
+
+def test_history_of_condition_is_not_a_current_condition():
+    assert _screen("metformin", METFORMIN, conditions=["History of renal failure (situation)"]) is None
+
+
+def test_unqualified_condition_contraindication_is_decided():
+    verdict = _screen("propranolol", PROPRANOLOL, conditions=["Childhood asthma (disorder)"])
+    assert verdict is not None
+    assert verdict.rule == "contraindicated_condition"
+    assert verdict.verdict == "STRONGLY ADVISE AGAINST"
+
+
+def test_renal_impairment_matches_chronic_kidney_disease():
+    verdict = _screen("metformin", METFORMIN, conditions=["Chronic kidney disease stage 3 (disorder)"])
+    assert verdict is not None and verdict.rule == "contraindicated_condition"
+
+
+def test_kidney_stone_is_not_renal_impairment():
+    assert _screen("metformin", METFORMIN, conditions=["Kidney stone (disorder)"]) is None
+
+
+def test_medication_do_not_use_is_decided():
+    verdict = _screen("dextromethorphan", SELEGILINE_INTERACTION, meds=["selegiline 5 MG Oral Capsule"])
+    assert verdict is not None and verdict.rule == "contraindicated_medication"
+
+
+def test_allergy_to_class_is_decided():
+    verdict = _screen("amoxicillin", {}, allergies=["Penicillin V"])
+    assert verdict is not None and verdict.rule == "allergy_class"
+
+
+def test_penicillin_allergy_covers_every_penicillin_product():
+    for drug in ("Penicillin V Potassium 250 MG Oral Tablet", "penicillin g benzathine"):
+        verdict = _screen(drug, {}, allergies=["Penicillin"])
+        assert verdict is not None and verdict.rule == "allergy_class"
+    assert _screen("penicillin v", {}, allergies=["Penicillin G"]).rule == "allergy_class"
+
+
+def test_unrelated_patient_goes_to_the_llm():
+    assert _screen("naproxen", NAPROXEN, allergies=["Grass pollen"], conditions=["Viral sinusitis"]) is None
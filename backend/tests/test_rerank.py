@@ -0,0 +1,56 @@
+import rerank
+from tokens import count_tokens
+
+
+def _article(pmid, title, abstract="", types=(), pubdate="2015"):
+    return {"pmid": pmid, "title": title, "abstract": abstract, "publication_types": list(types),
+            "pubdate": pubdate, "citation": f"J Test. {pubdate}.", "url": f"https://pubmed.example/{pmid}"}
+
+
+def test_current_option_counts_half():
+    weights = rerank.query_weights("penicillin allergy", current_option="amoxicillin", search_hint="cephalosporin")
+    assert weights == {"penicillin": 1.0, "allergy": 1.0, "cephalosporin": 1.0, "amoxicillin": 0.5}
+
+
+def test_relevant_articles_rank_first():
+    articles = [
+        _article("1", "Statin adherence in older adults"),
+        _article("2", "Cephalosporin use after penicillin allergy", "Cephalosporins were tolerated."),
+        _article("3", "Penicillin allergy labels"),
+    ]
+    ranked = rerank.rank(articles, rerank.query_weights("penicillin allergy cephalosporin"))
+    assert [a["pmid"] for _, a in ranked] == ["2", "3", "1"]
+
+
+def test_publication_type_and_recency_break_relevance_ties():
+    articles = [
+        _article("old", "Penicillin allergy", pubdate="1990"),
+        _article("case", "Penicillin allergy", types=["Case Reports"]),
+        _article("meta", "Penicillin allergy", types=["Meta-Analysis"]),
+        _article("new", "Penicillin allergy", pubdate="2024"),
+        _article("retracted", "Penicillin allergy", types=["Retracted Publication"]),
+    ]
+    ranked = rerank.rank(articles, rerank.query_weights("penicillin allergy"))
+    assert [a["pmid"] for _, a in ranked] == ["meta", "new", "old", "case"]
+
+
+def test_evidence_keeps_the_best_sentences_within_budget():
+    abstract = (
+        "Background sentence about hospital logistics and staffing levels. "
+        "Cephalosporins were safe in patients with penicillin allergy. "
+        "Funding came from a national grant."
+    )
+    articles = [_article("1", "Cephalosporins in penicillin allergy", abstract), _article("2", "Unrelated statins")]
+    best = "Cephalosporins were safe in patients with penicillin allergy."
+    # Room for the header and the best sentence only
+    budget = count_tokens(rerank._header(articles[0])) + 2 + count_tokens(best) + 1
+    block, chosen, stats = rerank.build_evidence(articles, "penicillin allergy", search_hint="cephalosporin",
+                                                 k=1, budget=budget)
+    assert [a["pmid"] for a in chosen] == ["1"]
+    assert f"\n  … {best} …\n" in block
+    assert stats["sentences_kept"] == 1 and stats["sentences_total"] == 3
+
+
+def test_no_candidates():
+    block, chosen, stats = rerank.build_evidence([], "penicillin allergy")
+    assert block == "(no articles found)" and chosen == [] and stats["articles"] == 0
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+import research_agent
+from research_agent import SearchResult
+
+
+@pytest.fixture
+def ncbi(monkeypatch):
+    """Fake esearch: queries in `hits` return a PMID, queries in `down` fail; every query is recorded."""
+    state = {"hits": set(), "down": set(), "calls": []}
+
+    async def search(query, retmax=5):
+        state["calls"].append(query)
+        if query in state["down"]:
+            raise RuntimeError("NCBI unavailable")
+        return SearchResult(query=query, pmids=["1"] if query in state["hits"] else [])
+
+    monkeypatch.setattr(research_agent, "apubmed_search", search)
+    return state
+
+
+def test_primary_hit_runs_one_search(ncbi):
+    ncbi["hits"] = {"warfarin; (bleeding)", "warfarin"}
+    result = asyncio.run(research_agent.asearch_with_fallbacks("warfarin; (bleeding)"))
+    assert result.query == "warfarin; (bleeding)"
+    assert ncbi["calls"] == ["warfarin; (bleeding)"]
+
+
+def test_miss_falls_back_to_the_most_specific_variant_with_hits(ncbi):
+    ncbi["hits"] = {"statin", "statin myopathy"}
+    ncbi["down"] = {"statin; (myopathy)"}
+    result = asyncio.run(research_agent.asearch_with_fallbacks("statin; (myopathy)"))
+    assert result.query == "statin"
+    assert sorted(ncbi["calls"]) == ["statin", "statin myopathy", "statin; (myopathy)"]
+
+
+def test_every_variant_failing_raises(ncbi):
+    ncbi["down"] = set(research_agent.query_variants("statin; (myopathy)"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(research_agent.asearch_with_fallbacks("statin; (myopathy)"))
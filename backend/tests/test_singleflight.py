@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import Group
+
+
+def test_concurrent_callers_share_one_call():
+    group = Group("test_do")
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {value for value, _ in results} == {"value"}
+    assert group.stats()["in_flight"] == 0
+
+
+def test_error_is_shared_and_nothing_is_remembered():
+    group = Group("test_errors")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("upstream down")
+
+    errors = []
+
+    def follow():
+        started.wait()
+        try:
+            group.do("k", lambda: "unused")
+        except ValueError as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    with pytest.raises(ValueError):
+        group.do("k", fail)
+    follower.join()
+
+    assert len(errors) == 1 and group.stats()["shared_errors"] == 1
+    assert group.do("k", lambda: "fresh") == ("fresh", False)
+
+
+def test_do_many_joins_calls_in_flight_and_leads_the_rest():
+    group = Group("test_do_many")
+    release = threading.Event()
+    single = []
+    thread = threading.Thread(target=lambda: single.append(group.do("a", lambda: release.wait() and "A")))
+    thread.start()
+    time.sleep(0.05)
+
+    batches = []
+
+    def fn(keys):
+        batches.append(keys)
+        release.set()
+        return [key.upper() if key != "c" else RuntimeError("bad") for key in keys]
+
+    out = group.do_many(["a", "b", "b", "c"], fn)
+    thread.join()
+
+    assert batches == [["b", "c"]]
+    assert out[0] == ("A", True)
+    assert out[1] == ("B", False) and out[2] == ("B", True)
+    assert isinstance(out[3][0], RuntimeError) and out[3][1] is False
+    assert single == [("A", False)]
+
+
+def test_async_callers_share_one_task():
+    group = Group("test_ado")
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(group.ado("k", slow) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [shared for _, shared in results] == [False, True, True]
@@ -0,0 +1,35 @@
+"""
+Token counting for prompt budgets, measured with the model's tiktoken encoding.
+"""
+import threading
+from typing import Optional
+
+MODEL = "gpt-4o-mini"
+
+_encoding = None
+_encoding_failed = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.encoding_for_model(MODEL)
+                except Exception as e:
+                    # tiktoken downloads its BPE files on first use; without network we estimate
+                    print(f"tiktoken encoding for {MODEL} unavailable ({e}); estimating tokens from length")
+                    _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))